@@ -1,174 +1,180 @@
-import sqlite3
-import re
-import tabula
-import csv
-from datetime import datetime
+import os
+import sys
+import threading
+import time
+
+# stockchecker_core is shared with the other front-end, one folder up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from stockchecker_core import instrumentation  # noqa: E402
+from stockchecker_core.batch import (NOT_ON_ORDER_POLICIES, SCAN_BATCH_SIZE, UNKNOWN_POLICIES,  # noqa: E402
+                                     ScanRejected, scan_lines)
+from stockchecker_core.output import OUTPUT_FORMATS, output_format, write_pages  # noqa: E402
+from stockchecker_core.pdf_import import (OrderPDF, import_pdfs, prewarm, print_order_lines,  # noqa: E402
+                                          print_timings)
+from stockchecker_core.storage import (BARCODE_DATABASE_EXTENSION, BARCODE_FILE_EXTENSIONS, DATABASE_FILE,  # noqa: E402
+                                       REPORT_PAGE_SIZE, Storage)
+from stockchecker_core.validation import pn_regex_check  # noqa: E402
+
+# Rows printed before asking whether to show more
+TERMINAL_PAGE_SIZE = 40
+
+
+def load_barcodes(db):
+    """
+    Bulk imports a CSV of barcodes (barcode, product code, last update, primary code) into the database
+    Gzipped CSV (.csv.gz) and barcode databases written by export barcodes (.sqlite) can be imported too
+    Barcodes that already exist in the database are skipped, rows with missing columns are rejected
+    :param db: Storage
+    :return:
+    """
+    barcodes_file = input("CSV Filename:")
+    try:
+        inserted, skipped, rejected = db.load_barcodes(barcodes_file)
+        print(inserted, "barcodes added,", skipped, "already in database,", rejected, "rejected.")
+    except FileNotFoundError as e:
+        print("File does not exist:", e)
 
 
-def connect_db(sqlite_file):
+def export_barcodes(db):
     """
-    Connect to database
-    :param sqlite_file: filename of sqlite database
-    :return: conn (sqlite connection), c (cursor)
+    Exports every barcode in the database to a CSV (.csv), gzipped CSV (.csv.gz) or barcode database (.sqlite) file
+    :param db: Storage
+    :return:
     """
-    conn = sqlite3.connect(sqlite_file)
-    c = conn.cursor()
-    return conn, c
+    barcodes_file = input("Export Filename (.csv, .csv.gz or .sqlite):")
+    if not barcodes_file.endswith(BARCODE_FILE_EXTENSIONS):
+        barcodes_file += ".csv"
+    start = time.perf_counter()
+    try:
+        written = db.export_barcodes(barcodes_file)
+    except OSError as e:
+        print("Unable to write file:", e)
+        return
+    elapsed = time.perf_counter() - start
+    print(written, "barcodes exported to", barcodes_file, "in {:.2f}s".format(elapsed))
 
 
-def close_db(conn):
+def export_changes(db):
     """
-    Commit all changes to database and close connection
-    :param conn: sqlite connection
+    Exports the barcodes added, changed or removed since the last export to a station to a barcode database (.sqlite)
+    The first export to a station holds every barcode
+    :param db: Storage
     :return:
     """
-    conn.commit()
-    conn.close()
-
-
-def initialise_db(c, conn):
-    # check if db exists, if so, warn user then abort
-    c.execute('CREATE TABLE products('
-              'barcode TEXT, '
-              'product_code TEXT, '
-              'last_update NUMERIC, '
-              'primary_code NUMERIC, '
-              'PRIMARY KEY (barcode))')
-    c.execute('CREATE TABLE orders('
-              'order_number INTEGER, '
-              'internal_reference TEXT, '
-              'PRIMARY KEY(order_number))')
-    c.execute('CREATE TABLE scanned_products('
-              'order_number INTEGER, '
-              'product_code TEXT, '
-              'expected_quantity INTEGER, '
-              'scanned_quantity INTEGER, '
-              'PRIMARY KEY (order_number, product_code), '
-              'FOREIGN KEY (order_number) REFERENCES orders(order_number)'
-              'ON DELETE CASCADE)')
-    conn.commit()
-
-
-def load_barcodes(c,conn):
-    barcodes_file = input("CSV Filename:")
+    station = input("Station Name:")
+    if not station:
+        print("Station name is required")
+        return
+    changes_file = input("Export Filename (.sqlite):")
+    if not changes_file.endswith(BARCODE_DATABASE_EXTENSION):
+        changes_file += BARCODE_DATABASE_EXTENSION
+    try:
+        changed, removed = db.export_barcode_changes(changes_file, station)
+    except OSError as e:
+        print("Unable to write file:", e)
+        return
+    print(changed, "barcodes changed,", removed, "removed since the last export to", station)
+
+
+def load_changes(db):
+    """
+    Merges barcode changes exported by export changes on another station
+    :param db: Storage
+    :return:
+    """
+    changes_file = input("Changes Filename:")
     try:
-        with open(barcodes_file) as csvfile:
-            readCSV = csv.reader(csvfile, delimiter=',')
-            for row in readCSV:
-                c.execute("SELECT count(*) "
-                          "FROM products "
-                          "WHERE barcode = ?",
-                          (row[0],))
-                if c.fetchone()[0] == 0:
-                    c.execute("INSERT INTO products "
-                              "VALUES(?,?,?,?)",
-                              (row[0], row[1], row[2], row[3]))
-        conn.commit()
+        changed, removed = db.load_barcode_changes(changes_file)
+        print(changed, "barcodes added or changed,", removed, "removed.")
     except FileNotFoundError as e:
         print("File does not exist:", e)
 
 
-def load_pdf(c, conn):
+def load_pdf(db):
     """
     Parses Order PDF and feeds data into the database
-    :param c: sqlite cursor
-    :param conn: sqlite connection
+    :param db: Storage
     :return:
     """
     pdf_name = input("PDF Filename:")
     try:
-        order_num = None
-        df_on = tabula.read_pdf(pdf_name, pages="1", area=[[40, 20, 535, 800]],
-                                columns=[100, 210, 265, 325, 365, 440, 530, 590, 660, 710, 750, 800])
-        for index, row in df_on.iterrows():
-            if row[0] == "Customer Ord":
-                print("Customer Order Number:", row[1], "Delivery Reference Number:", row[3])
-                order_num = row[1]
-                # check if exists in db, give user option to cancel
-                c.execute("SELECT count(*) "
-                          "FROM orders "
-                          "WHERE order_number = ?",
-                          (order_num,))
-                if c.fetchone()[0] != 0:
-                    print("Order", order_num, "already exists in database.")
-                    while True:
-                        confirmation = input("Continue to add products for scanning (y/n)?")
-                        if confirmation == "n" or confirmation == "no" or confirmation == "back":
-                            return
-                        elif confirmation == "y" or confirmation == "yes":
-                            break
-                        else:
-                            print("Invalid input, try again.")
-                c.execute("INSERT INTO orders "
-                          "VALUES(?,?)",
-                          (row[1], row[3]))
-                break
-
-        df_pd = tabula.read_pdf(pdf_name, pages="all", area=[[40, 20, 535, 800]],
-                                columns=[50, 160, 525, 600, 665, 700, 860])
-        df_pd = df_pd.astype(str)
-        header = ["Line", "Product Code", "Supplied Quantity"]
-        row_format = "{:15}" * (len(header))
-        print(row_format.format(*header))
-        for index, row in df_pd.iterrows():
-            if pn_regex_check(row[1]):
-                print(row_format.format(row[0], row[1], row[4]))
-                try:
-                    quantity = int(row[4])
-                except ValueError:
-                    quantity = 0
-                c.execute("SELECT count(*), expected_quantity "
-                          "FROM scanned_products "
-                          "WHERE order_number = ? AND product_code = ?",
-                          (order_num, row[1]))
-                rdata = c.fetchone()
-                if rdata[0] != 0:
-                    while True:
-                        confirmation = input("Product already exists on order. "
-                                             "Add quantity to supplied quantity? (y/n)?")
-                        if confirmation == "n" or confirmation == "no" or confirmation == "back":
-                            break
-                        elif confirmation == "y" or confirmation == "yes":
-                            c.execute("UPDATE scanned_products "
-                                      "SET expected_quantity = ?"
-                                      "WHERE order_number = ? AND product_code = ?",
-                                      (rdata[1] + quantity, order_num, row[1]))
-                            break
-                        else:
-                            print("Invalid input, try again.")
+        order_pdf = OrderPDF(pdf_name, db.sqlite_file)
+        order_num = order_pdf.order_number
+        if order_num is None:
+            print("Customer Order Number not found in PDF.")
+            return
+        print("Customer Order Number:", order_num, "Delivery Reference Number:", order_pdf.delivery_reference)
+        # check if exists in db, give user option to cancel
+        exists = db.order_exists(order_num)
+        if exists:
+            print("Order", order_num, "already exists in database.")
+            while True:
+                confirmation = input("Continue to add products for scanning (y/n)?")
+                if confirmation == "n" or confirmation == "no" or confirmation == "back":
+                    return
+                elif confirmation == "y" or confirmation == "yes":
+                    break
                 else:
-                    c.execute("INSERT INTO scanned_products "
-                              "VALUES(?,?,?,0)",
-                              (order_num, row[1], quantity))
-        conn.commit()
+                    print("Invalid input, try again.")
+
+        # parsed before the order is written, so a PDF that fails to parse adds nothing and the write lock isn't
+        # held while tabula runs
+        lines = order_pdf.read_lines()
+        start = time.perf_counter()
+        if not exists:
+            db.add_order(order_num, order_pdf.delivery_reference)
+        print_order_lines(lines)
+        existing = db.order_product_codes(order_num)
+        add_existing = False
+        if any(product_code in existing for product_code, quantity in lines):
+            while True:
+                confirmation = input("Some products already exist on order. "
+                                     "Add quantities to supplied quantities? (y/n)?")
+                if confirmation == "n" or confirmation == "no" or confirmation == "back":
+                    break
+                elif confirmation == "y" or confirmation == "yes":
+                    add_existing = True
+                    break
+                else:
+                    print("Invalid input, try again.")
+        db.add_order_lines(order_num, lines, add_existing)
+        db.commit()
+        order_pdf.timings['database'] = time.perf_counter() - start
+        print_timings(order_pdf.timings)
+        instrumentation.record_timings('pdf.', order_pdf.timings)
     except FileNotFoundError as e:
         print("File does not exist:", e)
 
 
+def load_pdf_folder(db):
+    """
+    Batch imports every order PDF in a folder
+    :param db: Storage
+    :return:
+    """
+    folder = input("PDF Folder:")
+    try:
+        pdf_names = sorted(os.path.join(folder, name) for name in os.listdir(folder) if name.lower().endswith('.pdf'))
+    except FileNotFoundError as e:
+        print("Folder does not exist:", e)
+        return
+    if not pdf_names:
+        print("No PDFs found in", folder)
+        return
+    import_pdfs(db, pdf_names)
 
-def add_barcode(c, conn):
+
+def add_barcode(db):
     """
     Add a barcode linked to a product to the database
-    :param c: sqlite cursor
-    :param conn: sqlite connection
+    :param db: Storage
     :return:
     """
     # read input, check if barcode exists, if yes abort
     barcode = input('Input Barcode: ')
-    c.execute("SELECT count(*) "
-              "FROM products "
-              "WHERE barcode = ?",
-              (barcode,))
-    count = c.fetchone()[0]
-    if count == 0:
+    if not db.barcode_exists(barcode):
         product_code = input('Product Code: ')
-        if pn_regex_check(product_code) is True:
-            # valid product code, insert to db
-            current_date = datetime.now().strftime("%d/%m/%Y")
-            c.execute("INSERT INTO products "
-                      "VALUES (?,?,?,'false')",
-                      (barcode, product_code.upper(), current_date,))
-            conn.commit()
+        if db.add_barcode(barcode, product_code):
             print(product_code.upper(), 'added to database.')
         else:
             print("Invalid product code. Must be 2 letters followed by 4 numbers.")
@@ -176,201 +182,207 @@ def add_barcode(c, conn):
         print('Barcode already exists in system.')
 
 
-def remove_barcode(c, conn):
+def remove_barcode(db):
     """
     Remove a barcode linked to a product to the database
-    :param c: sqlite cursor
-    :param conn: sqlite connection
+    :param db: Storage
     :return:
     """
     barcode = input('Input Barcode: ')
-    c.execute("SELECT count(*) "
-              "FROM products "
-              "WHERE barcode = ?",
-              (barcode,))
-    count = c.fetchone()[0]
-    if count != 0:
-        c.execute('DELETE FROM products '
-                  'WHERE barcode = ?',
-                  (barcode,))
-        conn.commit()
+    if db.remove_barcode(barcode):
         print('Barcode has been removed from database.')
     else:
         print('Barcode is not in the database. Unable to remove')
 
 
-def validate_order_input(c):
+def validate_order_input(db):
     """
     Checks if user input is a valid delivery reference (e.g. SJ532017) or a valid customer order number (e.g. 40408133)
     It is valid if it exists in the database
-    :param c: sqlite cursor
+    :param db: Storage
     :return: returns None if the user wants to go back to the main menu, otherwise returns the customer order number
     """
     while True:
         ref = input('Input Delivery Reference or Customer Order Number:')
         if ref == "exit" or ref == "back":
             return None
-        c.execute("SELECT count(*) "
-                  "FROM orders "
-                  "WHERE internal_reference = ?",
-                  (ref,))
-        internal_ref_count = c.fetchone()
-        if internal_ref_count[0] > 1:
+        order_numbers = db.resolve_order(ref)
+        if len(order_numbers) > 1:
             print("Delivery Reference is linked to multiple orders, try again with Customer Order Number")
-        elif internal_ref_count[0] == 0:
-            c.execute("SELECT count(*) "
-                      "FROM orders "
-                      "WHERE order_number= ?", (ref,))
-            if c.fetchone()[0] != 0:
-                break
-            else:
-                print("Order number does not exist in system, try again.")
+        elif not order_numbers:
+            print("Order number does not exist in system, try again.")
+            matches = db.search_orders(ref)
+            if matches:
+                print("Did you mean:", ", ".join("{} ({})".format(delivery_ref, order_number)
+                                                 for order_number, delivery_ref in matches))
         else:
-            c.execute("SELECT order_number "
-                      "FROM orders "
-                      "WHERE internal_reference = ?", (ref,))
-            ref = c.fetchone()[0]
-            break
-    return ref
+            return order_numbers[0]
 
 
-def check_order(c):
+def check_order(db):
     """
     Print off a report of a specific order
-    :param c: sqlite cursor
+    :param db: Storage
     :return:
     """
-    order_num = validate_order_input(c)
+    order_num = validate_order_input(db)
     if order_num is not None:
-        print_report(c, order_num)
+        print_report(db, order_num)
 
 
-def scan_order(c, conn):
+def scan_order(db):
     """
     Function for stock checking
     User will either scan barcodes (increments scanned quantity by 1) or manually inputting a product code and quantity
-    :param c: sqlite cursor
-    :param conn: sqlite connection
+    Entering undo cancels the last scan, undo 3 the last three
+    :param db: Storage
     :return:
     """
-    order_num = validate_order_input(c)
+    order_num = validate_order_input(db)
     if order_num is None:
         print("Order does not exist in database.")
         return
+    session = db.scan_session(order_num)
     while True:
         input_code = input('Barcode or Product Code:')
         if input_code == "finish" or input_code == "end":
             break
-        # Check if input a valid barcode in the database
-        c.execute("SELECT product_code "
-                  "FROM products "
-                  "WHERE barcode = ?",
-                  (input_code,))
-        product_code = c.fetchone()
+        if input_code == "undo" or input_code.startswith("undo "):
+            undo_scans(session, input_code[len("undo"):].strip() or "1")
+            continue
+        # Check if input a valid barcode in the database, scanned barcodes count as 1
+        product_code = db.lookup_barcode(input_code)
+        quantity = 1
         # If input is not barcode in database, then go through steps to check if it is a valid product code input
         if product_code is None:
-            input_code = input_code.upper()
-            if pn_regex_check(input_code) is False:
+            product_code = input_code.upper()
+            if pn_regex_check(product_code) is False:
                 print("ERROR: Barcode does not exist in database or "
                       "Product Code is invalid formatting (2 letters, 4 digits).")
                 continue
-            # Check if product code exists on order
-            c.execute("SELECT count(*), scanned_quantity "
-                      "FROM scanned_products "
-                      "WHERE order_number = ? "
-                      "AND product_code = ?",
-                      (order_num, input_code,))
-            on_order = c.fetchone()
-            # If product code does not exist on the order, ask user if they want to force add
-            if on_order[0] == 0:
-                while True:
-                    add_to_order = input(input_code + " is not on the order list. Force add to order (y/n)?")
-                    if add_to_order == "y" or add_to_order == "yes":
-                        quantity = get_quantity()
-                        if quantity is None:
-                            break
-                        else:
-                            c.execute("INSERT INTO scanned_products "
-                                      "VALUES(?,?,0,?)",
-                                      (order_num, input_code, quantity,))
-                            break
-                    elif add_to_order == "n" or add_to_order == "no":
-                        break
-                    else:
-                        print("Try again, valid input is 'y' or 'n'")
-            # If product code does exists on the order, ask user what quantity they want to add
-            else:
+            quantity = None
+        # If product code does not exist on the order, ask user if they want to force add
+        if not session.is_on_order(product_code):
+            while True:
+                add_to_order = input(product_code + " is not on the order list. Force add to order (y/n)?")
+                if add_to_order == "y" or add_to_order == "yes":
+                    quantity = get_quantity()
+                    if quantity is not None:
+                        session.add_product(product_code, quantity)
+                    break
+                elif add_to_order == "n" or add_to_order == "no":
+                    break
+                else:
+                    print("Try again, valid input is 'y' or 'n'")
+        # If product code does exists on the order, ask user what quantity they want to add
+        else:
+            if quantity is None:
                 quantity = get_quantity()
                 if quantity is None:
                     continue
-                else:
-                    c.execute("UPDATE scanned_products "
-                              "SET scanned_quantity = ? "
-                              "WHERE order_number = ? AND product_code = ?",
-                              (quantity + on_order[1], order_num, input_code,))
-        else:
-            c.execute("SELECT scanned_quantity "
-                      "FROM scanned_products "
-                      "WHERE product_code = ?",
-                      (product_code[0],))
-            s_quantity = c.fetchone()
-            c.execute("UPDATE scanned_products "
-                      "SET scanned_quantity = ? "
-                      "WHERE order_number = ? AND product_code = ?",
-                      (s_quantity[0]+1, order_num, product_code[0],))
-        conn.commit()
-        # Print updated quantity for product code just inputted
-    print_report(c, order_num)
-
-
-def print_report(c, order_number):
+            session.scan(product_code, quantity)
+    session.finish()
+    # Print updated quantities for the order
+    print_report(db, order_num)
+
+
+def undo_scans(session, count):
+    """
+    Cancels the last scans made on this station in the scan session
+    :param session: ScanSession
+    :param count: number of scans to undo, as entered
+    :return:
+    """
+    if not count.isdigit() or int(count) == 0:
+        print("ERROR: enter undo, or undo followed by the number of scans to undo.")
+        return
+    undone = session.undo(int(count))
+    if not undone:
+        print("No scans to undo.")
+    for product_code, scanned_quantity in undone:
+        print("Undone scan of", product_code + ", scanned quantity is now", scanned_quantity)
+
+
+def scan_history(db):
+    """
+    Prints the most recent scans of an order, with the station and time they were made
+    :param db: Storage
+    :return:
+    """
+    order_number = validate_order_input(db)
+    if order_number is None:
+        print("Order does not exist in database.")
+        return
+    row_format = "{:>8}{:>15}{:>10}{:>20}{:>22}{:>10}"
+    print(row_format.format("Event", "Product Code", "Quantity", "Station", "Scanned At (UTC)", "Undoes"))
+    for row in db.scan_events(order_number, limit=20):
+        print(row_format.format(*["" if value is None else value for value in row]))
+
+
+def replay_scans(db):
+    """
+    Rebuilds the scanned quantities of every order from the scan event log, printing any line that was corrected
+    :param db: Storage
+    :return:
+    """
+    corrections = db.replay_scans()
+    for order_number, product_code, before, after in corrections:
+        print("Order", order_number, product_code + ": scanned quantity", before, "corrected to", after)
+    print(len(corrections), "lines corrected.")
+
+
+def print_report(db, order_number):
     """
     Prints out all the data associated with a specific order number
-    Also calculates the difference between expected and scanned quantities to see if any stock is missing
-    :param c: cursor for sqlite3
+    Also shows the difference between expected and scanned quantities to see if any stock is missing
+    :param db: Storage
     :param order_number: the customer order number to print out from the database
     :return:
     """
-    c.execute("SELECT product_code, expected_quantity, scanned_quantity "
-              "FROM scanned_products "
-              "WHERE order_number = ? "
-              "ORDER BY product_code ASC", (order_number,))
-    data = c.fetchall()
     header = ["Product Code", "Expected Quantity", "Scanned Quantity", "Difference"]
-    row_format = "{:^20}" * (len(header))
-    print(row_format.format(*header))
-    for row in data:
-        dif = row[2] - row[1]
-        print(row_format.format(*row, dif))
+    write_pages(db.order_line_pages(order_number), header, sys.stdout)
+    lines, lines_matched, units_short, units_over = db.order_summary(order_number)
+    print(lines_matched, "of", lines, "lines match,", units_short, "units short,", units_over, "units over.")
 
 
-def print_productsdb(c):
+def print_productsdb(db):
     """
-    Prints out all products that are linked to a barcode in the database
-    :param c: cursor for sqlite3
+    Prints out, or saves, the products that are linked to a barcode in the database
+    :param db: Storage
     :return:
     """
-    c.execute("SELECT * FROM products ORDER BY product_code ASC")
-    data = c.fetchall()
+    prefix = input("Product Code starts with (blank for all):")
     header = ["Barcode", "Product Code", "Last Update", "Primary Code"]
-    row_format = "{:^35}" * (len(header))
-    print(row_format.format(*header))
-    for row in data:
-        print(row_format.format(*row))
+    print_or_save(header, lambda page_size: db.product_pages(prefix, page_size), column_width=35)
+
 
+def more_rows():
+    return input("-- Enter for more, q to stop --") != "q"
 
-def pn_regex_check(p_code):
+
+def print_or_save(header, pages, column_width=20):
     """
-    Verify that the provided string uses the valid formatting for a product code
-    Formatting is 2 letters followed by 4 numbers
-    :param p_code: string to validate
-    :return: boolean (True or False)
+    Asks for a file to save a listing to, otherwise prints it a page at a time
+    :param header: column titles
+    :param pages: function(page size) returning the pages of rows of the listing
+    :param column_width: width of the printed columns
+    :return:
     """
-    regex = re.compile("^[a-zA-Z]{2}[0-9]{4}$")
-    if regex.match(p_code):
-        return True
-    else:
-        return False
+    filename = input("Output Filename (blank to print, " + " or ".join(OUTPUT_FORMATS) + " to save):")
+    if not filename:
+        write_pages(pages(TERMINAL_PAGE_SIZE), header, sys.stdout, column_width=column_width, more=more_rows)
+        return
+    fmt = output_format(filename)
+    if fmt is None:
+        print("Output Filename must end in", " or ".join(OUTPUT_FORMATS))
+        return
+    try:
+        with open(filename, 'w', newline="") as output_file:
+            written = write_pages(pages(REPORT_PAGE_SIZE), header, output_file, fmt)
+    except OSError as e:
+        print("Unable to write file:", e)
+        return
+    print(written, "rows saved to", filename)
 
 
 def get_quantity():
@@ -391,38 +403,26 @@ def get_quantity():
             return None
 
 
-def remove_order(c, conn):
+def remove_order(db):
     """
     Removes specified order from the database
-    :param c: cursor for sqlite3
-    :param conn: sqlite3 connection
+    :param db: Storage
     :return:
     """
     order_number = input("Input Customer Order Number to delete from database:")
-    c.execute("SELECT count(*) "
-              "FROM orders "
-              "WHERE order_number = ?", (order_number,))
-    if c.fetchone()[0] != 0:
-        c.execute("DELETE FROM orders "
-                  "WHERE order_number = ?", (order_number,))
-        conn.commit()
-    else:
+    if not db.remove_order(order_number):
         print("Order number does not exist in system.")
 
 
-def adj_supplied_quantity(c, conn):
+def adj_supplied_quantity(db):
     """
     Adjusts the supplied quantity if the product exists on the order, or adds the product to the order list if it
     doesn't exist on the order (and the user confirms)
-    :param c: cursor for sqlite3
-    :param conn:  sqlite connection
+    :param db: Storage
     :return:
     """
     order_number = input("Input Customer Order Number:")
-    c.execute("SELECT count(*) "
-              "FROM orders "
-              "WHERE order_number = ?", (order_number,))
-    if c.fetchone()[0] != 0:
+    if db.order_exists(order_number):
         prod_c = input("Product number to amend:")
         if pn_regex_check(prod_c):
             try:
@@ -430,77 +430,426 @@ def adj_supplied_quantity(c, conn):
             except ValueError:
                 print("Invalid input (not integer). Back to main menu.")
                 return
-            c.execute("SELECT count(*), expected_quantity "
-                      "FROM scanned_products "
-                      "WHERE order_number = ? AND product_code = ?", (order_number, prod_c,))
-            if c.fetchone()[0] != 0:
-                c.execute("UPDATE scanned_products "
-                          "SET expected_quantity = ? "
-                          "WHERE order_number = ? AND product_code = ?", (quantity, order_number, prod_c,))
-            else:
+            if not db.is_on_order(order_number, prod_c):
                 conf = input("Product is not on order. Add to order (y to confirm, anything else for no)?")
-                if conf == "y" or conf == "yes":
-                    c.execute("INSERT INTO scanned_products "
-                              "VALUES(?,?,?,0)", (order_number, prod_c, quantity,))
-                else:
+                if conf != "y" and conf != "yes":
                     return
-            conn.commit()
+            db.set_expected_quantity(order_number, prod_c, quantity)
         else:
             print("Invalid product number. Back to main menu.")
     else:
         print("Order number does not exist in system.")
 
 
-def list_orders(c):
+def list_orders(db, outstanding_only=False):
     """
-    Lists all the orders in the database
-    :param c: cursor for sqlite3
+    Lists the orders in the database with how far their scanned stock is from the expected quantities
+    :param db: Storage
+    :param outstanding_only: if True, only list orders with units short or over, largest discrepancy first
     :return:
     """
-    c.execute("SELECT * "
-              "FROM orders "
-              "ORDER BY order_number ASC")
-    data = c.fetchall()
-    header = ["Customer Order Number", "Delivery Reference Number"]
-    row_format = "{:^30}" * (len(header))
-    print(row_format.format(*header))
-    for row in data:
-        print(row_format.format(*row))
+    header = ["Customer Order Number", "Delivery Reference", "Lines", "Lines Matched", "Units Short", "Units Over"]
+    print_or_save(header, lambda page_size: db.order_summary_pages(outstanding_only, page_size), column_width=23)
 
 
-def main():
-    sqlite_file = 'database.db'
-    conn, c = connect_db(sqlite_file)
+def scan_server(db):
+    """
+    Receives scans from handheld scanners and other stations until Ctrl+C, see stockchecker_core.ingest
+    :param db: Storage
+    :return:
+    """
+    if not db.is_initialised():
+        print("Database is not initialised, type initialise first.")
+        return
+    # asyncio is only needed here, so it isn't imported at startup
+    import asyncio
+    from stockchecker_core.ingest import INGEST_HOST, INGEST_PORT, serve
+    db.commit()
+    print("Press Ctrl+C to stop.")
+    try:
+        asyncio.run(serve(db.sqlite_file, INGEST_HOST, INGEST_PORT))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print("Unable to start scan server:", e)
+        return
+    print("Scan server stopped.")
+
+
+def print_stats(db, cmd):
+    """
+    Shows the timers of the hot paths, or turns them on or off, see stockchecker_core.instrumentation
+    :param db: Storage
+    :param cmd: "stats", "stats on", "stats off" or "stats reset"
+    :return:
+    """
+    if cmd == "stats on":
+        instrumentation.enable()
+        print("Timing on.")
+    elif cmd == "stats off":
+        instrumentation.enable(False)
+        print("Timing off.")
+    elif cmd == "stats reset":
+        instrumentation.reset()
+        print("Timers reset.")
+    else:
+        if not instrumentation.enabled:
+            print("Timing is off, type stats on to start timing.")
+        print(instrumentation.format_stats())
+        cache = db.barcodes.stats()
+        print("Barcode cache:", cache['barcodes'], "barcodes,", cache['hits'], "hits,", cache['misses'], "misses")
+
+
+def profile(cmd):
+    """
+    Starts cProfile, or stops it and saves the profile to a file that can be read with python -m pstats
+    :param cmd: "profile on" or "profile off"
+    :return:
+    """
+    if cmd == "profile on":
+        if instrumentation.start_profile():
+            print("Profiling, type profile off to save the profile.")
+        else:
+            print("Already profiling.")
+        return
+    filename = input("Profile filename (e.g. stockchecker.prof):")
+    try:
+        if not instrumentation.stop_profile(filename):
+            print("Not profiling, type profile on first.")
+            return
+    except OSError as e:
+        print("Unable to save profile:", e)
+        return
+    print("Profile saved to", filename)
+
+
+# Command line mode
+# Each subcommand takes what the interactive commands prompt for as arguments, and the answers to their questions as
+# policies, so it can run from scripts. Commands return the exit status: 0, or 1 if anything failed
+
+
+def command_order(db, ref):
+    """
+    :param db: Storage
+    :param ref: delivery reference or customer order number
+    :return: customer order number, or None after printing why the reference doesn't match exactly one order
+    """
+    order_numbers = db.resolve_order(ref)
+    if len(order_numbers) == 1:
+        return order_numbers[0]
+    if order_numbers:
+        print("Delivery Reference", ref, "is linked to multiple orders, use the Customer Order Number.",
+              file=sys.stderr)
+    else:
+        print("Order", ref, "does not exist in database.", file=sys.stderr)
+    return None
+
+
+def write_listing(header, pages, output, column_width=20):
+    """
+    Prints a listing as a table, or saves it as CSV or JSON lines
+    :param header: column titles
+    :param pages: function(page size) returning the pages of rows of the listing
+    :param output: filename ending in one of OUTPUT_FORMATS, or None to print
+    :param column_width: width of the printed columns
+    :return: exit status
+    """
+    if output is None:
+        write_pages(pages(REPORT_PAGE_SIZE), header, sys.stdout, column_width=column_width)
+        return 0
+    fmt = output_format(output)
+    if fmt is None:
+        print("Output filename must end in", " or ".join(OUTPUT_FORMATS), file=sys.stderr)
+        return 1
+    try:
+        with open(output, 'w', newline="") as output_file:
+            written = write_pages(pages(REPORT_PAGE_SIZE), header, output_file, fmt)
+    except OSError as e:
+        print("Unable to write file:", e, file=sys.stderr)
+        return 1
+    print(written, "rows saved to", output)
+    return 0
+
+
+def initialise_command(db, args):
+    db.initialise()
+    return 0
+
+
+def import_pdf_command(db, args):
+    """
+    Imports order PDFs and folders of order PDFs
+    With --existing skip, orders already in the database are skipped and the PDFs are parsed in parallel. With
+    --existing add, their line items are added to the order, adding to the supplied quantities of products that
+    are already on it
+    """
+    pdf_names = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            pdf_names.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                    if name.lower().endswith('.pdf')))
+        else:
+            pdf_names.append(path)
+    if not pdf_names:
+        print("No PDFs found.", file=sys.stderr)
+        return 1
+    if args.existing == 'skip':
+        imported, skipped, failed = import_pdfs(db, pdf_names, args.workers)
+        return 1 if failed else 0
+    failed = 0
+    for pdf_name in pdf_names:
+        try:
+            order_pdf = OrderPDF(pdf_name, db.sqlite_file)
+            if order_pdf.order_number is None:
+                failed += 1
+                print(pdf_name + ": Customer Order Number not found in PDF.", file=sys.stderr)
+                continue
+            # the lines are parsed before the order is written, so a PDF that fails to parse adds nothing
+            lines = order_pdf.read_lines()
+            if not db.order_exists(order_pdf.order_number):
+                db.add_order(order_pdf.order_number, order_pdf.delivery_reference)
+        except Exception as e:
+            db.conn.rollback()
+            failed += 1
+            print(pdf_name + ": failed to parse,", e, file=sys.stderr)
+            continue
+        db.add_order_lines(order_pdf.order_number, lines)
+        db.commit()
+        instrumentation.record_timings('pdf.', order_pdf.timings)
+        print(pdf_name + ": order", order_pdf.order_number, "imported,", len(lines), "products.")
+    return 1 if failed else 0
+
+
+def import_barcodes_command(db, args):
+    try:
+        inserted, skipped, rejected = db.load_barcodes(args.file)
+    except FileNotFoundError as e:
+        print("File does not exist:", e, file=sys.stderr)
+        return 1
+    print(inserted, "barcodes added,", skipped, "already in database,", rejected, "rejected.")
+    return 0
+
+
+def export_barcodes_command(db, args):
+    try:
+        written = db.export_barcodes(args.file)
+    except OSError as e:
+        print("Unable to write file:", e, file=sys.stderr)
+        return 1
+    print(written, "barcodes exported to", args.file)
+    return 0
+
+
+def scan_command(db, args):
+    """
+    Applies scans read from a file or stdin to an order, see stockchecker_core.batch for the format
+    Scans typed or scanned at a terminal are recorded one at a time, piped scans in batches
+    """
+    order_number = command_order(db, args.order)
+    if order_number is None:
+        return 1
+    try:
+        scans_file = sys.stdin if args.file == '-' else open(args.file)
+    except OSError as e:
+        print("Unable to read file:", e, file=sys.stderr)
+        return 1
+    batch_size = args.batch_size or (1 if scans_file.isatty() else SCAN_BATCH_SIZE)
+    start = time.perf_counter()
+    try:
+        counts = scan_lines(db, order_number, scans_file, args.unknown, args.not_on_order, batch_size,
+                            args.station, rejected=lambda line_number, line, reason: print(
+                                "Skipped line {}: {}: {}".format(line_number, line, reason), file=sys.stderr))
+    except ScanRejected as e:
+        print("Stopped at", e, file=sys.stderr)
+        return 1
+    finally:
+        if scans_file is not sys.stdin:
+            scans_file.close()
+    elapsed = time.perf_counter() - start
+    print("{} scans of {} units recorded, {} undone, {} products added to the order in {:.2f}s ({:.0f} scans/sec)."
+          .format(counts['scans'], counts['units'], counts['undone'], counts['added'], elapsed,
+                  counts['scans'] / elapsed if elapsed else 0))
+    if counts['unknown'] or counts['not_on_order']:
+        print(counts['unknown'], "unknown scans and", counts['not_on_order'], "scans not on the order skipped.")
+    if args.report:
+        print_report(db, order_number)
+    return 0
+
+
+def report_command(db, args):
+    order_number = command_order(db, args.order)
+    if order_number is None:
+        return 1
+    header = ["Product Code", "Expected Quantity", "Scanned Quantity", "Difference"]
+    status = write_listing(header, lambda page_size: db.order_line_pages(order_number, args.discrepancies, page_size),
+                           args.output)
+    lines, lines_matched, units_short, units_over = db.order_summary(order_number)
+    print(lines_matched, "of", lines, "lines match,", units_short, "units short,", units_over, "units over.")
+    return status
+
+
+def orders_command(db, args):
+    header = ["Customer Order Number", "Delivery Reference", "Lines", "Lines Matched", "Units Short", "Units Over"]
+    return write_listing(header, lambda page_size: db.order_summary_pages(args.outstanding, page_size), args.output,
+                         column_width=23)
+
+
+def products_command(db, args):
+    header = ["Barcode", "Product Code", "Last Update", "Primary Code"]
+    return write_listing(header, lambda page_size: db.product_pages(args.prefix, page_size), args.output,
+                         column_width=35)
+
+
+def command_parser():
+    # only the command line mode needs argparse, so it isn't imported at startup
+    import argparse
+    parser = argparse.ArgumentParser(description="Verify stock deliveries. Run without a command for the "
+                                                 "interactive prompt.")
+    parser.add_argument('--database', default=DATABASE_FILE, help="sqlite database file (default %(default)s)")
+    parser.add_argument('--stats', action='store_true', help="print the hot path timers when the command finishes")
+    commands = parser.add_subparsers(metavar='command', required=True)
+
+    command = commands.add_parser('initialise', help="create the database")
+    command.set_defaults(command=initialise_command)
+
+    command = commands.add_parser('import-pdf', help="import order PDFs")
+    command.add_argument('paths', nargs='+', help="order PDFs, or folders of order PDFs")
+    command.add_argument('--existing', choices=('skip', 'add'), default='skip',
+                         help="orders already in the database are skipped, or have the line items added to them "
+                              "(default %(default)s)")
+    command.add_argument('--workers', type=int, help="PDFs parsed at once with --existing skip (default: cores)")
+    command.set_defaults(command=import_pdf_command)
+
+    command = commands.add_parser('import-barcodes', help="import a barcode file (.csv, .csv.gz or .sqlite)")
+    command.add_argument('file')
+    command.set_defaults(command=import_barcodes_command)
+
+    command = commands.add_parser('export-barcodes', help="export the barcodes to a .csv, .csv.gz or .sqlite file")
+    command.add_argument('file')
+    command.set_defaults(command=export_barcodes_command)
+
+    command = commands.add_parser('scan', help="apply scans from a file or stdin to an order")
+    command.add_argument('--order', required=True, help="delivery reference or customer order number")
+    command.add_argument('--file', default='-', help="file of scans, one per line (default stdin)")
+    command.add_argument('--unknown', choices=UNKNOWN_POLICIES, default='skip',
+                         help="barcodes not in the database and invalid product codes are skipped, or stop the "
+                              "scan (default %(default)s)")
+    command.add_argument('--not-on-order', choices=NOT_ON_ORDER_POLICIES, default='skip',
+                         help="products not on the order are skipped, force added to the order, or stop the scan "
+                              "(default %(default)s)")
+    command.add_argument('--batch-size', type=int,
+                         help="scans per transaction (default 1 at a terminal, otherwise %d)" % SCAN_BATCH_SIZE)
+    command.add_argument('--station', help="name the scans are recorded under (default: host name)")
+    command.add_argument('--report', action='store_true', help="print the order report afterwards")
+    command.set_defaults(command=scan_command)
+
+    command = commands.add_parser('report', help="print or save the report of an order")
+    command.add_argument('--order', required=True, help="delivery reference or customer order number")
+    command.add_argument('--discrepancies', action='store_true', help="only lines that don't match")
+    command.add_argument('--output', help="save to a .csv or .jsonl file instead of printing")
+    command.set_defaults(command=report_command)
+
+    command = commands.add_parser('orders', help="list the orders")
+    command.add_argument('--outstanding', action='store_true', help="only orders with units short or over")
+    command.add_argument('--output', help="save to a .csv or .jsonl file instead of printing")
+    command.set_defaults(command=orders_command)
+
+    command = commands.add_parser('products', help="list the barcodes")
+    command.add_argument('--prefix', default='', help="only product codes starting with this")
+    command.add_argument('--output', help="save to a .csv or .jsonl file instead of printing")
+    command.set_defaults(command=products_command)
+    return parser
+
+
+def run_command(argv):
+    """
+    Runs one command given on the command line
+    :param argv: command line arguments, e.g. ['scan', '--order', 'SJ532017']
+    :return: exit status
+    """
+    args = command_parser().parse_args(argv)
+    instrumentation.enable(args.stats or instrumentation.enabled)
+    db = Storage(args.database)
+    try:
+        if args.command is not initialise_command and not db.is_initialised():
+            print("Database is not initialised, run initialise first.", file=sys.stderr)
+            return 1
+        return args.command(db, args)
+    finally:
+        db.close()
+        if args.stats:
+            print(instrumentation.format_stats(), file=sys.stderr)
+
+
+def main(argv=None):
+    """
+    Runs the command given on the command line, or the interactive prompt if there is none
+    :param argv: command line arguments, sys.argv[1:] if None
+    :return: exit status
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv:
+        return run_command(argv)
+    # tabula and pandas load while the first command is typed
+    threading.Thread(target=prewarm, daemon=True).start()
+    db = Storage(DATABASE_FILE)
     while True:
         cmd = input('>')
         # check if db exists, if not fail to read any commands tell user to type initialise
         if cmd == "load pdf":
-            load_pdf(c, conn)
+            load_pdf(db)
+        elif cmd == "load pdf folder":
+            load_pdf_folder(db)
         elif cmd == "scan":
-            scan_order(c, conn)
+            scan_order(db)
         elif cmd == "add barcode":
-            add_barcode(c, conn)
+            add_barcode(db)
         elif cmd == "remove barcode":
-            remove_barcode(c, conn)
+            remove_barcode(db)
         elif cmd == "exit":
             break
         elif cmd == "initialise":
-            initialise_db(c, conn)
+            db.initialise()
         elif cmd == "check order":
-            check_order(c)
+            check_order(db)
         elif cmd == "remove order":
-            remove_order(c, conn)
+            remove_order(db)
         elif cmd == "list orders":
-            list_orders(c)
+            list_orders(db)
+        elif cmd == "list outstanding":
+            list_orders(db, outstanding_only=True)
+        elif cmd == "list products":
+            print_productsdb(db)
         elif cmd == "load barcodes":
-            load_barcodes(c, conn)
+            load_barcodes(db)
+        elif cmd == "export barcodes":
+            export_barcodes(db)
+        elif cmd == "scan history":
+            scan_history(db)
+        elif cmd == "replay scans":
+            replay_scans(db)
+        elif cmd == "scan server":
+            scan_server(db)
+        elif cmd == "export changes":
+            export_changes(db)
+        elif cmd == "load changes":
+            load_changes(db)
+        elif cmd.startswith("stats"):
+            print_stats(db, cmd)
+        elif cmd == "profile on" or cmd == "profile off":
+            profile(cmd)
         elif cmd == "?" or cmd == "help":
-            print("List of commands: load pdf, scan, add barcode, remove barcode, check order, "
-                  "remove order, list orders, adjust quantity, exit")
+            print("List of commands: load pdf, load pdf folder, scan, add barcode, remove barcode, load barcodes, "
+                  "export barcodes, export changes, load changes, scan server, scan history, replay scans, "
+                  "check order, remove order, list orders, list outstanding, list products, adjust quantity, "
+                  "stats, stats on, stats off, stats reset, profile on, profile off, exit")
+            print("Run with --help for the commands that can be run from scripts.")
         else:
             print("invalid input")
-    conn.close()
+    db.close()
+    return 0
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -5,17 +5,37 @@ from kivy.uix.screenmanager import ScreenManager, Screen
 from kivy.properties import BooleanProperty, ListProperty, NumericProperty, ObjectProperty
 from kivy.clock import Clock
 from kivy.uix.popup import Popup
-import sqlite3
-import re
-import tabula
-import csv
-from datetime import datetime
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from kivy.core.window import Window
 
+# stockchecker_core is shared with the other front-end, one folder up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from stockchecker_core import instrumentation  # noqa: E402
+from stockchecker_core.jobs import JobCancelled, JobRunner  # noqa: E402
+from stockchecker_core.pdf_import import (OrderPDF, import_pdfs, prewarm, print_order_lines,  # noqa: E402
+                                          print_timings)
+from stockchecker_core.report import OrderReport  # noqa: E402
+from stockchecker_core.storage import (BARCODE_FILE_EXTENSIONS, DATABASE_FILE, SCAN_FLUSH_INTERVAL,  # noqa: E402
+                                       Storage)
+from stockchecker_core.validation import pn_regex_check  # noqa: E402
+
 Window.softinput_mode = 'pan'
 
-conn = sqlite3.connect('database.db')
-c = conn.cursor()
+# Seconds after the window opens that tabula and pandas are imported in the background, so they don't hold up
+# the first screen but are ready by the time a PDF is imported
+PREWARM_DELAY = 2
+
+
+def run_on_ui_thread(callback, *args):
+    Clock.schedule_once(lambda dt: callback(*args))
+
+
+# Database connection of the UI, opened, used and closed only on the database thread of jobs
+db = None
+jobs = JobRunner(run_on_ui_thread)
 
 
 class MenuScreen(Screen):
@@ -25,7 +45,10 @@ class MenuScreen(Screen):
         Clock.schedule_once(self.init_ui, 0)
 
     def init_ui(self, dt=0):
-        if database_check():
+        jobs.submit(database_check, on_done=self.enable_buttons)
+
+    def enable_buttons(self, initialised):
+        if initialised:
             self.ids.verifyorderbutton.disabled = False
             self.ids.checkorderbutton.disabled = False
             self.ids.importpdfbutton.disabled = False
@@ -40,7 +63,10 @@ class AdvancedScreen(Screen):
         super(AdvancedScreen, self).__init__(**kwargs)
 
     def init_ui(self, dt=0):
-        if database_check():
+        jobs.submit(database_check, on_done=self.enable_buttons)
+
+    def enable_buttons(self, initialised):
+        if initialised:
             self.ids.initalisedbbutton.disabled = True
             self.ids.import_csv.disabled = False
             self.ids.export_csv.disabled = False
@@ -54,7 +80,7 @@ class AdvancedScreen(Screen):
             self.ids.rm_bar.disabled = True
 
     def initialise_db(self):
-        initialise_db()
+        jobs.submit(initialise_db, on_done=self.init_ui)
 
     def import_barcodes(self):
         load_popup = LoadingPopup()
@@ -66,11 +92,40 @@ class AdvancedScreen(Screen):
 
 
 class ImportPDFScreen(Screen):
+    job = ObjectProperty(None, allownone=True)
+
     def __init__(self, **kwargs):
         super(ImportPDFScreen, self).__init__(**kwargs)
 
     def start_import(self):
-        load_pdf(str(self.ids.file_chooser.selection[0]))
+        selection = self.ids.file_chooser.selection
+        if selection and self.job is None:
+            self.ids.import_status.text = 'Importing...'
+            self.ids.import_progress.value = 0
+            self.job = jobs.submit_background(import_pdf_files, [str(pdf) for pdf in selection],
+                                              on_done=self.import_done, on_error=self.import_failed,
+                                              on_progress=self.show_progress)
+
+    def cancel_import(self):
+        if self.job is not None:
+            self.job.cancel()
+
+    def show_progress(self, done, total):
+        self.ids.import_progress.max = total
+        self.ids.import_progress.value = done
+        self.ids.import_status.text = 'Imported {} of {} PDFs'.format(done, total)
+
+    def import_done(self, counts):
+        self.job = None
+        self.ids.import_status.text = '{} imported, {} skipped, {} failed'.format(*counts)
+
+    def import_failed(self, error):
+        self.job = None
+        if isinstance(error, JobCancelled):
+            self.ids.import_status.text = 'Import cancelled'
+        else:
+            print(error)
+            self.ids.import_status.text = 'Failed to Import'
 
     def refresh_view(self):
         self.ids.file_chooser._update_files()
@@ -79,96 +134,87 @@ class ImportPDFScreen(Screen):
 class CheckOrderScreen(Screen):
     data_items = ListProperty([])
     order_number = None
+    session = None
 
     def __init__(self,**kwargs):
         super(CheckOrderScreen, self).__init__(**kwargs)
+        self.report = OrderReport(self.data_items)
+        Clock.schedule_interval(self.flush_scans, SCAN_FLUSH_INTERVAL)
+
+    def on_leave(self, *args):
+        self.flush_scans()
+
+    def flush_scans(self, dt=0):
+        if self.session is not None:
+            jobs.submit(self.session.flush)
+
+    def suggest_orders(self, text):
+        jobs.submit(search_orders, text, on_done=self.show_suggestions)
+
+    def show_suggestions(self, suggestions):
+        self.ids.order_suggestions.text = suggestions
 
     def load_order(self):
-        order_num = validate_order_input(self.ids.checkordernum.text)
-        if order_num is not None:
-            c.execute("SELECT * "
-                      "FROM scanned_products "
-                      "WHERE order_number = ? "
-                      "ORDER BY product_code ASC", (order_num,))
-            rows = c.fetchall()
-            data = []
-            for row in rows:
-                for col in row:
-                    data.append([col])
-                data.append([int(data[-1][0]) - int(data[-2][0])])
-            self.data_items = [{'text': str(x[0])} for x in data]
-            self.order_number = order_num
+        jobs.submit(open_order, self.ids.checkordernum.text, self.session, on_done=self.show_order)
+
+    def show_order(self, order):
+        if order is not None:
+            self.order_number, self.session, snapshot = order
+            self.report.load(self.order_number, snapshot)
 
     def add_to_db(self):
         # check if quantity is integer, could do through kivy but it only forces positive numbers
-        # negative numbers required if mistakes are made when entering quantities
+        # negative numbers can still be entered, Undo cancels the last scan instead
         quantity = get_quantity(self.ids.quantity.text)
         if self.order_number is not None and quantity is not None:
-            # logic = if barcode or product number, and on order, read quantity textbox and add to db
-            # logic = if not valid product code --> if barcode not exist on system -->
-            # ask if user wants to add to DB (POPUP)
-            # then add thing to db
-            # logic = if valid product code but not on order, ask user if force add to DB (POPUP)
-            c.execute("SELECT product_code "
-                      "FROM products "
-                      "WHERE barcode = ?",
-                      (self.ids.scaninput.text,))
-            product_code = c.fetchone()
-            if product_code is None:
-                # Barcode does not exist in system
-                if pn_regex_check(self.ids.scaninput.text) is False:
-                    # Not a valid Product Code, ask user if they want to add to DB as a barcode
-                    # popup --> add to barcode db, back to main screen
-                    abp_popup = AddBarcodePopup()
-                    abp_popup.open()
-                    abp_popup.disable_barcode(self.ids.scaninput.text)
-                    return
-                else:
-                    # is valid product code, check if on order
-                    return_chk = is_on_order(self.order_number, self.ids.scaninput.text.upper())
-                    if return_chk[0]:
-                        # on order, add to db
-                        update_order(self.order_number, self.ids.scaninput.text.upper(), return_chk[1]+quantity)
-                        # update gui --> search through data_items and adjust the vals
-                        for idx, item in enumerate(self.data_items):
-                            if self.data_items[idx] == {'text': self.ids.scaninput.text.upper()}:
-                                self.data_items[idx+2] = {'text': str(return_chk[1]+quantity)}
-                                self.data_items[idx+3] = {'text': str(int(self.data_items[idx + 3]['text']) + quantity)}
-                                break
-                        self.update_labels(self.ids.scaninput.text.upper(), quantity)
-                        self.ids.scaninput.focus = True
-                    else:
-                        # not on order, popup -> force add to order? (yes, no)
-                        force_add_popup = ForceAddProductToOrderPopup(order_number=self.order_number,
-                                                                      product_code=self.ids.scaninput.text.upper(),
-                                                                      quantity=quantity,
-                                                                      caller=self)
-                        force_add_popup.open()
-            else:
-                # this is if barcode is in db
-                return_chk = is_on_order(self.order_number, product_code[0])
-                if return_chk[0]:
-                    # on order, add to db
-                    update_order(self.order_number, product_code[0], return_chk[1]+quantity)
-                    # update gui --> search through data_items and adjust the vals
-                    for idx, item in enumerate(self.data_items):
-                        if self.data_items[idx] == {'text': product_code[0]}:
-                            self.data_items[idx + 2] = {'text': str(return_chk[1] + quantity)}
-                            self.data_items[idx + 3] = {'text': str(int(self.data_items[idx + 3]['text']) + quantity)}
-                            break
-                    self.update_labels(product_code[0], quantity)
-                    self.ids.scaninput.focus = True
-                else:
-                    # not on order, popup -> force add to order? (yes, no)
-                    force_add_popup = ForceAddProductToOrderPopup(order_number=self.order_number,
-                                                                  product_code=product_code[0],
-                                                                  quantity=quantity,
-                                                                  caller=self)
-                    force_add_popup.open()
+            # the lookup and write run on the database thread, show_scan then updates the gui
+            jobs.submit(scan_product, self.session, self.ids.scaninput.text, quantity, on_done=self.show_scan)
             if not self.ids.auto_scan.active:
                 self.ids.quantity.text = ''
             self.ids.scaninput.text = ''
 
+    def show_scan(self, scan):
+        # logic = if barcode or product number, and on order, read quantity textbox and add to db
+        # logic = if not valid product code --> if barcode not exist on system -->
+        # ask if user wants to add to DB (POPUP)
+        # then add thing to db
+        # logic = if valid product code but not on order, ask user if force add to DB (POPUP)
+        scan_input, product_code, quantity, scanned_quantity, expected_quantity = scan
+        if product_code is None:
+            # Not a valid Product Code, ask user if they want to add to DB as a barcode
+            # popup --> add to barcode db, back to main screen
+            abp_popup = AddBarcodePopup()
+            abp_popup.open()
+            abp_popup.disable_barcode(scan_input)
+        elif scanned_quantity is None:
+            # not on order, popup -> force add to order? (yes, no)
+            force_add_popup = ForceAddProductToOrderPopup(order_number=self.order_number,
+                                                          product_code=product_code,
+                                                          quantity=quantity,
+                                                          caller=self)
+            force_add_popup.open()
+        else:
+            # on order, update gui --> adjust the vals of the product's row
+            if product_code in self.report.snapshot:
+                self.report.update(product_code, scanned_quantity)
+            else:
+                # added to the order by another station since the report was loaded
+                self.report.append(product_code, expected_quantity, scanned_quantity)
+            self.update_labels(product_code, quantity)
+            self.ids.scaninput.focus = True
+
+    def undo_scan(self):
+        if self.session is not None:
+            jobs.submit(self.session.undo, on_done=self.show_undo)
+
+    def show_undo(self, undone):
+        # undone is (product code, new scanned quantity) of the scan that was cancelled, if there was one
+        for product_code, scanned_quantity in undone:
+            if product_code in self.report.snapshot:
+                self.report.update(product_code, scanned_quantity)
+            self.update_labels(product_code, "undone")
+        self.ids.scaninput.focus = True
+
     def check_scan_mode(self):
         if self.ids.auto_scan.active:
             self.add_to_db()
@@ -189,52 +235,121 @@ class VerifyOrderScreen(Screen):
 
     def __init__(self, **kwargs):
         super(VerifyOrderScreen, self).__init__(**kwargs)
+        self.report = OrderReport(self.data_items)
         #Window.bind(on_key_down=self._on_keyboard_down)
 
     def _on_keyboard_down(self, instance, keyboard, keycode, text, modifiers):
         if self.ids.verifyordernum.focus and keycode == 40:  # 40 - Enter key pressed
             self.search_order()
 
+    def suggest_orders(self, text):
+        jobs.submit(search_orders, text, on_done=self.show_suggestions)
+
+    def show_suggestions(self, suggestions):
+        self.ids.order_suggestions.text = suggestions
+
     def search_order(self):
-        order_num = validate_order_input(self.ids.verifyordernum.text)
-        if order_num is not None:
-            c.execute("SELECT * "
-                      "FROM scanned_products "
-                      "WHERE order_number = ? "
-                      "ORDER BY product_code ASC", (order_num,))
-            rows = c.fetchall()
-            data = []
-            for row in rows:
-                for col in row:
-                    data.append([col])
-                data.append([int(data[-1][0]) - int(data[-2][0])])
-                if self.ids.verifychkbox.active and data[-1][0] == 0:
-                    del data[-5:]
-            self.data_items = [{'text': str(x[0])} for x in data]
+        jobs.submit(find_order, self.ids.verifyordernum.text, on_done=self.show_order)
+
+    def show_order(self, order):
+        if order is not None:
+            self.report.hide_matched = self.ids.verifychkbox.active
+            self.report.sort_by_difference = self.ids.verifysortbox.active
+            self.report.load(*order)
+            self.ids.order_totals.text = self.report.totals_text()
+
+    def filter_matched(self, hide_matched):
+        self.report.set_hide_matched(hide_matched)
+
+    def sort_by_difference(self, sort_by_difference):
+        self.report.set_sort_by_difference(sort_by_difference)
 
     def print_to_pdf(self):
         pass
 
 
 class ExportPopup(Popup):
+    job = None
+
     def __init__(self, **kwargs):
         super(ExportPopup, self).__init__(**kwargs)
 
     def start_export(self):
-        if export_barcodes(self.ids.export_filename.text + ".csv"):
+        if self.job is None:
+            barcodes_file = self.ids.export_filename.text
+            if not barcodes_file.endswith(BARCODE_FILE_EXTENSIONS):
+                barcodes_file += ".csv"
+            self.ids.export_warning.text = ''
+            self.ids.export_status.text = 'Exporting...'
+            self.job = jobs.submit_background(export_barcode_file, barcodes_file,
+                                              on_done=self.export_done, on_error=self.export_failed,
+                                              on_progress=self.show_progress)
+
+    def cancel(self):
+        if self.job is not None:
+            self.job.cancel()
+        else:
             self.dismiss()
+
+    def show_progress(self, done, total):
+        self.ids.export_progress.max = total
+        self.ids.export_progress.value = done
+        self.ids.export_status.text = 'Exported {} of {} barcodes'.format(done, total)
+
+    def export_done(self, result):
+        self.job = None
+        self.dismiss()
+
+    def export_failed(self, error):
+        self.job = None
+        self.ids.export_status.text = ''
+        if isinstance(error, JobCancelled):
+            self.ids.export_warning.text = 'Export cancelled'
         else:
+            print(error)
             self.ids.export_warning.text = 'Failed to Export'
 
 
 class LoadingPopup(Popup):
+    job = None
+
     def __init__(self, **kwargs):
         super(LoadingPopup, self).__init__(**kwargs)
 
     def import_barcodes(self):
-        if load_barcodes(self.ids.file_chooser.selection):
+        if self.job is not None:
+            return
+        if self.ids.file_chooser.selection:
+            self.ids.import_warning.text = 'Importing...'
+            self.job = jobs.submit_background(import_barcode_file, self.ids.file_chooser.selection[0],
+                                              on_done=self.import_done, on_error=self.import_failed,
+                                              on_progress=self.show_progress)
+        else:
+            self.ids.import_warning.text = 'Failed to Import'
+
+    def cancel(self):
+        if self.job is not None:
+            self.job.cancel()
+        else:
             self.dismiss()
+
+    def show_progress(self, done, total):
+        self.ids.import_progress.max = total
+        self.ids.import_progress.value = done
+
+    def import_done(self, counts):
+        self.job = None
+        # the import ran on its own connection, drop the barcodes cached by the connection of the UI
+        jobs.submit(invalidate_barcodes)
+        self.dismiss()
+
+    def import_failed(self, error):
+        self.job = None
+        self.ids.import_progress.value = 0
+        if isinstance(error, JobCancelled):
+            self.ids.import_warning.text = 'Import cancelled'
         else:
+            print(error)
             self.ids.import_warning.text = 'Failed to Import'
 
     def refresh_view(self):
@@ -253,7 +368,7 @@ class AddBarcodePopup(Popup):
         # regex check textbox of product code
         if pn_regex_check(self.ids.add_bc_product_code.text):
             # add to db
-            add_barcode(self.ids.add_bc_barcode.text,self.ids.add_bc_product_code.text)
+            jobs.submit(add_barcode, self.ids.add_bc_barcode.text, self.ids.add_bc_product_code.text)
             self.dismiss()
         else:
             self.ids.warning_label.text = 'INVALID PRODUCT CODE FORMAT\nUSE 2 LETTERS\nFOLLOWED BY 4 NUMBERS'
@@ -264,13 +379,58 @@ class RemoveBarcodePopup(Popup):
         super(RemoveBarcodePopup, self).__init__(**kwargs)
 
     def remove_barcode(self):
-        if remove_barcode(self.ids.rm_bc_barcode.text):
+        jobs.submit(remove_barcode, self.ids.rm_bc_barcode.text, on_done=self.removed)
+
+    def removed(self, removed):
+        if removed:
             self.dismiss()
         else:
             self.ids.rm_warning_label.text = 'BARCODE NOT IN DATABASE\nCANCEL OR TRY AGAIN'
             self.ids.rm_bc_barcode.text = ''
 
 
+class StatsPopup(Popup):
+    """
+    Latencies of the timed hot paths, see stockchecker_core.instrumentation
+    The profile is run on the database thread, where the queries and scans of the UI run
+    """
+    def __init__(self, **kwargs):
+        super(StatsPopup, self).__init__(**kwargs)
+
+    def on_open(self):
+        self.refresh()
+
+    def refresh(self):
+        self.ids.stats_table.text = instrumentation.format_stats()
+        self.ids.stats_timing.text = 'Stop Timing' if instrumentation.enabled else 'Start Timing'
+        self.ids.stats_profile.text = 'Save Profile' if instrumentation.profiling() else 'Start Profile'
+
+    def toggle_timing(self):
+        instrumentation.enable(not instrumentation.enabled)
+        self.refresh()
+
+    def reset(self):
+        instrumentation.reset()
+        self.refresh()
+
+    def toggle_profile(self):
+        self.ids.stats_warning.text = ''
+        if instrumentation.profiling():
+            profile_file = self.ids.profile_filename.text or 'stockchecker.prof'
+            jobs.submit(instrumentation.stop_profile, profile_file, on_done=self.profile_changed,
+                        on_error=self.profile_failed)
+        else:
+            jobs.submit(instrumentation.start_profile, on_done=self.profile_changed)
+
+    def profile_changed(self, result):
+        self.refresh()
+
+    def profile_failed(self, error):
+        print(error)
+        self.ids.stats_warning.text = 'Failed to Save Profile'
+        self.refresh()
+
+
 class ForceAddProductToOrderPopup(Popup):
     caller = None
 
@@ -284,13 +444,10 @@ class ForceAddProductToOrderPopup(Popup):
 
     def add_to_order(self):
         # add to DB
-        add_to_order(self.ids.title_order_number.text, self.ids.title_product_code.text, self.ids.body_quantity.text)
-        # update gui -->  self.data_items.append({'text': '40408133'}) etc
-        self.caller.data_items.append({'text': self.ids.title_order_number.text})
-        self.caller.data_items.append({'text': self.ids.title_product_code.text})
-        self.caller.data_items.append({'text': '0'})
-        self.caller.data_items.append({'text': self.ids.body_quantity.text})
-        self.caller.data_items.append({'text': self.ids.body_quantity.text})
+        jobs.submit(self.caller.session.add_product, self.ids.title_product_code.text,
+                    int(self.ids.body_quantity.text))
+        # update gui --> add a row to the end of the report
+        self.caller.report.append(self.ids.title_product_code.text, 0, int(self.ids.body_quantity.text))
         self.caller.ids.last_entered_item.text = self.ids.title_product_code.text
         self.caller.ids.last_entered_quantity.text = self.ids.body_quantity.text
         self.caller.ids.scaninput.focus = True
@@ -302,49 +459,13 @@ class ForceAddProductToOrderPopup(Popup):
 
 
 class StockChecker(App):
-    pass
-
-
-def add_to_order(order_number, product_code, quantity):
-    c.execute("INSERT INTO scanned_products "
-              "VALUES(?,?,0,?)",
-              (order_number, product_code, quantity,))
-    conn.commit()
-
-
-def update_order(order_number, product_code, new_quantity):
-    c.execute("UPDATE scanned_products "
-              "SET scanned_quantity = ? "
-              "WHERE order_number = ? AND product_code = ?",
-              (new_quantity, order_number, product_code,))
-    conn.commit()
-
-
-def is_on_order(order_number, product_code):
-    c.execute("SELECT count(*), scanned_quantity "
-              "FROM scanned_products "
-              "WHERE order_number = ? "
-              "AND product_code = ?",
-              (order_number, product_code,))
-    on_order = c.fetchone()
-    if on_order[0] == 0:
-        return [False, 0]
-    else:
-        return [True, on_order[1]]
+    def on_start(self):
+        Clock.schedule_once(lambda dt: jobs.submit_background(prewarm_pdf_import), PREWARM_DELAY)
 
-
-def pn_regex_check(p_code):
-    """
-    Verify that the provided string uses the valid formatting for a product code
-    Formatting is 2 letters followed by 4 numbers
-    :param p_code: string to validate
-    :return: boolean (True or False)
-    """
-    regex = re.compile("^[a-zA-Z]{2}[0-9]{4}$")
-    if regex.match(p_code):
-        return True
-    else:
-        return False
+    def on_stop(self):
+        self.root.ids.checkorder.flush_scans()
+        jobs.submit(close_database)
+        jobs.shutdown()
 
 
 def get_quantity(input_string):
@@ -360,216 +481,203 @@ def get_quantity(input_string):
             return None
 
 
+# The functions below run on the database thread of jobs
+
+
+def open_database():
+    global db
+    db = Storage(DATABASE_FILE)
+
+
+def close_database():
+    db.close()
+
+
+def database_check():
+    return db.is_initialised()
+
+
+def initialise_db():
+    db.initialise()
+
+
+def invalidate_barcodes():
+    db.barcodes.invalidate()
+
+
+def add_barcode(barcode, product_code):
+    return db.add_barcode(barcode, product_code)
+
+
+def remove_barcode(barcode):
+    return db.remove_barcode(barcode)
+
+
 def validate_order_input(order_num):
     """
     Checks if user input is a valid delivery reference (e.g. SJ532017) or a valid customer order number (e.g. 40408133)
     It is valid if it exists in the database
-    :param order_num: sqlite cursor
-    :return: returns None if the user wants to go back to the main menu, otherwise returns the customer order number
+    :param order_num: delivery reference or customer order number entered by the user
+    :return: returns None if the order can't be found, otherwise returns the customer order number
     """
-    c.execute("SELECT count(*) "
-              "FROM orders "
-              "WHERE internal_reference = ?",
-              (order_num.upper(),))
-    internal_ref_count = c.fetchone()
-    if internal_ref_count[0] > 1:
+    order_numbers = db.resolve_order(order_num)
+    if len(order_numbers) > 1:
         print("Delivery Reference is linked to multiple orders, try again with Customer Order Number")
         return None
-    elif internal_ref_count[0] == 0:
-        c.execute("SELECT count(*) "
-                  "FROM orders "
-                  "WHERE order_number= ?", (order_num,))
-        if c.fetchone()[0] != 0:
-            return order_num
-        else:
-            print("Order number does not exist in system, try again.")
-            return None
-    else:
-        c.execute("SELECT order_number "
-                  "FROM orders "
-                  "WHERE internal_reference = ?", (order_num.upper(),))
-        order_num = c.fetchone()[0]
-        return order_num
+    elif not order_numbers:
+        print("Order number does not exist in system, try again.")
+        return None
+    return order_numbers[0]
 
 
-def add_barcode(barcode, product_code):
+def search_orders(text):
     """
-    Add a barcode linked to a product to the database
-    :return:
+    :param text: part of a delivery reference or customer order number, as typed
+    :return: suggestions to show under the order number box
     """
-    # read input, check if barcode exists, if yes abort
-    c.execute("SELECT count(*) "
-              "FROM products "
-              "WHERE barcode = ?",
-              (barcode,))
-    count = c.fetchone()[0]
-    if count == 0:
-        if pn_regex_check(product_code) is True:
-            # valid product code, insert to db
-            current_date = datetime.now().strftime("%d/%m/%Y")
-            c.execute("INSERT INTO products "
-                      "VALUES (?,?,?,'false')",
-                      (barcode, product_code.upper(), current_date,))
-            conn.commit()
-            # print(product_code.upper(), 'added to database.')
-            return True
-        else:
-            # print("Invalid product code. Must be 2 letters followed by 4 numbers.")
-            return False
-    else:
-        # print('Barcode already exists in system.')
-        return False
+    return ", ".join("{} ({})".format(delivery_ref, order_number)
+                     for order_number, delivery_ref in db.search_orders(text, limit=5))
 
 
-def remove_barcode(barcode):
+def find_order(order_ref):
     """
-    Remove a barcode linked to a product to the database
-    :return:
+    :param order_ref: delivery reference or customer order number entered by the user
+    :return: (customer order number, OrderSnapshot of the order), or None if the order can't be found
     """
-    c.execute("SELECT count(*) "
-              "FROM products "
-              "WHERE barcode = ?",
-              (barcode,))
-    count = c.fetchone()[0]
-    if count != 0:
-        c.execute('DELETE FROM products '
-                  'WHERE barcode = ?',
-                  (barcode,))
-        conn.commit()
-        # print('Barcode has been removed from database.')
-        return True
-    else:
-        # print('Barcode is not in the database. Unable to remove')
-        return False
-
-
-def load_pdf(pdf):
+    order_num = validate_order_input(order_ref)
+    if order_num is None:
+        return None
+    return order_num, db.order_snapshot(order_num)
+
+
+def open_order(order_ref, previous_session):
+    """
+    Starts scanning an order, finishing the scan session of the previous order
+    :param order_ref: delivery reference or customer order number entered by the user
+    :param previous_session: ScanSession of the order that was being scanned, or None
+    :return: (customer order number, ScanSession, OrderSnapshot of the order), or None if the order can't be found
+    """
+    order_num = validate_order_input(order_ref)
+    if order_num is None:
+        return None
+    if previous_session is not None:
+        previous_session.finish()
+    return order_num, db.scan_session(order_num), db.order_snapshot(order_num)
+
+
+def scan_product(session, scan_input, quantity):
+    """
+    Adds a scanned barcode or entered product code to the scanned quantity of the order
+    :param session: ScanSession of the order
+    :param scan_input: barcode or product code entered by the user
+    :param quantity: quantity to add
+    :return: (scan_input, product code, quantity, new scanned quantity, expected quantity). Product code is None if
+    the input is not a barcode in the database or a valid product code, and the quantities are None if the product is
+    not on the order
+    """
+    product_code = db.lookup_barcode(scan_input)
+    if product_code is None:
+        # Barcode does not exist in system
+        if pn_regex_check(scan_input) is False:
+            return scan_input, None, quantity, None, None
+        product_code = scan_input.upper()
+    if not session.is_on_order(product_code):
+        return scan_input, product_code, quantity, None, None
+    scanned_quantity = session.scan(product_code, quantity)
+    return scan_input, product_code, quantity, scanned_quantity, session.snapshot.expected_quantity(product_code)
+
+
+# The functions below run on the background thread of jobs, each on its own connection
+
+
+def load_pdf(storage, pdf):
     """
     Parses Order PDF and feeds data into the database
-    :return:
+    :return: (imported, skipped, failed) counts
     """
     try:
-        order_num = None
-        df_on = tabula.read_pdf(pdf, pages="1", area=[[40, 20, 535, 800]],
-                                columns=[100, 210, 265, 325, 365, 440, 530, 590, 660, 710, 750, 800])
-        for index, row in df_on.iterrows():
-            if row[0] == "Customer Ord":
-                print("Customer Order Number:", row[1], "Delivery Reference Number:", row[3])
-                order_num = row[1]
-                # check if exists in db, cancel...
-                c.execute("SELECT count(*) "
-                          "FROM orders "
-                          "WHERE order_number = ?",
-                          (order_num,))
-                if c.fetchone()[0] != 0:
-                    print("Order", order_num, "already exists in database.")
-                    return
-                c.execute("INSERT INTO orders "
-                          "VALUES(?,?)",
-                          (row[1], row[3]))
-                break
-
-        df_pd = tabula.read_pdf(pdf, pages="all", area=[[40, 20, 535, 800]],
-                                columns=[50, 160, 525, 600, 665, 700, 860])
-        df_pd = df_pd.astype(str)
-        header = ["Line", "Product Code", "Supplied Quantity"]
-        row_format = "{:15}" * (len(header))
-        print(row_format.format(*header))
-        for index, row in df_pd.iterrows():
-            if pn_regex_check(row[1]):
-                print(row_format.format(row[0], row[1], row[4]))
-                try:
-                    quantity = int(row[4])
-                except ValueError:
-                    quantity = 0
-                c.execute("SELECT count(*), expected_quantity "
-                          "FROM scanned_products "
-                          "WHERE order_number = ? AND product_code = ?",
-                          (order_num, row[1]))
-                rdata = c.fetchone()
-                if rdata[0] != 0:
-                    c.execute("UPDATE scanned_products "
-                              "SET expected_quantity = ?"
-                              "WHERE order_number = ? AND product_code = ?",
-                              (rdata[1] + quantity, order_num, row[1]))
-                else:
-                    c.execute("INSERT INTO scanned_products "
-                              "VALUES(?,?,?,0)",
-                              (order_num, row[1], quantity))
-        conn.commit()
+        order_pdf = OrderPDF(pdf, storage.sqlite_file)
+        order_num = order_pdf.order_number
+        if order_num is None:
+            print("Customer Order Number not found in PDF.")
+            return 0, 0, 1
+        print("Customer Order Number:", order_num, "Delivery Reference Number:", order_pdf.delivery_reference)
+        # check if exists in db, cancel...
+        if storage.order_exists(order_num):
+            print("Order", order_num, "already exists in database.")
+            return 0, 1, 0
+        # parsed before the order is written, so the write lock isn't held while tabula runs and scans on the
+        # database thread aren't kept waiting
+        lines = order_pdf.read_lines()
+        start = time.perf_counter()
+        print_order_lines(lines)
+        storage.add_order(order_num, order_pdf.delivery_reference)
+        storage.add_order_lines(order_num, lines)
+        storage.commit()
+        order_pdf.timings['database'] = time.perf_counter() - start
+        print_timings(order_pdf.timings)
+        instrumentation.record_timings('pdf.', order_pdf.timings)
+        return 1, 0, 0
     except FileNotFoundError as e:
         print("File does not exist:", e)
+        return 0, 0, 1
 
 
-def load_barcodes(barcodes_csv_file):
-    try:
-        #check formatting of csv file, first column could be anything. 2nd do regex, 3rd do datetime check
-        with open(barcodes_csv_file) as csv_file:
-            read_csv = csv.reader(csv_file, delimiter=',')
-            for row in read_csv:
-                c.execute("SELECT count(*) "
-                          "FROM products "
-                          "WHERE barcode = ?",
-                          (row[0],))
-                if c.fetchone()[0] == 0:
-                    c.execute("INSERT INTO products "
-                              "VALUES(?,?,?,?)",
-                              (row[0], row[1], row[2], row[3]))
-        conn.commit()
-        return True
-    except Exception as e:
-        print("File does not exist:", e)
-        return False
+def prewarm_pdf_import(job):
+    prewarm()
 
 
-def export_barcodes(barcodes_csv_file):
+def import_pdf_files(job, pdf_names):
+    """
+    Imports the selected order PDFs
+    :param job: Job to report progress to
+    :param pdf_names: list of order PDF filenames
+    :return: (imported, skipped, failed) counts
+    """
+    storage = Storage(DATABASE_FILE)
     try:
-        c.execute('SELECT * FROM products')
-        with open(barcodes_csv_file, 'w', newline="") as output_file:
-            writer = csv.writer(output_file)
-            for result in c:
-                writer.writerow(result)
-        return True
-    except Exception as e:
-        print(e)
-        return False
-
-
-def initialise_db():
-    # check if db exists, if so, warn user then abort
-    c.execute('CREATE TABLE products('
-              'barcode TEXT, '
-              'product_code TEXT, '
-              'last_update NUMERIC, '
-              'primary_code NUMERIC, '
-              'PRIMARY KEY (barcode))')
-    c.execute('CREATE TABLE orders('
-              'order_number INTEGER, '
-              'internal_reference TEXT, '
-              'PRIMARY KEY(order_number))')
-    c.execute('CREATE TABLE scanned_products('
-              'order_number INTEGER, '
-              'product_code TEXT, '
-              'expected_quantity INTEGER, '
-              'scanned_quantity INTEGER, '
-              'PRIMARY KEY (order_number, product_code), '
-              'FOREIGN KEY (order_number) REFERENCES orders(order_number)'
-              'ON DELETE CASCADE)')
-    conn.commit()
+        if len(pdf_names) > 1:
+            # threads rather than processes, the extraction itself runs in Java and spawned worker processes
+            # would re-import this module and open another Kivy window
+            return import_pdfs(storage, pdf_names, executor_class=ThreadPoolExecutor, progress=job.progress)
+        job.progress(0, 1)
+        counts = load_pdf(storage, pdf_names[0])
+        job.progress(1, 1)
+        return counts
+    except BaseException:
+        # close commits, an order the import failed part way through is not kept
+        storage.conn.rollback()
+        raise
+    finally:
+        storage.close()
+
+
+def import_barcode_file(job, barcodes_csv_file):
+    """
+    Bulk imports a CSV of barcodes (barcode, product code, last update, primary code) into the database
+    Barcodes that already exist in the database are skipped, rows with missing columns are rejected
+    :param job: Job to report progress to, cancelling it rolls back the import
+    :param barcodes_csv_file: filename of the csv file
+    :return: (inserted, skipped, rejected) row counts
+    """
+    storage = Storage(DATABASE_FILE)
+    try:
+        #check formatting of csv file, first column could be anything. 2nd do regex, 3rd do datetime check
+        counts = storage.load_barcodes(barcodes_csv_file, progress=job.progress)
+        print(counts[0], "barcodes added,", counts[1], "already in database,", counts[2], "rejected.")
+        return counts
+    finally:
+        storage.close()
 
 
-def database_check():
-    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='products';")
-    prod_chk = bool(c.fetchone())
-    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='orders';")
-    order_chk = bool(c.fetchone())
-    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='scanned_products';")
-    scanned_prod_chk = bool(c.fetchone())
-    if prod_chk and order_chk and scanned_prod_chk:
-        return True
-    else:
-        return False
+def export_barcode_file(job, barcodes_csv_file):
+    storage = Storage(DATABASE_FILE)
+    try:
+        storage.export_barcodes(barcodes_csv_file, progress=job.progress)
+    finally:
+        storage.close()
 
 
 if __name__ == '__main__':
+    jobs.submit(open_database)
     StockChecker().run()
@@ -0,0 +1,31 @@
+"""
+Benchmark for batch PDF import
+Imports a folder of order PDFs into a fresh database with 1, 2, 4, ... worker processes to show scaling across cores
+Usage: python bench_batch_import.py <folder of order PDFs>
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from stockchecker_core.pdf_import import import_pdfs  # noqa: E402
+from stockchecker_core.storage import Storage  # noqa: E402
+
+
+def main():
+    folder = sys.argv[1]
+    pdf_names = sorted(os.path.join(folder, name) for name in os.listdir(folder) if name.lower().endswith('.pdf'))
+    workers = 1
+    with tempfile.TemporaryDirectory() as directory:
+        while True:
+            db = Storage(os.path.join(directory, 'workers%d.db' % workers))
+            db.initialise()
+            import_pdfs(db, pdf_names, workers)
+            db.close()
+            if workers >= os.cpu_count():
+                break
+            workers = min(workers * 2, os.cpu_count())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+Benchmark for batch scanning
+Replays a stream of barcode scans into an order one transaction per scan, as the interactive scan command and a
+terminal do, then through scan_lines in batches of increasing size
+Usage: python bench_batch_scan.py [number of scans]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from stockchecker_core.batch import scan_lines  # noqa: E402
+from stockchecker_core.storage import Storage  # noqa: E402
+
+ORDER_NUMBER = 40408133
+PRODUCTS = [('93000000%05d' % i, 'AA%04d' % i) for i in range(200)]
+
+
+def main():
+    scans = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    lines = [PRODUCTS[i % len(PRODUCTS)][0] + '\n' for i in range(scans)]
+    with tempfile.TemporaryDirectory() as directory:
+        db = Storage(os.path.join(directory, 'batch.db'))
+        db.initialise()
+        db.import_barcode_rows([barcode, product_code, '', 'false'] for barcode, product_code in PRODUCTS)
+        db.add_order(ORDER_NUMBER, 'SJ532017')
+        db.add_order_lines(ORDER_NUMBER, [(product_code, 1) for _, product_code in PRODUCTS])
+        db.commit()
+        print("{:30}{:>12}{:>15}".format("", "seconds", "scans/sec"))
+        # one transaction per scan is slow enough that a tenth of the scans shows the rate
+        for name, batch_size, count in [("per scan", 1, scans // 10), ("batches of 100", 100, scans),
+                                        ("batches of 1000", 1000, scans), ("batches of 10000", 10000, scans)]:
+            start = time.perf_counter()
+            counts = scan_lines(db, ORDER_NUMBER, lines[:count], batch_size=batch_size)
+            elapsed = time.perf_counter() - start
+            print("{:30}{:>12.2f}{:>15,.0f}".format(name, elapsed, counts['scans'] / elapsed))
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
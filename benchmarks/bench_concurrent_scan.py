@@ -0,0 +1,98 @@
+"""
+Load test for several stations scanning one order in a shared database
+Each scanner is a separate process with its own connection, scanning the same products of the same order. Runs
+the old read-modify-write update (SELECT scanned_quantity, then UPDATE ... SET scanned_quantity = ?) and
+ScanSession for growing numbers of scanners, and checks the scanned total against the number of scans made
+Usage: python bench_concurrent_scan.py [scans per scanner]
+"""
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from stockchecker_core.storage import BUSY_TIMEOUT, Storage  # noqa: E402
+
+ORDER_NUMBER = 40408133
+PRODUCT_CODES = ['AA%04d' % i for i in range(10)]
+SCANNER_COUNTS = [1, 2, 4, 8]
+
+
+def legacy_scanner(database_file, scans, start_barrier, results):
+    conn = sqlite3.connect(database_file, timeout=BUSY_TIMEOUT)
+    c = conn.cursor()
+    failed = 0
+    start_barrier.wait()
+    start = time.perf_counter()
+    for i in range(scans):
+        product_code = PRODUCT_CODES[i % len(PRODUCT_CODES)]
+        try:
+            c.execute("SELECT scanned_quantity FROM scanned_products WHERE order_number = ? AND product_code = ?",
+                      (ORDER_NUMBER, product_code))
+            scanned_quantity = c.fetchone()[0]
+            c.execute("UPDATE scanned_products SET scanned_quantity = ? WHERE order_number = ? AND product_code = ?",
+                      (scanned_quantity + 1, ORDER_NUMBER, product_code))
+            conn.commit()
+        except sqlite3.OperationalError:
+            conn.rollback()
+            failed += 1
+    results.put((time.perf_counter() - start, failed))
+    conn.close()
+
+
+def session_scanner(database_file, scans, start_barrier, results):
+    db = Storage(database_file)
+    session = db.scan_session(ORDER_NUMBER)
+    start_barrier.wait()
+    start = time.perf_counter()
+    for i in range(scans):
+        session.scan(PRODUCT_CODES[i % len(PRODUCT_CODES)])
+    session.finish()
+    results.put((time.perf_counter() - start, 0))
+    db.close()
+
+
+def run(scanner, directory, scanners, scans):
+    """
+    :return: (scans/sec over all scanners, scans lost, scans failed with an error)
+    """
+    database_file = os.path.join(directory, '%s_%d.db' % (scanner.__name__, scanners))
+    db = Storage(database_file)
+    db.initialise()
+    db.add_order(ORDER_NUMBER, 'SJ532017')
+    db.add_order_lines(ORDER_NUMBER, [(product_code, 0) for product_code in PRODUCT_CODES])
+    db.commit()
+
+    start_barrier = multiprocessing.Barrier(scanners)
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=scanner, args=(database_file, scans, start_barrier, results))
+                 for _ in range(scanners)]
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    scanned = sum(scanned_quantity for _, _, scanned_quantity in db.order_lines(ORDER_NUMBER))
+    db.close()
+    failed = sum(failed for _, failed in outcomes)
+    elapsed = max(seconds for seconds, _ in outcomes)
+    return scanners * scans / elapsed, scanners * scans - failed - scanned, failed
+
+
+def main():
+    scans = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print("{:>9}{:>24}{:>8}{:>8}{:>24}{:>8}".format("scanners", "read-modify-write (/s)", "lost", "failed",
+                                                   "ScanSession (/s)", "lost"))
+    with tempfile.TemporaryDirectory() as directory:
+        for scanners in SCANNER_COUNTS:
+            legacy_rate, legacy_lost, legacy_failed = run(legacy_scanner, directory, scanners, scans)
+            session_rate, session_lost, _ = run(session_scanner, directory, scanners, scans)
+            print("{:>9}{:>24.0f}{:>8}{:>8}{:>24.0f}{:>8}".format(scanners, legacy_rate, legacy_lost, legacy_failed,
+                                                                 session_rate, session_lost))
+
+
+if __name__ == '__main__':
+    main()
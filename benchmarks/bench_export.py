@@ -0,0 +1,58 @@
+"""
+Benchmark for barcode export and re-import
+Exports a products table with the old row by row CSV writer and with export_barcodes to CSV, gzipped CSV and a
+barcode database, then imports each file into an empty database
+Usage: python bench_export.py [number of rows]
+"""
+import csv
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from stockchecker_core.storage import Storage  # noqa: E402
+
+FORMATS = ['barcodes.csv', 'barcodes.csv.gz', 'barcodes.sqlite']
+
+
+def legacy_export(db, filename):
+    db.c.execute('SELECT * FROM products')
+    with open(filename, 'w', newline="") as output_file:
+        writer = csv.writer(output_file)
+        for result in db.c:
+            writer.writerow(result)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    with tempfile.TemporaryDirectory() as directory:
+        db = Storage(os.path.join(directory, 'source.db'))
+        db.initialise()
+        db.import_barcode_rows([str(9300000000000 + i), 'AA%04d' % (i % 10000), '01/01/2020', 'false']
+                               for i in range(rows))
+        db.commit()
+        print("{:20}{:>12}{:>12}{:>12}".format("format", "export (s)", "import (s)", "size (MB)"))
+        filename = os.path.join(directory, 'legacy.csv')
+        print("{:20}{:>12.2f}{:>12}{:>12.1f}".format("legacy csv", timed(legacy_export, db, filename), "",
+                                                     os.path.getsize(filename) / 1e6))
+        for name in FORMATS:
+            filename = os.path.join(directory, name)
+            export_seconds = timed(db.export_barcodes, filename)
+            target = Storage(os.path.join(directory, name + '.db'))
+            target.initialise()
+            import_seconds = timed(target.load_barcodes, filename)
+            target.close()
+            print("{:20}{:>12.2f}{:>12.2f}{:>12.1f}".format(name, export_seconds, import_seconds,
+                                                            os.path.getsize(filename) / 1e6))
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
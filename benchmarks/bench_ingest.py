@@ -0,0 +1,95 @@
+"""
+Load test for the scan ingest server
+Starts the server in its own process on a new database, then replays scans from several clients at once, each
+sending its scans in windows without waiting for every answer. Reports scans/sec and checks the scanned totals
+of the order against the scans sent
+Usage: python bench_ingest.py [scans per client] [clients]
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from stockchecker_core.ingest import INGEST_HOST, IngestServer  # noqa: E402
+from stockchecker_core.storage import Storage  # noqa: E402
+
+ORDER_NUMBER = 40408133
+DELIVERY_REFERENCE = 'SJ532017'
+PRODUCTS = [('93000000%05d' % i, 'AA%04d' % i) for i in range(100)]
+PORT = 8751
+# scans a client sends before reading their answers
+WINDOW = 200
+
+
+def run_server(database_file, ready, stop):
+    async def main():
+        server = IngestServer(database_file, INGEST_HOST, PORT)
+        await server.start()
+        ready.set()
+        await asyncio.get_running_loop().run_in_executor(None, stop.wait)
+        await server.close()
+    asyncio.run(main())
+
+
+async def client(scans, client_number):
+    """
+    :return: number of scans answered with an error
+    """
+    reader, writer = await asyncio.open_connection(INGEST_HOST, PORT)
+    errors = 0
+    for start in range(0, scans, WINDOW):
+        window = range(start, min(start + WINDOW, scans))
+        for i in window:
+            barcode, product_code = PRODUCTS[(i + client_number) % len(PRODUCTS)]
+            scan = {'order': DELIVERY_REFERENCE, 'barcode': barcode} if i % 2 else \
+                {'order': ORDER_NUMBER, 'product_code': product_code, 'quantity': 1}
+            writer.write((json.dumps(scan) + '\n').encode())
+        await writer.drain()
+        for _ in window:
+            if 'error' in json.loads(await reader.readline()):
+                errors += 1
+    writer.close()
+    await writer.wait_closed()
+    return errors
+
+
+async def replay(scans, clients):
+    return sum(await asyncio.gather(*[client(scans, i) for i in range(clients)]))
+
+
+def main():
+    scans = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    with tempfile.TemporaryDirectory() as directory:
+        database_file = os.path.join(directory, 'ingest.db')
+        db = Storage(database_file)
+        db.initialise()
+        db.import_barcode_rows([barcode, product_code, '', 'false'] for barcode, product_code in PRODUCTS)
+        db.add_order(ORDER_NUMBER, DELIVERY_REFERENCE)
+        db.add_order_lines(ORDER_NUMBER, [(product_code, 1) for _, product_code in PRODUCTS])
+        db.commit()
+
+        ready = multiprocessing.Event()
+        stop = multiprocessing.Event()
+        server = multiprocessing.Process(target=run_server, args=(database_file, ready, stop))
+        server.start()
+        ready.wait()
+        start = time.perf_counter()
+        errors = asyncio.run(replay(scans, clients))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        server.join()
+
+        scanned = sum(scanned_quantity for _, _, scanned_quantity in db.order_lines(ORDER_NUMBER))
+        db.close()
+        sent = scans * clients
+        print("{} clients, {:,} scans in {:.2f}s: {:,.0f} scans/sec".format(clients, sent, elapsed, sent / elapsed))
+        print("{:,} errors, {:,} scans missing from scanned_products".format(errors, sent - errors - scanned))
+
+
+if __name__ == '__main__':
+    main()
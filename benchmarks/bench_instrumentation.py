@@ -0,0 +1,51 @@
+"""
+Benchmark for the overhead of the hot path timers
+Times barcode lookups from the cache, the cheapest timed call, and scans written through a ScanSession, calling
+the undecorated functions, then the timed ones with timing off and on
+Usage: python bench_instrumentation.py [number of calls]
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from stockchecker_core import instrumentation  # noqa: E402
+from stockchecker_core.storage import ScanSession, Storage  # noqa: E402
+
+ORDER_NUMBER = 40408133
+PRODUCTS = [('93000000%05d' % i, 'AA%04d' % i) for i in range(100)]
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    with tempfile.TemporaryDirectory() as directory:
+        db = Storage(os.path.join(directory, 'instrumentation.db'))
+        db.initialise()
+        db.import_barcode_rows([barcode, product_code, '', 'false'] for barcode, product_code in PRODUCTS)
+        db.add_order(ORDER_NUMBER, 'SJ532017')
+        db.add_order_lines(ORDER_NUMBER, [(product_code, 1) for _, product_code in PRODUCTS])
+        db.commit()
+        session = db.scan_session(ORDER_NUMBER)
+        barcodes = [PRODUCTS[i % len(PRODUCTS)][0] for i in range(calls)]
+        product_codes = [PRODUCTS[i % len(PRODUCTS)][1] for i in range(calls // 10)]
+        lookup = Storage.lookup_barcode
+        record = ScanSession.record
+
+        print("{:30}{:>15}{:>15}".format("", "lookup (us)", "scan (us)"))
+        for name, enabled, lookup_function, record_function in [
+                ("undecorated", False, lookup.__wrapped__, record.__wrapped__),
+                ("timing off", False, lookup, record),
+                ("timing on", True, lookup, record)]:
+            instrumentation.enable(enabled)
+            lookup_seconds = timeit.timeit(lambda: [lookup_function(db, barcode) for barcode in barcodes], number=1)
+            scan_seconds = timeit.timeit(lambda: [record_function(session, [(product_code, 1, None)])
+                                                  for product_code in product_codes], number=1)
+            print("{:30}{:>15.3f}{:>15.1f}".format(name, lookup_seconds / len(barcodes) * 1e6,
+                                                    scan_seconds / len(product_codes) * 1e6))
+        session.finish()
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
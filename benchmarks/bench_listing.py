@@ -0,0 +1,62 @@
+"""
+Benchmark for product listings
+Compares the old listing, which fetched every product and formatted each row before printing, against the keyset
+paged product_pages written through write_pages as a table, CSV and JSON lines. Output goes to os.devnull, peak
+memory is measured with tracemalloc
+Usage: python bench_listing.py [number of products]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from stockchecker_core.output import write_pages  # noqa: E402
+from stockchecker_core.storage import Storage  # noqa: E402
+
+HEADER = ["Barcode", "Product Code", "Last Update", "Primary Code"]
+
+
+def legacy_listing(db, output):
+    db.c.execute("SELECT * FROM products ORDER BY product_code ASC")
+    data = db.c.fetchall()
+    row_format = "{:^35}" * (len(HEADER))
+    print(row_format.format(*HEADER), file=output)
+    for row in data:
+        print(row_format.format(*row), file=output)
+
+
+def measured(function, *args):
+    """
+    :return: (seconds, peak MB)
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 1e6
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+    with tempfile.TemporaryDirectory() as directory:
+        db = Storage(os.path.join(directory, 'listing.db'))
+        db.initialise()
+        db.import_barcode_rows([str(9300000000000 + i), 'AA%04d' % (i % 10000), '', 'false'] for i in range(rows))
+        db.commit()
+        print("{:20}{:>12}{:>12}".format("listing", "seconds", "peak (MB)"))
+        with open(os.devnull, 'w', newline="") as output:
+            results = [("legacy table", measured(legacy_listing, db, output))]
+            for fmt in ('table', 'csv', 'jsonl'):
+                results.append(("paged " + fmt,
+                                measured(write_pages, db.product_pages(), HEADER, output, fmt, 35)))
+        for name, (seconds, peak) in results:
+            print("{:20}{:>12.2f}{:>12.1f}".format(name, seconds, peak))
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Benchmark for bulk barcode import
+Compares rows/sec of the per-row SELECT + INSERT loop against the chunked INSERT OR IGNORE import
+Usage: python bench_load_barcodes.py [number of rows]
+"""
+import csv
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from stockchecker_core.storage import Storage  # noqa: E402
+
+
+def write_csv(filename, rows):
+    with open(filename, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        for i in range(rows):
+            writer.writerow([str(9300000000000 + i), 'AA%04d' % (i % 10000), '01/01/2020', 'false'])
+
+
+def legacy_import(db, filename):
+    c = db.c
+    with open(filename) as csv_file:
+        for row in csv.reader(csv_file, delimiter=','):
+            c.execute("SELECT count(*) "
+                      "FROM products "
+                      "WHERE barcode = ?",
+                      (row[0],))
+            if c.fetchone()[0] == 0:
+                c.execute("INSERT INTO products "
+                          "VALUES(?,?,?,?)",
+                          (row[0], row[1], row[2], row[3]))
+    db.commit()
+
+
+def bulk_import(db, filename):
+    db.load_barcodes(filename)
+
+
+def run(name, import_function, csv_filename, rows, directory):
+    db = Storage(os.path.join(directory, name + '.db'))
+    db.initialise()
+    start = time.perf_counter()
+    import_function(db, csv_filename)
+    elapsed = time.perf_counter() - start
+    db.close()
+    print("{:10}{:>10.2f}s{:>15,.0f} rows/sec".format(name, elapsed, rows / elapsed))
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    with tempfile.TemporaryDirectory() as directory:
+        csv_filename = os.path.join(directory, 'barcodes.csv')
+        write_csv(csv_filename, rows)
+        run('legacy', legacy_import, csv_filename, rows, directory)
+        run('bulk', bulk_import, csv_filename, rows, directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Benchmark for order lookups
+Compares resolving delivery references and customer order numbers with the old lookup (a query on the delivery
+reference, then a count on the order number) against the single query of resolve_order, and searching for part of
+a reference with a LIKE query against the in-memory OrderIndex of search_orders
+Usage: python bench_orders.py [number of orders]
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from stockchecker_core.storage import ORDER_SEARCH_LIMIT, Storage  # noqa: E402
+
+LOOKUPS = 2000
+
+
+def legacy_resolve(db, ref):
+    db.c.execute("SELECT order_number FROM orders WHERE internal_reference = ?", (ref.upper(),))
+    order_numbers = [row[0] for row in db.c]
+    if not order_numbers:
+        db.c.execute("SELECT count(*) FROM orders WHERE order_number = ?", (ref,))
+        if db.c.fetchone()[0] != 0:
+            order_numbers = [ref]
+    return order_numbers
+
+
+def like_search(db, text):
+    db.c.execute("SELECT order_number, internal_reference FROM orders "
+                 "WHERE internal_reference LIKE ? OR CAST(order_number AS TEXT) LIKE ? LIMIT ?",
+                 ('%' + text + '%', '%' + text + '%', ORDER_SEARCH_LIMIT))
+    return db.c.fetchall()
+
+
+def main():
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    with tempfile.TemporaryDirectory() as directory:
+        db = Storage(os.path.join(directory, 'orders.db'))
+        db.initialise()
+        db.c.executemany("INSERT INTO orders VALUES(?,?)",
+                         [(40400000 + i, 'SJ%06d' % i) for i in range(orders)])
+        db.commit()
+        # half delivery references, half customer order numbers, the second half the slow path of the old lookup
+        refs = ['SJ%06d' % (i * 7 % orders) for i in range(LOOKUPS // 2)] + \
+               [str(40400000 + i * 7 % orders) for i in range(LOOKUPS // 2)]
+        # what an operator has typed so far
+        partials = [ref[:len(ref) - 2] for ref in refs]
+
+        print("{:30}{:>15}".format("", "us/lookup"))
+        for name, function, inputs in [("legacy resolve", legacy_resolve, refs),
+                                       ("resolve_order", lambda db, ref: db.resolve_order(ref), refs),
+                                       ("LIKE search", like_search, partials),
+                                       ("search_orders", lambda db, text: db.search_orders(text), partials)]:
+            seconds = timeit.timeit(lambda: [function(db, text) for text in inputs], number=1)
+            print("{:30}{:>15.1f}".format(name, seconds / len(inputs) * 1e6))
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
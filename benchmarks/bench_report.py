@@ -0,0 +1,49 @@
+"""
+Benchmark for order report updates
+Compares the cost of updating a scanned row by searching the flat list of cells against the keyed OrderReport,
+for growing order sizes. Runs without Kivy, so the RecycleView refresh itself is not included
+Usage: python bench_report.py [number of scans]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from stockchecker_core.report import OrderReport  # noqa: E402
+from stockchecker_core.snapshot import OrderSnapshot  # noqa: E402
+
+ORDER_NUMBER = 40408133
+ORDER_SIZES = [100, 1000, 10000]
+
+
+def legacy_update(data_items, product_code, scanned_quantity, quantity):
+    for idx, item in enumerate(data_items):
+        if data_items[idx] == {'text': product_code}:
+            data_items[idx + 2] = {'text': str(scanned_quantity)}
+            data_items[idx + 3] = {'text': str(int(data_items[idx + 3]['text']) + quantity)}
+            break
+
+
+def main():
+    scans = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    print("{:>8}{:>20}{:>20}".format("rows", "search (us/scan)", "keyed (us/scan)"))
+    for size in ORDER_SIZES:
+        lines = [('AA%05d' % i, 10, 0) for i in range(size)]
+        # scan the products near the end of the order, the worst case for the search
+        product_codes = [lines[-1 - i % 10][0] for i in range(scans)]
+
+        legacy_report = OrderReport([])
+        legacy_report.load(ORDER_NUMBER, OrderSnapshot.from_rows(lines))
+        data_items = legacy_report.cells
+        legacy = timeit.timeit(lambda: [legacy_update(data_items, product_code, 1, 1)
+                                        for product_code in product_codes], number=1)
+
+        report = OrderReport([])
+        report.load(ORDER_NUMBER, OrderSnapshot.from_rows(lines))
+        keyed = timeit.timeit(lambda: [report.update(product_code, 1) for product_code in product_codes], number=1)
+
+        print("{:>8}{:>20.2f}{:>20.2f}".format(size, legacy / scans * 1e6, keyed / scans * 1e6))
+
+
+if __name__ == '__main__':
+    main()
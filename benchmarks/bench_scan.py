@@ -0,0 +1,82 @@
+"""
+Benchmark for scan latency
+Compares scans/sec of the per-scan UPDATE + commit against the batched ScanSession
+The database is created in the given directory (default: current directory) so disk syncs are included
+Usage: python bench_scan.py [number of scans] [directory]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from stockchecker_core.storage import Storage  # noqa: E402
+
+ORDER_NUMBER = 40408133
+PRODUCT_CODES = ['AA%04d' % i for i in range(200)]
+
+
+def create_order(db):
+    db.initialise()
+    db.add_order(ORDER_NUMBER, 'SJ532017')
+    db.add_order_lines(ORDER_NUMBER, [(product_code, 10) for product_code in PRODUCT_CODES])
+    db.commit()
+
+
+def legacy_scans(database, scans):
+    # plain connection in the default rollback journal mode, as the front-ends used before ScanSession
+    conn = sqlite3.connect(database)
+    c = conn.cursor()
+    c.execute('CREATE TABLE scanned_products('
+              'order_number INTEGER, '
+              'product_code TEXT, '
+              'expected_quantity INTEGER, '
+              'scanned_quantity INTEGER, '
+              'PRIMARY KEY (order_number, product_code))')
+    c.executemany("INSERT INTO scanned_products VALUES(?,?,10,0)",
+                  [(ORDER_NUMBER, product_code) for product_code in PRODUCT_CODES])
+    conn.commit()
+    start = time.perf_counter()
+    for i in range(scans):
+        product_code = PRODUCT_CODES[i % len(PRODUCT_CODES)]
+        c.execute("SELECT count(*), scanned_quantity "
+                  "FROM scanned_products "
+                  "WHERE order_number = ? "
+                  "AND product_code = ?",
+                  (ORDER_NUMBER, product_code,))
+        on_order = c.fetchone()
+        c.execute("UPDATE scanned_products "
+                  "SET scanned_quantity = ? "
+                  "WHERE order_number = ? AND product_code = ?",
+                  (on_order[1] + 1, ORDER_NUMBER, product_code,))
+        conn.commit()
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return elapsed
+
+
+def session_scans(database, scans):
+    db = Storage(database)
+    create_order(db)
+    start = time.perf_counter()
+    session = db.scan_session(ORDER_NUMBER)
+    for i in range(scans):
+        session.scan(PRODUCT_CODES[i % len(PRODUCT_CODES)])
+    session.finish()
+    elapsed = time.perf_counter() - start
+    db.close()
+    return elapsed
+
+
+def main():
+    scans = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    directory = sys.argv[2] if len(sys.argv) > 2 else os.getcwd()
+    with tempfile.TemporaryDirectory(dir=directory) as temp_directory:
+        for name, function in (('legacy', legacy_scans), ('session', session_scans)):
+            elapsed = function(os.path.join(temp_directory, name + '.db'), scans)
+            print("{:10}{:>10.2f}s{:>15,.0f} scans/sec".format(name, elapsed, scans / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark for the in-memory representation of an order
+Compares the {product code: [expected, scanned]} dict orders used to be loaded into against OrderSnapshot, for
+growing order sizes: memory held once loaded, time to load, and time for the totals, the discrepancy filter and a
+sort by difference, in ms. The report render makes the cells of the rows shown with matched rows hidden, as the
+RecycleView of the GUI needs them
+Usage: python bench_snapshot.py
+"""
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from stockchecker_core.report import OrderReport  # noqa: E402
+from stockchecker_core.snapshot import OrderSnapshot  # noqa: E402
+
+ORDER_NUMBER = 40408133
+ORDER_SIZES = [1000, 10000, 100000, 1000000]
+
+
+def order_rows(size):
+    # fresh strings for each load, as read from a database cursor
+    return [('AA%06d' % i, 10, 10 if i % 7 else 9 + i % 3) for i in range(size)]
+
+
+def dict_lines(rows):
+    return {product_code: [expected_quantity, scanned_quantity]
+            for product_code, expected_quantity, scanned_quantity in rows}
+
+
+def dict_totals(lines):
+    lines_matched = units_short = units_over = 0
+    for expected_quantity, scanned_quantity in lines.values():
+        difference = scanned_quantity - expected_quantity
+        if difference < 0:
+            units_short -= difference
+        elif difference > 0:
+            units_over += difference
+        else:
+            lines_matched += 1
+    return len(lines), lines_matched, units_short, units_over
+
+
+def dict_discrepancies(lines):
+    return [product_code for product_code, (expected_quantity, scanned_quantity) in lines.items()
+            if scanned_quantity != expected_quantity]
+
+
+def dict_sorted_by_difference(lines):
+    return sorted(lines, key=lambda product_code: (lines[product_code][1] - lines[product_code][0], product_code))
+
+
+def loaded_size(load, size):
+    """
+    :return: bytes allocated by loading the rows and kept once the rows themselves are dropped
+    """
+    rows = order_rows(size)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    loaded = load(rows)
+    del rows
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del loaded
+    return after - before
+
+
+def best(function, repeat=3):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def main():
+    print("{:>9}{:>12}{:>12}{:>12}{:>12}{:>12}{:>12}".format("lines", "", "MB", "load (ms)", "totals", "filter",
+                                                             "sort"))
+    for size in ORDER_SIZES:
+        rows = order_rows(size)
+        lines = dict_lines(rows)
+        snapshot = OrderSnapshot.from_rows(rows)
+        assert dict_totals(lines) == snapshot.totals()
+        assert dict_discrepancies(lines) == [snapshot.product_codes[row] for row in snapshot.discrepancy_rows()]
+        results = [("dict", loaded_size(dict_lines, size), best(lambda: dict_lines(rows)),
+                    best(lambda: dict_totals(lines)), best(lambda: dict_discrepancies(lines)),
+                    best(lambda: dict_sorted_by_difference(lines))),
+                   ("snapshot", loaded_size(OrderSnapshot.from_rows, size), best(lambda: OrderSnapshot.from_rows(rows)),
+                    best(snapshot.totals), best(snapshot.discrepancy_rows),
+                    best(snapshot.sorted_by_difference))]
+        for name, memory, *times in results:
+            print("{:>9}{:>12}{:>12.1f}".format(size, name, memory / 1e6) +
+                  "".join("{:>12.2f}".format(elapsed * 1e3) for elapsed in times))
+        report = OrderReport([], hide_matched=True)
+        render = best(lambda: report.load(ORDER_NUMBER, snapshot))
+        print("{:>9}{:>12}{:>36}{:>12.2f}  ({} rows shown)".format(size, "render", "", render * 1e3, len(report.rows)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Benchmark for startup time
+Starts fresh interpreters and times them until they are ready: an empty interpreter for reference, importing the
+CLI, running a command from the command line against a database, and loading tabula and pandas for the first PDF
+import, which now happens on first use or in the background
+Usage: python bench_startup.py [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+CLI_DIR = os.path.join(ROOT_DIR, 'StockChecker_CLI')
+
+
+def timed_runs(command, runs):
+    """
+    :return: wall clock seconds of each run of the command
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=CLI_DIR, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    with tempfile.TemporaryDirectory() as directory:
+        database_file = os.path.join(directory, 'startup.db')
+        subprocess.run([sys.executable, 'StockChecker.py', '--database', database_file, 'initialise'], cwd=CLI_DIR,
+                       check=True)
+        starts = [("python", [sys.executable, '-c', 'pass']),
+                  ("import CLI", [sys.executable, '-c', 'import StockChecker']),
+                  ("CLI orders command", [sys.executable, 'StockChecker.py', '--database', database_file, 'orders']),
+                  ("import CLI + PDF import ready", [sys.executable, '-c', 'import StockChecker; '
+                                                                          'StockChecker.prewarm()'])]
+        print("{:35}{:>12}{:>12}".format("", "median (ms)", "min (ms)"))
+        for name, command in starts:
+            times = timed_runs(command, runs)
+            print("{:35}{:>12.1f}{:>12.1f}".format(name, statistics.median(times) * 1e3, min(times) * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Micro-benchmarks for product code validation
+Compares compiling the regex on every call against the precompiled CodeValidator, for single codes, lists and
+pandas columns
+Usage: python bench_validation.py [number of codes]
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from stockchecker_core.validation import CodeValidator  # noqa: E402
+
+
+def compile_per_call(p_code):
+    regex = re.compile("^[a-zA-Z]{2}[0-9]{4}$")
+    if regex.match(p_code):
+        return True
+    else:
+        return False
+
+
+def report(name, seconds, count):
+    print("{:30}{:>10.4f}s{:>15,.0f} codes/sec".format(name, seconds, count / seconds))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    validator = CodeValidator.for_supplier()
+    codes = ['aa%04d' % (i % 10000) if i % 10 else 'invalid' for i in range(count)]
+
+    report('single, compile per call', timeit.timeit(lambda: [compile_per_call(code) for code in codes], number=1),
+           count)
+    report('single, precompiled', timeit.timeit(lambda: [validator.is_product_code(code) for code in codes],
+                                                number=1), count)
+    report('bulk list', timeit.timeit(lambda: validator.validate_product_codes(codes), number=1), count)
+    try:
+        import pandas as pd
+    except ImportError:
+        print("pandas not installed, skipping column benchmark")
+        return
+    column = pd.Series(codes)
+    report('bulk pandas column', timeit.timeit(lambda: validator.validate_product_code_column(column), number=1),
+           count)
+
+
+if __name__ == '__main__':
+    main()
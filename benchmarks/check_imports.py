@@ -0,0 +1,65 @@
+"""
+Startup import regression check
+Imports the CLI, and the stockchecker_core modules the GUI imports, in a fresh interpreter under -X importtime.
+Exits with status 1 if any of them imports a module that is only needed later, e.g. pandas and tabula which are
+only needed to parse a PDF, or if the imports take longer than the budget. Prints the slowest imports
+Usage: python check_imports.py [budget in ms]
+"""
+import os
+import subprocess
+import sys
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+# Modules imported on first use instead of at startup
+LAZY_MODULES = ('pandas', 'numpy', 'tabula', 'jpype', 'asyncio', 'multiprocessing', 'argparse', 'cProfile')
+
+# (name, code importing it, directory it runs in)
+STARTUP_IMPORTS = [
+    ("CLI", "import StockChecker", os.path.join(ROOT_DIR, 'StockChecker_CLI')),
+    ("GUI core modules", "import stockchecker_core.jobs, stockchecker_core.pdf_import, stockchecker_core.report, "
+                         "stockchecker_core.storage, stockchecker_core.validation, stockchecker_core.instrumentation",
+     ROOT_DIR),
+]
+DEFAULT_BUDGET_MS = 100
+SLOWEST_SHOWN = 8
+
+
+def import_times(code, directory):
+    """
+    :return: (module, self ms, cumulative ms) of every module imported by the code, in import order. Modules
+    imported by another module are indented by two spaces for each level
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=directory, capture_output=True,
+                            text=True, check=True)
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        times.append((module[1:].rstrip(), int(self_us) / 1e3, int(cumulative_us) / 1e3))
+    return times
+
+
+def main():
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET_MS
+    failures = 0
+    for name, code, directory in STARTUP_IMPORTS:
+        times = import_times(code, directory)
+        # the top level imports of the code are the ones not indented
+        total = sum(cumulative for module, _, cumulative in times if not module.startswith(' '))
+        print("{}: {:.1f}ms".format(name, total))
+        for module, self_ms, cumulative in sorted(times, key=lambda time: time[1], reverse=True)[:SLOWEST_SHOWN]:
+            print("    {:50}{:>8.1f}ms".format(module.strip(), self_ms))
+        eager = sorted({module.strip().split('.')[0] for module, _, _ in times} & set(LAZY_MODULES))
+        if eager:
+            failures += 1
+            print("FAIL", name, "imports at startup:", ", ".join(eager))
+        if total > budget:
+            failures += 1
+            print("FAIL", name, "imports take {:.1f}ms, over the budget of {:.0f}ms".format(total, budget))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
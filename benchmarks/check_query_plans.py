@@ -0,0 +1,115 @@
+"""
+Query plan regression check
+Runs the lookups used while importing and scanning against a freshly initialised database, and checks the query
+plan of every statement they execute. Exits with status 1 if any of them scans a whole table without an index or
+sorts through a temporary b-tree, other than the few statements listed below
+Usage: python check_query_plans.py
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from stockchecker_core.storage import Storage  # noqa: E402
+
+ORDER_NUMBER = 40408133
+# Tables that are read in full by design: the one row scan watermark
+FULL_SCAN_TABLES = {'scan_events_applied'}
+# The scan event log only grows, so walking all of it, even through an index, fails the check
+EVENT_LOG = 'scan_events'
+# Statements, by how they start, that group the scan events they read through a temporary b-tree by design. Both
+# read a bounded part of the log: the events after the watermark, and the events of one order
+GROUPED_EVENT_READS = ("SELECT sum(quantity), order_number, product_code, max(id) FROM scan_events NOT INDEXED "
+                       "WHERE id > ",
+                       "SELECT order_number, product_code, sum(quantity) FROM scan_events WHERE order_number = ")
+
+
+def hot_queries(db):
+    """
+    Runs the lookups of an import and scan session
+    :param db: Storage
+    :return:
+    """
+    db.import_barcode_rows([[str(9300000000000 + i), 'AA%04d' % i, '01/01/2020', 'false'] for i in range(100)])
+    db.add_order(ORDER_NUMBER, 'SJ532017')
+    db.add_order_lines(ORDER_NUMBER, [('AA%04d' % i, 10) for i in range(100)])
+    db.commit()
+    db.resolve_order('SJ532017')
+    db.resolve_order(str(ORDER_NUMBER))
+    db.search_orders('SJ53')
+    db.order_exists(ORDER_NUMBER)
+    db.order_lines(ORDER_NUMBER)
+    db.order_snapshot(ORDER_NUMBER)
+    db.order_product_codes(ORDER_NUMBER)
+    db.is_on_order(ORDER_NUMBER, 'AA0001')
+    db.set_expected_quantity(ORDER_NUMBER, 'AA0001', 5)
+    list(db.product_pages('AA', page_size=10))
+    list(db.product_pages(page_size=10))
+    list(db.order_line_pages(ORDER_NUMBER, page_size=10))
+    list(db.order_line_pages(ORDER_NUMBER, discrepancies_only=True, page_size=10))
+    db.barcode_exists('9300000000001')
+    db.lookup_barcode('9300000000001')
+    db.add_barcode('9300000009999', 'AA0001')
+    db.remove_barcode('9300000009999')
+    session = db.scan_session(ORDER_NUMBER)
+    session.scan('AA0001')
+    session.add_product('ZZ0001', 1)
+    session.undo(2)
+    session.finish()
+    db.scan_events(ORDER_NUMBER, limit=20)
+    db.order_summary(ORDER_NUMBER)
+    list(db.order_summary_pages(outstanding_only=True, page_size=1))
+    list(db.order_summary_pages(page_size=1))
+    db.replay_scans(ORDER_NUMBER)
+    db.remove_order(ORDER_NUMBER)
+
+
+def bad_plan_steps(db, statement):
+    """
+    :param db: Storage
+    :param statement: SQL statement with its parameters expanded
+    :return: query plan steps that scan a table without an index, scan the event log or use a temporary b-tree
+    """
+    bad = []
+    tables = set()
+    for row in db.conn.execute("EXPLAIN QUERY PLAN " + statement):
+        detail = row[-1]
+        words = detail.split()
+        if words[0] in ('SCAN', 'SEARCH'):
+            tables.add(words[1])
+        if (words[0] == 'SCAN' and ('USING' not in words or words[1] == EVENT_LOG) and
+                words[1] not in FULL_SCAN_TABLES) or \
+                ('TEMP B-TREE' in detail and not statement.startswith(GROUPED_EVENT_READS)):
+            bad.append(detail)
+    if tables and tables <= FULL_SCAN_TABLES:
+        return []
+    return bad
+
+
+def main():
+    statements = []
+    with tempfile.TemporaryDirectory() as directory:
+        db = Storage(os.path.join(directory, 'plans.db'))
+        db.initialise()
+        db.conn.set_trace_callback(statements.append)
+        hot_queries(db)
+        db.conn.set_trace_callback(None)
+        failures = 0
+        checked = set()
+        for statement in statements:
+            if statement in checked or not statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                continue
+            checked.add(statement)
+            bad = bad_plan_steps(db, statement)
+            if bad:
+                failures += 1
+                print("FAIL", statement)
+                for detail in bad:
+                    print("    ", detail)
+        db.close()
+    print(len(checked), "statements checked,", failures, "with table scans")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
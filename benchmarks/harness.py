@@ -0,0 +1,239 @@
+"""
+Benchmark suite for a whole stock check
+Runs the CLI commands of a stock check headlessly on synthetic data from synthetic.py: load barcodes, load pdf for
+every order, looking up orders, scanning every order, printing their reports and exporting the barcodes. Each
+command is fed scripted answers in place of the keyboard and its output is discarded. The best time of each step
+over the repeats is saved as JSON with the commit it was run on, and two result files can be compared to catch
+regressions between commits.
+Order PDFs are pre-parsed into the parsed PDF cache so the suite runs without Java, unless --parse-pdfs is given
+Usage:
+    python harness.py run [--barcodes N] [--orders N] [--lines N] [--seed N] [--repeat N] [--parse-pdfs]
+                          [--timers] [--output results.json]
+    python harness.py compare <baseline.json> <results.json> [--threshold 0.1]
+"""
+import argparse
+import builtins
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, os.pardir))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, os.pardir, 'StockChecker_CLI'))
+import StockChecker as cli  # noqa: E402
+import synthetic  # noqa: E402
+from stockchecker_core import instrumentation  # noqa: E402
+from stockchecker_core.pdf_import import ParsedPDFCache, cache_directory  # noqa: E402
+from stockchecker_core.storage import Storage  # noqa: E402
+
+# Order lookups made by the validate_order_input step, alternating delivery references and customer order numbers
+LOOKUPS = 1000
+
+
+def headless(function, args, answers):
+    """
+    Runs a CLI command with scripted answers to its prompts
+    :param function: CLI function, e.g. StockChecker.load_barcodes
+    :param args: arguments of the function
+    :param answers: what is typed at each prompt, in order
+    :return: what the function returns
+    """
+    answers = iter(answers)
+
+    def scripted_input(prompt=''):
+        try:
+            return next(answers)
+        except StopIteration:
+            raise RuntimeError("No scripted answer for the prompt " + repr(prompt)) from None
+
+    keyboard_input = builtins.input
+    builtins.input = scripted_input
+    try:
+        return function(*args)
+    finally:
+        builtins.input = keyboard_input
+
+
+def scan_answers(manifest, scans):
+    """
+    :param manifest: (customer order number, delivery reference, lines) from synthetic.order_manifests
+    :param scans: scan stream of the order from synthetic.scan_stream
+    :return: answers to the prompts of scan_order that check the order
+    """
+    answers = [manifest[1]]
+    for code, quantity, undone in scans:
+        answers.append(code)
+        if quantity is not None:
+            answers.append(str(quantity))
+        if undone:
+            answers.append("undo")
+    answers.append("finish")
+    return answers
+
+
+def run_suite(directory, barcodes, orders, lines, seed, parse_pdfs):
+    """
+    Runs every step once in a fresh database
+    :param directory: empty folder for the fixtures, database and parsed PDF cache, the current directory
+    :return: dict of step -> (seconds, operations)
+    """
+    manifests = synthetic.write_fixtures(directory, barcodes, orders, lines, seed)
+    pdf_names = [os.path.join(directory, 'orders', '%d.pdf' % order_number) for order_number, _, _ in manifests]
+    sqlite_file = os.path.join(directory, 'bench.db')
+    if not parse_pdfs:
+        pdf_cache = ParsedPDFCache(cache_directory(sqlite_file))
+        for pdf_name, (order_number, delivery_ref, order_lines) in zip(pdf_names, manifests):
+            pdf_cache.put(ParsedPDFCache.digest(pdf_name), order_number, delivery_ref, order_lines)
+    scans = [synthetic.scan_stream(manifest, seed) for manifest in manifests]
+    refs = [str(manifests[i // 2 % orders][0]) if i % 2 else manifests[i // 2 % orders][1] for i in range(LOOKUPS)]
+
+    db = Storage(sqlite_file)
+    timings = {}
+
+    def measure(step, operations, function):
+        start = time.perf_counter()
+        function()
+        timings[step] = (time.perf_counter() - start, operations)
+
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        db.initialise()
+        measure('load_barcodes', barcodes,
+                lambda: headless(cli.load_barcodes, (db,), ['catalogue.csv']))
+        measure('load_pdf', orders,
+                lambda: [headless(cli.load_pdf, (db,), [pdf_name]) for pdf_name in pdf_names])
+        measure('validate_order_input', len(refs),
+                lambda: [headless(cli.validate_order_input, (db,), [ref]) for ref in refs])
+        measure('scan_order', sum(len(order_scans) for order_scans in scans),
+                lambda: [headless(cli.scan_order, (db,), scan_answers(manifest, order_scans))
+                         for manifest, order_scans in zip(manifests, scans)])
+        measure('print_report', orders,
+                lambda: [cli.print_report(db, order_number) for order_number, _, _ in manifests])
+        measure('export_barcodes', barcodes,
+                lambda: headless(cli.export_barcodes, (db,), ['export.csv']))
+
+    # every order was scanned exactly as supplied, anything else means a step did not do its job
+    for order_number, _, order_lines in manifests:
+        order_summary = db.order_summary(order_number)
+        if order_summary is None or order_summary[1] != len(order_lines):
+            db.close()
+            raise RuntimeError("Order {} was not checked correctly: {}".format(order_number, order_summary))
+    db.close()
+    return timings
+
+
+def commit():
+    """
+    :return: git commit hash of the tree being benchmarked, or None if it is not a git checkout
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BENCHMARKS_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    parameters = {'barcodes': args.barcodes, 'orders': args.orders, 'lines': args.lines, 'seed': args.seed,
+                  'parse_pdfs': args.parse_pdfs, 'timers': args.timers}
+    instrumentation.enable(args.timers)
+    best = {}
+    working_directory = os.getcwd()
+    for repeat in range(args.repeat):
+        with tempfile.TemporaryDirectory() as directory:
+            # the parsed PDF cache is a folder in the current directory
+            os.chdir(directory)
+            try:
+                timings = run_suite(directory, args.barcodes, args.orders, args.lines, args.seed, args.parse_pdfs)
+            finally:
+                os.chdir(working_directory)
+        for step, (seconds, operations) in timings.items():
+            if step not in best or seconds < best[step][0]:
+                best[step] = (seconds, operations)
+        print("Run", repeat + 1, "of", args.repeat, "done in {:.2f}s".format(sum(s for s, _ in timings.values())))
+
+    results = {'commit': commit(),
+               'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'cpus': os.cpu_count(),
+               'parameters': parameters,
+               'steps': {step: {'seconds': round(seconds, 6), 'operations': operations,
+                                'us_per_operation': round(seconds / operations * 1e6, 3)}
+                         for step, (seconds, operations) in best.items()}}
+    if args.timers:
+        results['timers'] = {row[0]: dict(zip(['count', 'total_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'], row[1:]))
+                             for row in instrumentation.stats()}
+    print("{:25}{:>12}{:>12}{:>16}".format("step", "seconds", "operations", "us/operation"))
+    for step, result in results['steps'].items():
+        print("{:25}{:>12.3f}{:>12}{:>16.1f}".format(step, result['seconds'], result['operations'],
+                                                     result['us_per_operation']))
+    with open(args.output, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+    print("Results saved to", args.output)
+
+
+def compare(args):
+    """
+    Compares the time per operation of each step against a baseline
+    :return: 1 if any step is slower than the baseline by more than the threshold, otherwise 0
+    """
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    with open(args.results) as results_file:
+        results = json.load(results_file)
+    if baseline['parameters'] != results['parameters']:
+        print("Warning: results were run with different parameters,", baseline['parameters'], "and",
+              results['parameters'])
+    print("Baseline", baseline['commit'], "against", results['commit'])
+    print("{:25}{:>16}{:>16}{:>10}".format("step", "baseline (us)", "results (us)", "change"))
+    regressions = 0
+    for step, before in baseline['steps'].items():
+        after = results['steps'].get(step)
+        if after is None:
+            print("{:25}{:>16.1f}{:>16}".format(step, before['us_per_operation'], "missing"))
+            continue
+        change = after['us_per_operation'] / before['us_per_operation'] - 1
+        regressed = change > args.threshold
+        regressions += regressed
+        print("{:25}{:>16.1f}{:>16.1f}{:>+10.1%}{}".format(step, before['us_per_operation'],
+                                                          after['us_per_operation'], change,
+                                                          "  REGRESSION" if regressed else ""))
+    print(regressions, "steps slower by more than {:.0%}".format(args.threshold))
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite for a whole stock check on synthetic data")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help="run the suite and save the results as JSON")
+    run_parser.add_argument('--barcodes', type=int, default=10000, help="barcodes in the catalogue, 10k to 1M")
+    run_parser.add_argument('--orders', type=int, default=20, help="order PDFs to load and scan")
+    run_parser.add_argument('--lines', type=int, default=50, help="line items per order")
+    run_parser.add_argument('--seed', type=int, default=0, help="random seed of the synthetic data")
+    run_parser.add_argument('--repeat', type=int, default=3, help="runs of the suite, the best time of each step "
+                                                                  "is kept")
+    run_parser.add_argument('--parse-pdfs', action='store_true', help="parse the order PDFs with tabula, which "
+                                                                      "needs Java, instead of pre-parsing them")
+    run_parser.add_argument('--timers', action='store_true', help="also save the hot path timers of "
+                                                                  "stockchecker_core.instrumentation")
+    run_parser.add_argument('--output', default='results.json', help="file the results are saved to")
+    compare_parser = commands.add_parser('compare', help="compare results against a baseline")
+    compare_parser.add_argument('baseline', help="results of the baseline commit")
+    compare_parser.add_argument('results', help="results to compare")
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help="slowdown of a step reported as a regression, 0.1 for 10%%")
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""
+Synthetic data for the benchmarks
+Generates a barcode catalogue, order manifests and scan streams from a seed, so every run and every commit works on
+the same data. The catalogue has about three barcodes for every two product codes, like a real catalogue where some
+products have an alternate barcode. Order manifests are written as order PDFs laid out like the Jaycar order PDF
+(the areas and columns read by stockchecker_core.pdf_import), and as the tables parse_order_lines returns
+Usage: python synthetic.py <folder> [number of barcodes] [number of orders] [lines per order]
+"""
+import csv
+import gzip
+import json
+import os
+import random
+import sys
+
+# First barcode of the catalogue, barcode i is BARCODE_START + i
+BARCODE_START = 9300000000000
+FIRST_ORDER_NUMBER = 40400000
+LAST_UPDATE = '2024-01-01 00:00:00'
+
+# Landscape A4 in points, text is placed from the top of the page like the areas of pdf_import
+PAGE_WIDTH = 842
+PAGE_HEIGHT = 595
+LINE_HEIGHT = 12
+FIRST_PAGE_LINES_TOP = 115
+LINES_TOP = 60
+LINES_BOTTOM = 520
+
+
+def product_code(k):
+    """
+    :return: the k-th product code, two letters then four digits, e.g. 0 -> AA0000
+    """
+    letters = k // 10000
+    return chr(ord('A') + letters // 26 % 26) + chr(ord('A') + letters % 26) + '%04d' % (k % 10000)
+
+
+def product_count(barcodes):
+    """
+    :return: number of product codes in a catalogue of this many barcodes
+    """
+    return (2 * (barcodes - 1)) // 3 + 1
+
+
+def product_index(code):
+    """
+    :return: k of the product code, the inverse of product_code
+    """
+    return ((ord(code[0]) - ord('A')) * 26 + ord(code[1]) - ord('A')) * 10000 + int(code[2:])
+
+
+def barcode(k):
+    """
+    :return: first barcode of the k-th product code
+    """
+    return str(BARCODE_START + (3 * k + 1) // 2)
+
+
+def catalogue_rows(barcodes):
+    """
+    :param barcodes: number of barcodes, e.g. 10,000 to 1,000,000
+    :return: (barcode, product code, last update, primary code) rows, as in a barcode CSV
+    """
+    for i in range(barcodes):
+        k = i * 2 // 3
+        primary = (3 * k + 1) // 2 == i
+        yield str(BARCODE_START + i), product_code(k), LAST_UPDATE, 'true' if primary else 'false'
+
+
+def write_catalogue(filename, barcodes):
+    """
+    Writes the catalogue as a barcode CSV, gzipped if the filename ends in .gz
+    :return:
+    """
+    with (gzip.open(filename, 'wt', newline='') if filename.endswith('.gz') else
+          open(filename, 'w', newline='')) as csv_file:
+        csv.writer(csv_file).writerows(catalogue_rows(barcodes))
+
+
+def order_manifests(orders, lines, barcodes, seed=0):
+    """
+    :param orders: number of orders
+    :param lines: line items per order
+    :param barcodes: number of barcodes in the catalogue the products are picked from
+    :param seed: random seed
+    :return: (customer order number, delivery reference, [(product code, supplied quantity)]) of each order
+    """
+    rng = random.Random(seed)
+    products = product_count(barcodes)
+    manifests = []
+    for i in range(orders):
+        codes = [product_code(k) for k in rng.sample(range(products), min(lines, products))]
+        manifests.append((FIRST_ORDER_NUMBER + i, 'SJ%06d' % (532017 + i),
+                          [(code, rng.randint(1, 12)) for code in codes]))
+    return manifests
+
+
+def scan_stream(manifest, seed=0, manual=0.05, mistakes=0.02):
+    """
+    Scans that check an order, in random order
+    Most scans are barcodes, one per unit. Some lines are entered as a product code with their quantity, and some
+    lines get one scan too many, which is undone
+    :param manifest: (customer order number, delivery reference, lines) from order_manifests
+    :param seed: random seed, added to the order number so each order gets its own stream
+    :param manual: fraction of lines entered by product code
+    :param mistakes: fraction of lines with an extra scan that is undone
+    :return: list of (barcode or product code, quantity or None for a barcode scan, True if the scan is undone)
+    """
+    rng = random.Random(seed + manifest[0])
+    scans = []
+    for code, quantity in manifest[2]:
+        k = product_index(code)
+        if rng.random() < manual:
+            scans.append((code, quantity, False))
+        else:
+            scans.extend((barcode(k), None, False) for _ in range(quantity))
+        if rng.random() < mistakes:
+            scans.append((barcode(k), None, True))
+    rng.shuffle(scans)
+    return scans
+
+
+def pdf_string(text):
+    return '(' + str(text).replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') + ')'
+
+
+def pdf_page_text(cells):
+    """
+    :param cells: (x, top, text) of each piece of text on the page
+    :return: content stream drawing the text in 8pt Helvetica
+    """
+    return '\n'.join('BT /F1 8 Tf {} {} Td {} Tj ET'.format(x, PAGE_HEIGHT - top, pdf_string(text))
+                     for x, top, text in cells).encode('latin-1')
+
+
+def order_pdf_pages(order_number, delivery_ref, lines):
+    """
+    :return: text cells of each page of the order PDF
+    """
+    cells = [(25, 50, 'Jaycar'), (215, 50, 'Picking'), (270, 50, 'Slip'),
+             (25, 65, 'Customer Ord'), (110, 65, order_number), (215, 65, 'Del Ref'), (270, 65, delivery_ref),
+             (25, 100, 'Line'), (55, 100, 'Product'), (165, 100, 'Description'), (530, 100, 'Ordered'),
+             (605, 100, 'Supplied'), (670, 100, 'Unit')]
+    pages = []
+    top = FIRST_PAGE_LINES_TOP
+    for line_number, (code, quantity) in enumerate(lines, 1):
+        if top > LINES_BOTTOM:
+            pages.append(cells)
+            cells = [(25, 45, 'Line'), (55, 45, 'Product'), (165, 45, 'Description'), (530, 45, 'Ordered'),
+                     (605, 45, 'Supplied'), (670, 45, 'Unit')]
+            top = LINES_TOP
+        cells.extend([(25, top, line_number), (55, top, code), (165, top, 'Synthetic product ' + code),
+                      (530, top, quantity), (605, top, quantity), (670, top, 'EA')])
+        top += LINE_HEIGHT
+    pages.append(cells)
+    return pages
+
+
+def write_order_pdf(filename, order_number, delivery_ref, lines):
+    """
+    Writes an order as a text-only PDF, with the order header and line items where tabula looks for them
+    :return:
+    """
+    pages = order_pdf_pages(order_number, delivery_ref, lines)
+    # 1 catalog, 2 page tree, 3 font, then a page and its content stream for each page
+    page_ids = [4 + 2 * i for i in range(len(pages))]
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>',
+               ('<< /Type /Pages /Kids [' + ' '.join('%d 0 R' % page_id for page_id in page_ids) +
+                '] /Count %d >>' % len(pages)).encode(),
+               b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    for page_id, cells in zip(page_ids, pages):
+        content = pdf_page_text(cells)
+        objects.append(('<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << /Font << /F1 3 0 R >> >> '
+                        '/Contents %d 0 R >>' % (PAGE_WIDTH, PAGE_HEIGHT, page_id + 1)).encode())
+        objects.append(b'<< /Length %d >>\nstream\n' % len(content) + content + b'\nendstream')
+    with open(filename, 'wb') as pdf_file:
+        pdf_file.write(b'%PDF-1.4\n')
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(pdf_file.tell())
+            pdf_file.write(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+        xref = pdf_file.tell()
+        pdf_file.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+        pdf_file.writelines(b'%010d 00000 n \n' % offset for offset in offsets)
+        pdf_file.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref))
+
+
+def write_fixtures(folder, barcodes, orders, lines, seed=0):
+    """
+    Writes catalogue.csv, an order PDF per order in orders/, the manifests as orders.json and the scans of every
+    order as scans.jsonl, in the JSON lines accepted by the scan ingest server, which has no undo so the extra scans
+    are left out
+    :return: manifests from order_manifests
+    """
+    os.makedirs(os.path.join(folder, 'orders'), exist_ok=True)
+    write_catalogue(os.path.join(folder, 'catalogue.csv'), barcodes)
+    manifests = order_manifests(orders, lines, barcodes, seed)
+    for order_number, delivery_ref, order_lines in manifests:
+        write_order_pdf(os.path.join(folder, 'orders', '%d.pdf' % order_number), order_number, delivery_ref,
+                        order_lines)
+    with open(os.path.join(folder, 'orders.json'), 'w') as manifest_file:
+        json.dump([{'order_number': order_number, 'delivery_reference': delivery_ref, 'lines': order_lines}
+                   for order_number, delivery_ref, order_lines in manifests], manifest_file)
+    with open(os.path.join(folder, 'scans.jsonl'), 'w') as scans_file:
+        for manifest in manifests:
+            for code, quantity, undone in scan_stream(manifest, seed):
+                if undone:
+                    continue
+                scan = {'order': manifest[0], 'barcode': code} if quantity is None else \
+                    {'order': manifest[0], 'product_code': code, 'quantity': quantity}
+                scans_file.write(json.dumps(scan) + '\n')
+    return manifests
+
+
+def main():
+    folder = sys.argv[1]
+    barcodes = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    orders = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    lines = int(sys.argv[4]) if len(sys.argv) > 4 else 50
+    write_fixtures(folder, barcodes, orders, lines)
+    print("Wrote", barcodes, "barcodes and", orders, "orders of", lines, "lines to", folder)
+
+
+if __name__ == '__main__':
+    main()
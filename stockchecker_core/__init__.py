@@ -0,0 +1,3 @@
+"""
+Code shared by the StockChecker CLI and GUI
+"""
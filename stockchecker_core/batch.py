@@ -0,0 +1,125 @@
+"""
+Batch scanning
+Scans streamed from a file, or from a barcode wedge on stdin, one per line:
+    9300000000001       a barcode, counts 1
+    AA1234              a product code, counts 1
+    AA1234,3            a product code and quantity, also AA1234 3
+    undo                cancels the last scan made by the station, undo 3 the last three
+Blank lines and lines starting with # are skipped. Scans are applied through a ScanSession in batches, one
+transaction per batch, and scans that can't be counted are handled by the policies given up front instead of
+asking: skip them, stop at them, or for products that are not on the order, force add them
+"""
+from stockchecker_core.validation import pn_regex_check
+
+# Scans applied per transaction
+SCAN_BATCH_SIZE = 1000
+
+# What happens to barcodes that are not in the database and text that isn't a product code
+UNKNOWN_POLICIES = ('skip', 'fail')
+# What happens to products that are not on the order
+NOT_ON_ORDER_POLICIES = ('skip', 'add', 'fail')
+
+
+class ScanRejected(ValueError):
+    """
+    Raised by scan_lines at a scan the fail policy stops at, scans before it are recorded
+    """
+    def __init__(self, line_number, line, reason):
+        super(ScanRejected, self).__init__("line {}: {}: {}".format(line_number, line, reason))
+        self.line_number = line_number
+        self.line = line
+        self.reason = reason
+
+
+def parse_scan(line):
+    """
+    :param line: scan line, stripped
+    :return: (barcode or product code, quantity or None if no quantity was given)
+    :raises ValueError: if the quantity is not a whole number
+    """
+    code, _, quantity = line.replace(',', ' ').partition(' ')
+    quantity = quantity.strip()
+    return code, int(quantity) if quantity else None
+
+
+def scan_lines(db, order_number, lines, unknown='skip', not_on_order='skip', batch_size=SCAN_BATCH_SIZE,
+               station=None, rejected=None):
+    """
+    Applies a stream of scan lines to an order
+    :param db: Storage
+    :param order_number: customer order number
+    :param lines: iterable of scan lines, e.g. a file or sys.stdin, read as the scans are applied
+    :param unknown: one of UNKNOWN_POLICIES
+    :param not_on_order: one of NOT_ON_ORDER_POLICIES
+    :param batch_size: scans applied per transaction
+    :param station: name the scans are recorded under, STATION if None
+    :param rejected: called with (line number, line, reason) for each scan that is skipped
+    :return: dict of counts: scans and units recorded, scans undone, unknown and not on order scans skipped, and
+    products added to the order
+    :raises ScanRejected: at the first scan a fail policy applies to
+    """
+    counts = dict.fromkeys(('scans', 'units', 'undone', 'unknown', 'not_on_order', 'added'), 0)
+    session = db.scan_session(order_number, station)
+    batch = []
+
+    def apply_batch():
+        if batch:
+            session.scan_many(batch)
+            counts['scans'] += len(batch)
+            counts['units'] += sum(quantity for _, quantity in batch)
+            batch.clear()
+
+    def reject(line_number, line, reason, policy, count):
+        if policy == 'fail':
+            apply_batch()
+            raise ScanRejected(line_number, line, reason)
+        counts[count] += 1
+        if rejected is not None:
+            rejected(line_number, line, reason)
+
+    try:
+        for line_number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line == 'undo' or line.startswith('undo '):
+                undo_count = line[len('undo'):].strip() or '1'
+                if not undo_count.isdigit():
+                    reject(line_number, line, "undo count is not a whole number", unknown, 'unknown')
+                    continue
+                apply_batch()
+                counts['undone'] += len(session.undo(int(undo_count)))
+                continue
+            try:
+                code, quantity = parse_scan(line)
+            except ValueError:
+                reject(line_number, line, "quantity is not a whole number", unknown, 'unknown')
+                continue
+            # a quantity means a product code was typed, otherwise the barcode is looked up first
+            product_code = db.lookup_barcode(code) if quantity is None else None
+            if product_code is None:
+                product_code = code.upper()
+                if not pn_regex_check(product_code):
+                    reject(line_number, line, "barcode does not exist in database or product code is invalid "
+                                              "formatting (2 letters, 4 digits)", unknown, 'unknown')
+                    continue
+            if quantity is None:
+                quantity = 1
+            if not session.is_on_order(product_code):
+                if not_on_order == 'add':
+                    apply_batch()
+                    session.add_product(product_code, quantity)
+                    counts['added'] += 1
+                    counts['scans'] += 1
+                    counts['units'] += quantity
+                else:
+                    reject(line_number, line, product_code + " is not on the order list", not_on_order,
+                           'not_on_order')
+                continue
+            batch.append((product_code, quantity))
+            if len(batch) >= batch_size:
+                apply_batch()
+        apply_batch()
+    finally:
+        session.finish()
+    return counts
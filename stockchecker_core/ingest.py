@@ -0,0 +1,244 @@
+"""
+Scan ingest server
+Handheld scanners and other stations send scans over TCP on the local machine, one JSON object per line:
+    {"order": "SJ532017", "barcode": "9300000000001"}
+    {"order": 40408133, "product_code": "AA1234", "quantity": 2, "station": "handheld 3"}
+order is a delivery reference or customer order number, quantity defaults to 1 and station, the name the scan is
+recorded under in the scan event log, to "ingest". Each scan is answered, in the order sent, with the running
+totals of its line once the scan is recorded:
+    {"order": "40408133", "product_code": "AA1234", "expected": 10, "scanned": 3, "difference": -7}
+or with {"error": "..."}. Clients can send many scans before reading the answers.
+Scans from every client are queued and applied in batches on one database connection, through the ScanSession of
+each order and station, so a batch costs one transaction however many scans it holds
+"""
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from stockchecker_core.storage import (DATABASE_FILE, SCAN_FLUSH_INTERVAL, SQLITE_INTEGER_MAX, SQLITE_INTEGER_MIN,
+                                       Storage)
+from stockchecker_core.validation import pn_regex_check
+
+INGEST_HOST = '127.0.0.1'
+INGEST_PORT = 8750
+INGEST_STATION = 'ingest'
+
+# Most scans applied in one transaction, and scans queued before clients are made to wait
+INGEST_BATCH_SIZE = 1000
+INGEST_QUEUE_SIZE = 10 * INGEST_BATCH_SIZE
+
+
+class IngestServer:
+    """
+    asyncio server that queues the scans of its clients and applies them on a database thread
+    While a batch is being written, scans that arrive queue up for the next one, so batches grow with the load
+    """
+    def __init__(self, database_file=DATABASE_FILE, host=INGEST_HOST, port=INGEST_PORT,
+                 batch_size=INGEST_BATCH_SIZE):
+        self.database_file = database_file
+        self.host = host
+        self.port = port
+        self.batch_size = batch_size
+        self.queue = None
+        self.server = None
+        self.batcher = None
+        # the sqlite connection can only be used on the thread that opened it
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ingest')
+        self.db = None
+        self.orders = {}
+        self.sessions = {}
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.db = await loop.run_in_executor(self.executor, Storage, self.database_file)
+        if not await loop.run_in_executor(self.executor, self.db.is_initialised):
+            raise RuntimeError("Database is not initialised: " + self.database_file)
+        self.queue = asyncio.Queue(INGEST_QUEUE_SIZE)
+        self.batcher = asyncio.create_task(self.apply_batches())
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+
+    async def close(self):
+        """
+        Stops accepting scans, then writes every session to scanned_products and closes the database
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        if self.server is not None:
+            # not wait_closed, which waits for every client to disconnect
+            self.server.close()
+        if self.batcher is not None:
+            self.batcher.cancel()
+            try:
+                await self.batcher
+            except asyncio.CancelledError:
+                pass
+        if self.db is not None:
+            await loop.run_in_executor(self.executor, self.close_database)
+        self.executor.shutdown(wait=True)
+
+    async def handle_client(self, reader, writer):
+        """
+        Reads the scans of one client and queues them, while its answers are written back in order
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        answers = asyncio.Queue()
+        answer_writer = asyncio.create_task(self.write_answers(writer, answers))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                answer = loop.create_future()
+                try:
+                    scan = json.loads(line)
+                    if not isinstance(scan, dict):
+                        raise ValueError("expected a JSON object")
+                except ValueError as e:
+                    answer.set_result({'error': "Invalid scan: " + str(e)})
+                else:
+                    await self.queue.put((scan, answer))
+                answers.put_nowait(answer)
+        except ConnectionError:
+            pass
+        finally:
+            answers.put_nowait(None)
+            await answer_writer
+            writer.close()
+
+    @staticmethod
+    async def write_answers(writer, answers):
+        while True:
+            answer = await answers.get()
+            if answer is None:
+                break
+            try:
+                writer.write((json.dumps(await answer) + '\n').encode())
+                if answers.empty():
+                    await writer.drain()
+            except ConnectionError:
+                # the client has gone, keep taking its answers so the reader can finish
+                continue
+
+    async def apply_batches(self):
+        """
+        Applies queued scans on the database thread, flushing the sessions when no scans arrive for a while
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                first = await asyncio.wait_for(self.queue.get(), SCAN_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                await loop.run_in_executor(self.executor, self.flush)
+                continue
+            batch = [first]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                results = await loop.run_in_executor(self.executor, self.apply, [scan for scan, _ in batch])
+            except Exception as e:
+                results = [{'error': "Scan not recorded: " + str(e)}] * len(batch)
+            for (_, answer), result in zip(batch, results):
+                if not answer.done():
+                    answer.set_result(result)
+
+    # The methods below run on the database thread
+
+    def session(self, order_ref, station):
+        """
+        :param order_ref: delivery reference or customer order number
+        :param station: name the scans are recorded under
+        :return: ScanSession of the order, or None if the reference doesn't match exactly one order
+        """
+        order_ref = str(order_ref).upper()
+        order_number = self.orders.get(order_ref)
+        if order_number is None:
+            order_numbers = self.db.resolve_order(order_ref)
+            if len(order_numbers) != 1:
+                return None
+            order_number = str(order_numbers[0])
+            self.orders[order_ref] = order_number
+        session = self.sessions.get((order_number, station))
+        if session is None:
+            session = self.sessions[order_number, station] = self.db.scan_session(order_number, station)
+        return session
+
+    def resolve_scan(self, scan):
+        """
+        :param scan: scan sent by a client
+        :return: (ScanSession, product code, quantity), or an error answer
+        """
+        session = self.session(scan.get('order', ''), str(scan.get('station', INGEST_STATION)))
+        if session is None:
+            return {'error': "Order not found: " + str(scan.get('order'))}
+        quantity = scan.get('quantity', 1)
+        if not isinstance(quantity, int) or isinstance(quantity, bool):
+            return {'error': "Quantity must be a whole number"}
+        if not SQLITE_INTEGER_MIN <= quantity <= SQLITE_INTEGER_MAX:
+            return {'error': "Quantity is out of range: " + str(quantity)}
+        if 'barcode' in scan:
+            product_code = self.db.lookup_barcode(str(scan['barcode']))
+            if product_code is None:
+                return {'error': "Barcode does not exist in database: " + str(scan['barcode'])}
+        else:
+            product_code = str(scan.get('product_code', '')).upper()
+            if not pn_regex_check(product_code):
+                return {'error': "Product Code is invalid formatting (2 letters, 4 digits)"}
+        if not session.is_on_order(product_code):
+            return {'error': product_code + " is not on the order list"}
+        return session, product_code, quantity
+
+    def apply(self, scans):
+        """
+        Records a batch of scans, one scan_many per order and station
+        Each scan_many commits on its own, so if one fails only the scans of that order and station are answered with
+        the error, and the scans of the other sessions still get their totals
+        :param scans: scans sent by clients
+        :return: answer to each scan
+        """
+        answers = [self.resolve_scan(scan) for scan in scans]
+        by_session = {}
+        for index, answer in enumerate(answers):
+            if isinstance(answer, tuple):
+                session, product_code, quantity = answer
+                by_session.setdefault(session, []).append((index, product_code, quantity))
+        for session, session_scans in by_session.items():
+            try:
+                scanned_quantities = session.scan_many([(product_code, quantity)
+                                                        for _, product_code, quantity in session_scans])
+            except Exception as e:
+                for index, _, _ in session_scans:
+                    answers[index] = {'error': "Scan not recorded: " + str(e)}
+                continue
+            for (index, product_code, _), scanned_quantity in zip(session_scans, scanned_quantities):
+                expected_quantity = session.snapshot.expected_quantity(product_code)
+                answers[index] = {'order': session.order_number,
+                                  'product_code': product_code,
+                                  'expected': expected_quantity,
+                                  'scanned': scanned_quantity,
+                                  'difference': scanned_quantity - expected_quantity}
+        return answers
+
+    def flush(self):
+        for session in self.sessions.values():
+            session.flush()
+
+    def close_database(self):
+        for session in self.sessions.values():
+            session.finish()
+        self.db.close()
+
+
+async def serve(database_file=DATABASE_FILE, host=INGEST_HOST, port=INGEST_PORT):
+    """
+    Runs the ingest server until it is cancelled, e.g. by Ctrl+C under asyncio.run
+    :return:
+    """
+    server = IngestServer(database_file, host, port)
+    try:
+        await server.start()
+        print("Listening for scans on {}:{}".format(host, port))
+        await server.server.serve_forever()
+    finally:
+        await server.close()
@@ -0,0 +1,188 @@
+"""
+Timers for the hot paths of scanning, importing and reporting
+Storage queries, scan writes, PDF parsing stages and report updates are timed under dotted names, e.g.
+storage.lookup_barcode or pdf.line items, and stats() gives the count, total and p50/p95/p99 latencies of each.
+Timing is off unless enabled with enable() or the STOCKCHECKER_STATS=1 environment variable, and while it is off
+a timed call costs one extra function call and a flag check.
+cProfile can be started and dumped to a file for a closer look at one thread, e.g. the database thread of the GUI
+"""
+import functools
+import os
+import threading
+import time
+from collections import deque
+
+# Most recent durations kept per timer to work out percentiles
+SAMPLE_SIZE = 2048
+
+enabled = os.environ.get('STOCKCHECKER_STATS') == '1'
+timers = {}
+timers_lock = threading.Lock()
+profiler = None
+
+
+class Timer:
+    """
+    Count, total and most recent durations of one timed call or stage
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.samples = deque(maxlen=SAMPLE_SIZE)
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.count += 1
+            self.total += seconds
+            if seconds > self.maximum:
+                self.maximum = seconds
+            self.samples.append(seconds)
+
+    def percentiles(self, *percents):
+        """
+        :param percents: e.g. 50, 95, 99
+        :return: duration at each percentile of the recent samples, in seconds
+        """
+        with self.lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return [0.0 for _ in percents]
+        return [samples[min(len(samples) - 1, int(len(samples) * percent / 100))] for percent in percents]
+
+
+def timer(name):
+    """
+    :return: Timer for the name, created on first use
+    """
+    found = timers.get(name)
+    if found is None:
+        with timers_lock:
+            found = timers.setdefault(name, Timer())
+    return found
+
+
+def record(name, seconds):
+    if enabled:
+        timer(name).record(seconds)
+
+
+def record_timings(prefix, timings):
+    """
+    Records the stage timings of an import, e.g. OrderPDF.timings, which may come back from a worker process
+    :param prefix: prepended to each stage name
+    :param timings: dict of stage -> seconds
+    :return:
+    """
+    if enabled:
+        for stage, seconds in timings.items():
+            timer(prefix + stage).record(seconds)
+
+
+def timed(name):
+    """
+    Decorator that records the duration of each call under the name while timing is enabled
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timer(name).record(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class stage:
+    """
+    Context manager that records the duration of a block under the name while timing is enabled
+    """
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start is not None:
+            timer(self.name).record(time.perf_counter() - self.start)
+        return False
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def reset():
+    with timers_lock:
+        timers.clear()
+
+
+def stats():
+    """
+    :return: (name, count, total ms, p50 ms, p95 ms, p99 ms, max ms) rows of every timer, by name
+    """
+    rows = []
+    for name, found in sorted(timers.items()):
+        p50, p95, p99 = found.percentiles(50, 95, 99)
+        rows.append((name, found.count, round(found.total * 1e3, 1), round(p50 * 1e3, 3), round(p95 * 1e3, 3),
+                     round(p99 * 1e3, 3), round(found.maximum * 1e3, 3)))
+    return rows
+
+
+STATS_HEADER = ["Timer", "Count", "Total (ms)", "p50 (ms)", "p95 (ms)", "p99 (ms)", "Max (ms)"]
+
+
+def format_stats():
+    """
+    :return: stats() as a table for a terminal or monospaced label, timer names in a wider column of their own
+    """
+    row_format = "{:<34}" + "{:>11}" * (len(STATS_HEADER) - 1)
+    return "\n".join(row_format.format(*row) for row in [STATS_HEADER] + stats())
+
+
+def profiling():
+    return profiler is not None
+
+
+def start_profile():
+    """
+    Starts cProfile on the calling thread
+    :return: False if a profile is already running
+    """
+    global profiler
+    if profiler is not None:
+        return False
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return True
+
+
+def stop_profile(filename):
+    """
+    Stops the profile started by start_profile, on the same thread, and writes it to a file that can be read with
+    python -m pstats or snakeviz
+    :param filename: file to write the profile to
+    :return: False if no profile was running
+    """
+    global profiler
+    if profiler is None:
+        return False
+    profiler.disable()
+    try:
+        profiler.dump_stats(filename)
+    finally:
+        profiler = None
+    return True
@@ -0,0 +1,117 @@
+"""
+Background jobs for the GUI
+Database and import work runs on worker threads so it doesn't block the UI. Results, errors and progress are
+handed back through a schedule function, e.g. one that calls Clock.schedule_once, so callbacks always run on the
+UI thread
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """
+    A submitted piece of work. Long running work is given its Job, and reports progress through it
+    """
+    def __init__(self, runner, on_done=None, on_error=None, on_progress=None):
+        self.runner = runner
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        """
+        Asks the job to stop. Work that hasn't started is dropped, running work stops at its next progress report
+        :return:
+        """
+        self.cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def progress(self, done, total=None):
+        """
+        Reports progress, called from the worker thread
+        :param done: amount of work done so far
+        :param total: total amount of work, or None if not known
+        :return:
+        """
+        if self.cancelled:
+            raise JobCancelled()
+        if self.on_progress is not None:
+            self.runner.schedule(self.on_progress, done, total)
+
+    def finished(self, future):
+        self.runner.background_jobs.discard(self)
+        if future.cancelled():
+            if self.on_error is not None:
+                self.runner.schedule(self.on_error, JobCancelled())
+            return
+        error = future.exception()
+        if error is not None:
+            if self.on_error is not None:
+                self.runner.schedule(self.on_error, error)
+            else:
+                print("Background job failed:", repr(error))
+        elif self.on_done is not None:
+            self.runner.schedule(self.on_done, future.result())
+
+
+class JobRunner:
+    """
+    Two single worker threads: one owns the database connection of the UI and runs its queries in the order they
+    are submitted, e.g. the scans of a session, and the other runs long jobs such as imports and exports, which
+    open their own connection so they don't hold up the first
+    """
+    def __init__(self, schedule):
+        """
+        :param schedule: function(callback, *args) that runs the callback on the UI thread
+        """
+        self.schedule = schedule
+        self.db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='database')
+        self.background_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='background')
+        self.background_jobs = set()
+
+    def submit(self, function, *args, on_done=None, on_error=None):
+        """
+        Runs function(*args) on the database thread
+        :param on_done: called with the result on the UI thread
+        :param on_error: called with the exception on the UI thread
+        :return: Job
+        """
+        job = Job(self, on_done, on_error)
+        job.future = self.db_executor.submit(function, *args)
+        job.future.add_done_callback(job.finished)
+        return job
+
+    def submit_background(self, function, *args, on_done=None, on_error=None, on_progress=None):
+        """
+        Runs function(job, *args) on the background thread
+        :param on_done: called with the result on the UI thread
+        :param on_error: called with the exception on the UI thread, JobCancelled if the job was cancelled
+        :param on_progress: called with (done, total) on the UI thread each time the job reports progress
+        :return: Job
+        """
+        job = Job(self, on_done, on_error, on_progress)
+        self.background_jobs.add(job)
+        job.future = self.background_executor.submit(function, job, *args)
+        job.future.add_done_callback(job.finished)
+        return job
+
+    def shutdown(self):
+        """
+        Cancels long jobs, waits for submitted work to finish and stops the threads
+        :return:
+        """
+        for job in list(self.background_jobs):
+            job.cancel()
+        self.background_executor.shutdown(wait=True)
+        self.db_executor.shutdown(wait=True)
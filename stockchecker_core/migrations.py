@@ -0,0 +1,178 @@
+"""
+Schema migrations
+The schema version of a database is kept in PRAGMA user_version. Version 0 is the schema created by
+Storage.initialise, and every migration below upgrades a database one version, in place, in its own transaction
+"""
+
+# (version, description, statements), in order. Add new migrations to the end, never edit applied ones
+MIGRATIONS = [
+    (1, "index order lookups by delivery reference and products by product code",
+     ["CREATE INDEX IF NOT EXISTS orders_internal_reference "
+      "ON orders(internal_reference)",
+      # covers the product code -> barcode lookups and product listing without touching the table
+      "CREATE INDEX IF NOT EXISTS products_product_code "
+      "ON products(product_code, barcode)"]),
+    (2, "scan journal",
+     ['CREATE TABLE IF NOT EXISTS scan_journal('
+      'id INTEGER PRIMARY KEY, '
+      'order_number INTEGER, '
+      'product_code TEXT, '
+      'quantity INTEGER)']),
+    (3, "sortable last_update timestamps, barcode tombstones and sync watermarks",
+     # dd/mm/YYYY -> YYYY-MM-DD, new timestamps are written as YYYY-MM-DD HH:MM:SS (UTC)
+     ["UPDATE products "
+      "SET last_update = substr(last_update, 7, 4) || '-' || substr(last_update, 4, 2) || '-' || "
+      "substr(last_update, 1, 2) "
+      "WHERE last_update GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]'",
+      "CREATE INDEX IF NOT EXISTS products_last_update "
+      "ON products(last_update)",
+      'CREATE TABLE IF NOT EXISTS deleted_products('
+      'barcode TEXT, '
+      'deleted_at TEXT, '
+      'PRIMARY KEY (barcode))',
+      "CREATE INDEX IF NOT EXISTS deleted_products_deleted_at "
+      "ON deleted_products(deleted_at)",
+      'CREATE TABLE IF NOT EXISTS sync_watermarks('
+      'station TEXT, '
+      'exported_until TEXT, '
+      'PRIMARY KEY (station))']),
+    (4, "scan journal rows keyed by session, so stations sharing a database only flush their own scans",
+     ["ALTER TABLE scan_journal ADD COLUMN session TEXT",
+      "CREATE INDEX IF NOT EXISTS scan_journal_session "
+      "ON scan_journal(session)"]),
+    (5, "append-only scan event log replacing the scan journal",
+     ['CREATE TABLE IF NOT EXISTS scan_events('
+      'id INTEGER PRIMARY KEY, '
+      'order_number INTEGER, '
+      'product_code TEXT, '
+      'quantity INTEGER, '
+      'station TEXT, '
+      'scanned_at TEXT, '
+      'undoes INTEGER)',
+      # only undo events are indexed, so recording a scan stays a single append
+      "CREATE INDEX IF NOT EXISTS scan_events_undoes "
+      "ON scan_events(undoes) WHERE undoes IS NOT NULL",
+      # scanned_products holds every event up to last_event_id
+      'CREATE TABLE IF NOT EXISTS scan_events_applied('
+      'last_event_id INTEGER)',
+      # quantities scanned before the log existed become one event per line, already applied
+      "INSERT INTO scan_events(order_number, product_code, quantity, station) "
+      "SELECT order_number, product_code, scanned_quantity, 'before scan log' "
+      "FROM scanned_products "
+      "WHERE scanned_quantity != 0",
+      "INSERT INTO scan_events_applied "
+      "SELECT coalesce(max(id), 0) "
+      "FROM scan_events",
+      # journal rows that were not written yet are applied by the next flush
+      "INSERT INTO scan_events(order_number, product_code, quantity, station) "
+      "SELECT order_number, product_code, quantity, 'scan journal' "
+      "FROM scan_journal",
+      "DROP TABLE scan_journal"]),
+    (6, "per-order discrepancy summary kept up to date by triggers on scanned_products",
+     ['CREATE TABLE IF NOT EXISTS order_summary('
+      'order_number INTEGER, '
+      'lines INTEGER, '
+      'lines_matched INTEGER, '
+      'units_short INTEGER, '
+      'units_over INTEGER, '
+      'PRIMARY KEY (order_number))',
+      # orders with the largest discrepancy first, without sorting
+      "CREATE INDEX IF NOT EXISTS order_summary_discrepancy "
+      "ON order_summary(units_short + units_over)",
+      "INSERT INTO order_summary "
+      "SELECT order_number, count(*), sum(scanned_quantity = expected_quantity), "
+      "sum(max(expected_quantity - scanned_quantity, 0)), sum(max(scanned_quantity - expected_quantity, 0)) "
+      "FROM scanned_products "
+      "GROUP BY order_number",
+      "CREATE TRIGGER IF NOT EXISTS order_summary_line_added "
+      "AFTER INSERT ON scanned_products "
+      "BEGIN "
+      "INSERT INTO order_summary "
+      "VALUES(NEW.order_number, 1, NEW.scanned_quantity = NEW.expected_quantity, "
+      "max(NEW.expected_quantity - NEW.scanned_quantity, 0), max(NEW.scanned_quantity - NEW.expected_quantity, 0)) "
+      "ON CONFLICT(order_number) DO UPDATE SET lines = lines + 1, "
+      "lines_matched = lines_matched + excluded.lines_matched, "
+      "units_short = units_short + excluded.units_short, "
+      "units_over = units_over + excluded.units_over; "
+      "END",
+      "CREATE TRIGGER IF NOT EXISTS order_summary_line_changed "
+      "AFTER UPDATE OF expected_quantity, scanned_quantity ON scanned_products "
+      "BEGIN "
+      "UPDATE order_summary "
+      "SET lines_matched = lines_matched - (OLD.scanned_quantity = OLD.expected_quantity) "
+      "+ (NEW.scanned_quantity = NEW.expected_quantity), "
+      "units_short = units_short - max(OLD.expected_quantity - OLD.scanned_quantity, 0) "
+      "+ max(NEW.expected_quantity - NEW.scanned_quantity, 0), "
+      "units_over = units_over - max(OLD.scanned_quantity - OLD.expected_quantity, 0) "
+      "+ max(NEW.scanned_quantity - NEW.expected_quantity, 0) "
+      "WHERE order_number = NEW.order_number; "
+      "END",
+      # also fires for the lines removed with their order by the foreign key cascade
+      "CREATE TRIGGER IF NOT EXISTS order_summary_line_removed "
+      "AFTER DELETE ON scanned_products "
+      "BEGIN "
+      "UPDATE order_summary "
+      "SET lines = lines - 1, "
+      "lines_matched = lines_matched - (OLD.scanned_quantity = OLD.expected_quantity), "
+      "units_short = units_short - max(OLD.expected_quantity - OLD.scanned_quantity, 0), "
+      "units_over = units_over - max(OLD.scanned_quantity - OLD.expected_quantity, 0) "
+      "WHERE order_number = OLD.order_number; "
+      "DELETE FROM order_summary "
+      "WHERE order_number = OLD.order_number AND lines = 0; "
+      "END"]),
+    (7, "barcode version, counted up by every change to the barcodes so other connections reload their cache",
+     ['CREATE TABLE IF NOT EXISTS barcode_version('
+      'id INTEGER, '
+      'version INTEGER, '
+      'PRIMARY KEY (id))',
+      "INSERT OR IGNORE INTO barcode_version "
+      "VALUES(1, 0)"]),
+    (8, "index the scan event log by order",
+     # one more b-tree insert per scan, so reading, undoing, replaying and removing an order's events costs the
+     # events of that order instead of the whole log
+     ["CREATE INDEX IF NOT EXISTS scan_events_order "
+      "ON scan_events(order_number, id)"]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    """
+    :param conn: sqlite connection
+    :return: schema version of the database
+    """
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Applies the migrations the database is missing
+    Each migration takes the write lock before checking the version again, so stations opening the database at the
+    same time don't apply a migration twice
+    :param conn: sqlite connection to an initialised database
+    :return: list of the versions applied
+    """
+    applied = []
+    version = schema_version(conn)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError("Database schema version {} is newer than this version of StockChecker ({})"
+                           .format(version, SCHEMA_VERSION))
+    for migration_version, description, statements in MIGRATIONS:
+        if migration_version <= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        if schema_version(conn) >= migration_version:
+            conn.rollback()
+            continue
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            # PRAGMA does not take parameters, the version is always an int from MIGRATIONS
+            conn.execute("PRAGMA user_version = %d" % migration_version)
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        applied.append(migration_version)
+    return applied
@@ -0,0 +1,67 @@
+"""
+Output of reports and listings
+Rows come in pages, e.g. from Storage.order_line_pages, and are written as each page is read, so memory stays the
+same however long the listing is. Listings print as an aligned table, or are saved as CSV or JSON lines
+"""
+import csv
+import json
+
+# File extension -> output format
+OUTPUT_FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl'}
+
+
+def output_format(filename):
+    """
+    :param filename: file the listing is saved to
+    :return: 'csv' or 'jsonl', or None if the extension is not one of OUTPUT_FORMATS
+    """
+    for extension, name in OUTPUT_FORMATS.items():
+        if filename.lower().endswith(extension):
+            return name
+    return None
+
+
+def json_keys(header):
+    """
+    :return: the column titles of the header as JSON keys, e.g. "Product Code" -> "product_code"
+    """
+    return [title.lower().replace(' ', '_') for title in header]
+
+
+def write_pages(pages, header, output, fmt='table', column_width=20, more=None):
+    """
+    Writes pages of rows as they are read
+    :param pages: iterable of lists of rows
+    :param header: column titles
+    :param output: text file to write to, opened with newline="" for CSV
+    :param fmt: 'table', 'csv' or 'jsonl'
+    :param column_width: width of the centred table columns
+    :param more: for tables, function called between pages, returns False to stop, e.g. to wait for the user
+    :return: number of rows written
+    """
+    if fmt == 'csv':
+        writer = csv.writer(output)
+        writer.writerow(header)
+        write_page = writer.writerows
+    elif fmt == 'jsonl':
+        keys = json_keys(header)
+
+        def write_page(page):
+            output.writelines(json.dumps(dict(zip(keys, row))) + '\n' for row in page)
+    else:
+        row_format = ("{:^" + str(column_width) + "}") * len(header)
+        output.write(row_format.format(*header) + '\n')
+
+        def write_page(page):
+            output.writelines(row_format.format(*["" if value is None else value for value in row]) + '\n'
+                              for row in page)
+    written = 0
+    pages = iter(pages)
+    page = next(pages, None)
+    while page is not None:
+        write_page(page)
+        written += len(page)
+        page = next(pages, None)
+        if page is not None and fmt == 'table' and more is not None and not more():
+            break
+    return written
@@ -0,0 +1,292 @@
+"""
+Order PDF parsing and import
+Order PDFs are parsed with tabula in two timed stages, the page 1 header then the line items, and parsed PDFs are
+cached on disk by content hash so re-imports skip tabula entirely.
+tabula and pandas take longer to import than the rest of the program takes to start, so they are imported on
+first use, or ahead of time by prewarm
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import as_completed
+
+from stockchecker_core.instrumentation import record_timings
+from stockchecker_core.validation import validator
+
+# Table area and column boundaries (in points) of the Jaycar order PDF
+ORDER_PDF_AREA = [[40, 20, 535, 800]]
+ORDER_HEADER_COLUMNS = [100, 210, 265, 325, 365, 440, 530, 590, 660, 710, 750, 800]
+ORDER_LINE_COLUMNS = [50, 160, 525, 600, 665, 700, 860]
+
+# Parsed order PDFs are cached in this folder, next to the database file, up to this many bytes
+PDF_CACHE_DIR = 'pdf_cache'
+PDF_CACHE_MAX_BYTES = 20 * 1024 * 1024
+
+
+class ParsedPDFCache:
+    """
+    On-disk cache of parsed order PDFs, keyed by a SHA-256 hash of the PDF contents
+    Each entry is a small JSON file holding the order header and line items. Entries are touched when read,
+    and the least recently used are removed once the cache grows past max_bytes
+    """
+    def __init__(self, directory, max_bytes=PDF_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def digest(pdf_name):
+        """
+        :param pdf_name: filename of the order PDF
+        :return: hex SHA-256 of the file contents
+        """
+        sha = hashlib.sha256()
+        with open(pdf_name, 'rb') as pdf_file:
+            for block in iter(lambda: pdf_file.read(1 << 20), b''):
+                sha.update(block)
+        return sha.hexdigest()
+
+    def get(self, digest):
+        """
+        :param digest: hash from ParsedPDFCache.digest
+        :return: (customer order number, delivery reference number, line items), or None if not cached
+        """
+        path = os.path.join(self.directory, digest + '.json')
+        try:
+            with open(path) as entry_file:
+                entry = json.load(entry_file)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry['order_number'], entry['delivery_reference'], [tuple(line) for line in entry['lines']]
+
+    def put(self, digest, order_num, delivery_ref, lines):
+        """
+        Stores a parsed order PDF, then evicts entries if the cache is over its size limit
+        :return:
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, digest + '.json')
+        temp_path = path + '.%d.tmp' % os.getpid()
+        with open(temp_path, 'w') as entry_file:
+            json.dump({'order_number': order_num, 'delivery_reference': delivery_ref, 'lines': lines},
+                      entry_file, separators=(',', ':'), default=str)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def cache_directory(sqlite_file):
+    """
+    :param sqlite_file: filename of the database the PDFs are imported into
+    :return: folder of the parsed PDF cache of the database, next to the database file
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(sqlite_file)), PDF_CACHE_DIR)
+
+
+class OrderPDF:
+    """
+    An order PDF being imported
+    The header is read when created, from the parsed PDF cache when possible, and the line items are extracted
+    by read_lines so an import can stop after the header (e.g. the order already exists) without parsing them
+    """
+    def __init__(self, pdf_name, sqlite_file):
+        """
+        :param pdf_name: filename of the order PDF
+        :param sqlite_file: filename of the database the order is imported into, the parsed PDF cache is next to it
+        """
+        self.pdf_name = pdf_name
+        self.cache = ParsedPDFCache(cache_directory(sqlite_file))
+        self.timings = {}
+        start = time.perf_counter()
+        self.digest = ParsedPDFCache.digest(pdf_name)
+        cached = self.cache.get(self.digest)
+        if cached is not None:
+            self.order_number, self.delivery_reference, self.lines = cached
+            self.timings['cache'] = time.perf_counter() - start
+        else:
+            self.order_number, self.delivery_reference = parse_order_header(pdf_name)
+            self.lines = None
+            self.timings['header'] = time.perf_counter() - start
+
+    def read_lines(self):
+        """
+        :return: (product code, supplied quantity) tuples of the order
+        """
+        if self.lines is None:
+            start = time.perf_counter()
+            self.lines = parse_order_lines(self.pdf_name)
+            self.cache.put(self.digest, self.order_number, self.delivery_reference, self.lines)
+            self.timings['line items'] = time.perf_counter() - start
+        return self.lines
+
+
+def prewarm():
+    """
+    Imports tabula and pandas so the first PDF import doesn't wait for them, e.g. on a background thread at startup
+    :return: False if they are not installed
+    """
+    try:
+        import pandas  # noqa: F401
+        import tabula  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def read_pdf_table(pdf_name, pages, columns):
+    """
+    Extracts the table in the order area of a PDF as a single DataFrame
+    tabula-py 2.8+ keeps its JVM loaded between calls (through jpype), so the header and line item
+    extractions of an import share one Java process
+    :param pdf_name: filename of the order PDF
+    :param pages: pages to extract, e.g. "1" or "all"
+    :param columns: x coordinates of the column boundaries
+    :return: DataFrame, or None if no table was found
+    """
+    import tabula
+    tables = tabula.read_pdf(pdf_name, pages=pages, area=ORDER_PDF_AREA, columns=columns, multiple_tables=False)
+    if isinstance(tables, list):
+        # tabula-py 2 returns a list of DataFrames
+        return tables[0] if tables else None
+    return tables
+
+
+def parse_order_header(pdf_name):
+    """
+    Finds the customer order number and delivery reference on the first page of an order PDF
+    :param pdf_name: filename of the order PDF
+    :return: (customer order number, delivery reference number), or (None, None) if not found
+    """
+    df_on = read_pdf_table(pdf_name, "1", ORDER_HEADER_COLUMNS)
+    if df_on is not None:
+        for row in df_on.itertuples(index=False):
+            if row[0] == "Customer Ord":
+                return row[1], row[3]
+    return None, None
+
+
+def parse_order_lines(pdf_name):
+    """
+    Extracts the line items from every page of an order PDF
+    Rows without a valid product code are dropped, product codes are uppercased and quantities of repeated
+    product codes are added together
+    :param pdf_name: filename of the order PDF
+    :return: list of (product code, supplied quantity) tuples
+    """
+    import pandas as pd
+    df_pd = read_pdf_table(pdf_name, "all", ORDER_LINE_COLUMNS)
+    if df_pd is None:
+        return []
+    product_codes, rejects = validator.validate_product_code_column(df_pd.iloc[:, 1])
+    quantities = pd.to_numeric(df_pd.iloc[:, 4], errors='coerce').fillna(0).astype(int)
+    quantities = quantities.loc[product_codes.index].groupby(product_codes, sort=False).sum()
+    return list(zip(quantities.index, quantities.tolist()))
+
+
+def print_order_lines(lines):
+    header = ["Product Code", "Supplied Quantity"]
+    row_format = "{:20}" * (len(header))
+    print(row_format.format(*header))
+    print("\n".join(row_format.format(product_code, quantity) for product_code, quantity in lines))
+
+
+def print_timings(timings):
+    print("Import took", ", ".join("{} {:.2f}s".format(stage, seconds) for stage, seconds in timings.items()))
+
+
+def parse_order_pdf(pdf_name, sqlite_file):
+    """
+    Parses an order PDF, run in a worker for batch imports
+    PDFs in the parsed PDF cache of the database are not parsed again. Otherwise line items are not extracted for
+    orders that already exist in the database
+    :param pdf_name: filename of the order PDF
+    :param sqlite_file: filename of sqlite database the order is imported into
+    :return: (customer order number, delivery reference number, line items or None if not extracted, timings)
+    """
+    order_pdf = OrderPDF(pdf_name, sqlite_file)
+    lines = order_pdf.lines
+    if order_pdf.order_number is not None and lines is None:
+        check_conn = sqlite3.connect(sqlite_file)
+        exists = check_conn.execute("SELECT count(*) "
+                                    "FROM orders "
+                                    "WHERE order_number = ?",
+                                    (order_pdf.order_number,)).fetchone()[0] != 0
+        check_conn.close()
+        if not exists:
+            lines = order_pdf.read_lines()
+    return order_pdf.order_number, order_pdf.delivery_reference, lines, order_pdf.timings
+
+
+def import_pdfs(storage, pdf_names, workers=None, executor_class=None, progress=None):
+    """
+    Batch imports order PDFs. PDFs are parsed in a pool of workers, and each parsed order is written to the
+    database by the calling process as soon as it is ready. Orders that already exist in the database are skipped
+    :param storage: Storage of the database to import into
+    :param pdf_names: list of order PDF filenames
+    :param workers: number of workers, defaults to the number of cores
+    :param executor_class: ThreadPoolExecutor where worker processes can't be used, ProcessPoolExecutor if None
+    :param progress: called with (PDFs done, total PDFs) as each parsed PDF comes back, may raise to stop the
+    import. Orders already written stay imported and PDFs that were not started are not parsed
+    :return: (imported, skipped, failed) counts
+    """
+    if executor_class is None:
+        # imported here as it brings in multiprocessing
+        from concurrent.futures import ProcessPoolExecutor as executor_class
+    workers = max(1, min(workers or os.cpu_count(), len(pdf_names)))
+    sqlite_file = storage.sqlite_file
+    imported = skipped = failed = 0
+    start = time.perf_counter()
+    with executor_class(max_workers=workers) as executor:
+        futures = {executor.submit(parse_order_pdf, pdf_name, sqlite_file): pdf_name
+                   for pdf_name in pdf_names}
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                if progress is not None:
+                    progress(done, len(futures))
+                status = "[{}/{}] {}:".format(done, len(futures), os.path.basename(futures[future]))
+                try:
+                    order_num, delivery_ref, lines, timings = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(status, "failed to parse,", e)
+                    continue
+                record_timings('pdf.', timings)
+                if order_num is None:
+                    failed += 1
+                    print(status, "Customer Order Number not found in PDF.")
+                    continue
+                if lines is None or storage.order_exists(order_num):
+                    skipped += 1
+                    print(status, "order", order_num, "already exists in database, skipped.")
+                    continue
+                storage.add_order(order_num, delivery_ref)
+                storage.add_order_lines(order_num, lines)
+                storage.commit()
+                imported += 1
+                print(status, "order", order_num, "imported,", len(lines), "products.")
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            print("Import stopped after", imported, "orders")
+            raise
+    elapsed = time.perf_counter() - start
+    print("Imported", imported, "orders,", skipped, "skipped,", failed, "failed in",
+          "{:.2f}s using {} workers ({:.2f} PDFs/sec)".format(elapsed, workers, len(pdf_names) / elapsed))
+    return imported, skipped, failed
@@ -0,0 +1,129 @@
+"""
+Order report rows for the GUI
+The RecycleView of the check and verify order screens shows an order as a flat list of {'text': ...} cells, five
+per row. OrderReport keeps that list in step with the order, finding a product's row by its product code.
+The quantities are kept in an OrderSnapshot and cells are only made for the rows that are shown
+"""
+from stockchecker_core.instrumentation import timed
+from stockchecker_core.snapshot import OrderSnapshot
+
+# Order number, product code, expected quantity, scanned quantity, difference
+REPORT_COLUMNS = 5
+
+
+def report_cells(order_number, text_rows):
+    """
+    :param order_number: customer order number
+    :param text_rows: (product code, expected, scanned, difference) strings of each row, from
+    OrderSnapshot.text_rows
+    :return: the five cells of each row, as one flat list
+    """
+    order_text = str(order_number)
+    cells = []
+    for product_code, expected_text, scanned_text, difference_text in text_rows:
+        cells += ({'text': order_text}, {'text': product_code}, {'text': expected_text}, {'text': scanned_text},
+                  {'text': difference_text})
+    return cells
+
+
+class OrderReport:
+    """
+    Keyed view of the rows of one order, rendered into a flat list of cells
+    Quantities of every product are kept in the OrderSnapshot of the order, and the cells of each shown row are
+    found through the product code -> shown row map, so a scan updates its row in place without searching the list.
+    With hide_matched, rows where the scanned quantity equals the expected quantity are not shown, and with
+    sort_by_difference the rows are shown most short first instead of in the order of the snapshot
+    """
+    def __init__(self, cells, hide_matched=False, sort_by_difference=False):
+        """
+        :param cells: list the cells are rendered into, e.g. the data_items ListProperty of a screen
+        :param hide_matched: True to leave out rows with no difference
+        :param sort_by_difference: True to show the rows most short first
+        """
+        self.cells = cells
+        self.hide_matched = hide_matched
+        self.sort_by_difference = sort_by_difference
+        self.order_number = None
+        self.snapshot = OrderSnapshot()
+        self.rows = {}
+
+    def is_shown(self, product_code):
+        snapshot = self.snapshot
+        return not self.hide_matched or snapshot.scanned_quantity(product_code) != snapshot.expected_quantity(
+            product_code)
+
+    def load(self, order_number, snapshot):
+        """
+        Replaces the report with the lines of an order
+        :param order_number: customer order number
+        :param snapshot: OrderSnapshot of the order, rows in display order. The report updates it as scans are shown
+        :return:
+        """
+        self.order_number = order_number
+        self.snapshot = snapshot
+        self.render()
+
+    @timed('report.render')
+    def render(self):
+        """
+        Rebuilds every cell, in one assignment so the view only refreshes once
+        :return:
+        """
+        snapshot = self.snapshot
+        shown = snapshot.discrepancy_rows() if self.hide_matched else range(len(snapshot))
+        if self.sort_by_difference:
+            shown = snapshot.sorted_by_difference(shown)
+        product_codes = snapshot.product_codes
+        self.rows = {product_codes[row]: index for index, row in enumerate(shown)}
+        self.cells[:] = report_cells(self.order_number, snapshot.text_rows(shown))
+
+    def set_hide_matched(self, hide_matched):
+        if hide_matched != self.hide_matched:
+            self.hide_matched = hide_matched
+            self.render()
+
+    def set_sort_by_difference(self, sort_by_difference):
+        if sort_by_difference != self.sort_by_difference:
+            self.sort_by_difference = sort_by_difference
+            self.render()
+
+    def totals_text(self):
+        """
+        :return: line and unit totals of the whole order, shown or not
+        """
+        lines, lines_matched, units_short, units_over = self.snapshot.totals()
+        return "{} of {} lines matched, {} units short, {} units over".format(lines_matched, lines, units_short,
+                                                                            units_over)
+
+    @timed('report.update')
+    def update(self, product_code, scanned_quantity):
+        """
+        Sets the scanned quantity of a product on the report
+        :param product_code: product code on the order
+        :param scanned_quantity: new scanned quantity
+        :return:
+        """
+        self.snapshot.set_scanned(product_code, scanned_quantity)
+        row = self.rows.get(product_code)
+        if row is None or not self.is_shown(product_code) or self.sort_by_difference:
+            # the row is appearing, disappearing or moving in the view, which moves the rows after it
+            self.render()
+            return
+        start = row * REPORT_COLUMNS + 3
+        self.cells[start:start + 2] = [{'text': str(scanned_quantity)},
+                                       {'text': str(scanned_quantity - self.snapshot.expected_quantity(product_code))}]
+
+    def append(self, product_code, expected_quantity, scanned_quantity):
+        """
+        Adds a product that was not on the order to the end of the report
+        :return:
+        """
+        if product_code in self.snapshot:
+            self.update(product_code, scanned_quantity)
+            return
+        row = self.snapshot.append(product_code, expected_quantity, scanned_quantity)
+        if self.sort_by_difference:
+            self.render()
+        elif self.is_shown(product_code):
+            self.rows[product_code] = len(self.cells) // REPORT_COLUMNS
+            self.cells.extend(report_cells(self.order_number, self.snapshot.text_rows([row])))
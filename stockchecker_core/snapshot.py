@@ -0,0 +1,167 @@
+"""
+Columnar snapshot of the lines of an order
+An order is held as parallel columns instead of a tuple or list per line: product codes are interned strings in
+one list, and expected and scanned quantities are int64 arrays. Differences, totals, filters and sorts run over
+whole columns, with numpy for large orders when it is installed. numpy is imported on first use, as it takes
+longer to import than the rest of the program takes to start
+"""
+import sys
+from array import array
+
+# Quantities are stored as 64 bit ints, the range of a SQLite INTEGER
+QUANTITY_TYPECODE = 'q'
+
+# Orders with fewer lines than this are faster to go through in Python than to hand to numpy
+NUMPY_MIN_LINES = 2000
+
+# numpy module once imported, False if it is not installed
+numpy = None
+
+
+def numpy_module():
+    """
+    :return: numpy, or None if it is not installed
+    """
+    global numpy
+    if numpy is None:
+        try:
+            import numpy as module
+        except ImportError:
+            module = False
+        numpy = module
+    return numpy or None
+
+
+class OrderSnapshot:
+    """
+    Lines of one order: product code, expected quantity and scanned quantity columns, with a product code -> row
+    map to find a line. Rows keep the order they were added in
+    """
+    def __init__(self):
+        self.product_codes = []
+        self.expected = array(QUANTITY_TYPECODE)
+        self.scanned = array(QUANTITY_TYPECODE)
+        self.rows = {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        :param rows: iterable of (product code, expected quantity, scanned quantity), e.g. a cursor
+        :return: OrderSnapshot of the rows
+        """
+        snapshot = cls()
+        rows = rows if isinstance(rows, list) else list(rows)
+        intern = sys.intern
+        snapshot.product_codes = [intern(row[0]) for row in rows]
+        snapshot.expected = array(QUANTITY_TYPECODE, [row[1] for row in rows])
+        snapshot.scanned = array(QUANTITY_TYPECODE, [row[2] for row in rows])
+        snapshot.rows = dict(zip(snapshot.product_codes, range(len(rows))))
+        return snapshot
+
+    def __len__(self):
+        return len(self.product_codes)
+
+    def __contains__(self, product_code):
+        return product_code in self.rows
+
+    def append(self, product_code, expected_quantity, scanned_quantity):
+        """
+        Adds a line, e.g. a product force added to the order
+        :return: row of the line
+        """
+        product_code = sys.intern(product_code)
+        row = len(self.product_codes)
+        self.rows[product_code] = row
+        self.product_codes.append(product_code)
+        self.expected.append(expected_quantity)
+        self.scanned.append(scanned_quantity)
+        return row
+
+    def expected_quantity(self, product_code):
+        return self.expected[self.rows[product_code]]
+
+    def scanned_quantity(self, product_code):
+        return self.scanned[self.rows[product_code]]
+
+    def set_scanned(self, product_code, scanned_quantity):
+        self.scanned[self.rows[product_code]] = scanned_quantity
+
+    def add_scanned(self, product_code, quantity):
+        """
+        :return: new scanned quantity of the product
+        :raises OverflowError: if the new scanned quantity does not fit in a SQLite INTEGER, the quantity is not added
+        """
+        row = self.rows[product_code]
+        self.scanned[row] += quantity
+        return self.scanned[row]
+
+    def columns(self):
+        """
+        :return: (expected, scanned) as numpy arrays sharing the memory of the columns, or None if the order is
+        too small for numpy or it is not installed. The views must be dropped before lines are appended
+        """
+        np = numpy_module() if len(self) >= NUMPY_MIN_LINES else None
+        if np is None:
+            return None
+        return np.frombuffer(self.expected, dtype=np.int64), np.frombuffer(self.scanned, dtype=np.int64)
+
+    def differences(self):
+        """
+        :return: scanned minus expected quantity of every row, as a list
+        """
+        columns = self.columns()
+        if columns is not None:
+            expected, scanned = columns
+            return (scanned - expected).tolist()
+        return [scanned - expected for expected, scanned in zip(self.expected, self.scanned)]
+
+    def discrepancy_rows(self):
+        """
+        :return: rows where the scanned quantity is not the expected quantity, in row order
+        """
+        columns = self.columns()
+        if columns is not None:
+            expected, scanned = columns
+            return numpy.flatnonzero(scanned != expected).tolist()
+        return [row for row, (expected, scanned) in enumerate(zip(self.expected, self.scanned)) if expected != scanned]
+
+    def sorted_by_difference(self, rows=None):
+        """
+        :param rows: rows to sort, every row if None
+        :return: the rows sorted by difference, most short first, then by product code
+        """
+        if rows is None:
+            rows = range(len(self))
+        differences = self.differences()
+        product_codes = self.product_codes
+        return sorted(rows, key=lambda row: (differences[row], product_codes[row]))
+
+    def totals(self):
+        """
+        :return: (lines, lines matched, units short, units over), as Storage.order_summary
+        """
+        columns = self.columns()
+        if columns is not None:
+            expected, scanned = columns
+            differences = scanned - expected
+            return (len(self), int((differences == 0).sum()), int(-differences[differences < 0].sum()),
+                    int(differences[differences > 0].sum()))
+        lines_matched = units_short = units_over = 0
+        for difference in self.differences():
+            if difference < 0:
+                units_short -= difference
+            elif difference > 0:
+                units_over += difference
+            else:
+                lines_matched += 1
+        return len(self), lines_matched, units_short, units_over
+
+    def text_rows(self, rows):
+        """
+        Generates the text of rows as they are read, e.g. for the cells of a report
+        :param rows: rows to generate
+        :return: (product code, expected, scanned, difference) strings of each row
+        """
+        for row in rows:
+            expected, scanned = self.expected[row], self.scanned[row]
+            yield self.product_codes[row], str(expected), str(scanned), str(scanned - expected)
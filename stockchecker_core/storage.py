@@ -0,0 +1,1197 @@
+"""
+Database layer shared by the StockChecker CLI and GUI
+Storage owns the sqlite connection and runs every query the front-ends need. sqlite3 caches prepared statements
+per connection by SQL text, so keeping one long-lived connection with constant SQL reuses them across calls
+"""
+import csv
+import gzip
+import io
+import os
+import socket
+import sqlite3
+import sys
+import time
+from bisect import bisect_left
+from datetime import datetime, timezone
+from itertools import islice
+
+from stockchecker_core.instrumentation import stage, timed
+from stockchecker_core.migrations import migrate
+from stockchecker_core.snapshot import OrderSnapshot
+from stockchecker_core.validation import pn_regex_check
+
+DATABASE_FILE = 'database.db'
+
+# Name scans are recorded under in the scan event log, and undone by
+STATION = socket.gethostname()
+
+# Seconds a statement waits for another station's write to finish before failing with "database is locked", and
+# how many more times a write transaction is tried after that
+BUSY_TIMEOUT = 10.0
+LOCKED_RETRIES = 3
+
+# Number of prepared statements sqlite3 keeps per connection
+STATEMENT_CACHE_SIZE = 256
+
+# Number of CSV rows inserted per statement when bulk importing barcodes, and written at a time when exporting
+BARCODE_CHUNK_SIZE = 5000
+
+# Barcode files ending in .gz are gzipped CSV, and files ending in .sqlite hold a products table, which is
+# imported with a single INSERT ... SELECT per chunk instead of parsing text
+GZIP_EXTENSION = '.gz'
+BARCODE_DATABASE_EXTENSION = '.sqlite'
+BARCODE_FILE_EXTENSIONS = ('.csv', '.csv' + GZIP_EXTENSION, BARCODE_DATABASE_EXTENSION)
+EXPORT_GZIP_LEVEL = 6
+
+# products.last_update and barcode tombstones are stamped with the UTC time in this format, which sorts as text
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Rows read per query by the *_pages listings
+REPORT_PAGE_SIZE = 1000
+
+# Most orders returned by a search as the user types
+ORDER_SEARCH_LIMIT = 10
+
+# Scans are written to scanned_products once this many are pending, or this many seconds after the last write
+SCAN_FLUSH_SIZE = 50
+SCAN_FLUSH_INTERVAL = 5.0
+
+# Range of a SQLite INTEGER, quantities outside it can't be stored
+SQLITE_INTEGER_MIN = -2 ** 63
+SQLITE_INTEGER_MAX = 2 ** 63 - 1
+
+
+@timed('db.begin_write')
+def begin_write(conn, retries=LOCKED_RETRIES):
+    """
+    Starts a transaction holding the write lock, so no statement in it can fail on another station's write
+    Work not yet committed on the connection is committed first
+    :param conn: sqlite connection
+    :param retries: times to try again when the database is still locked after BUSY_TIMEOUT
+    :return:
+    """
+    if conn.in_transaction:
+        conn.commit()
+    for attempt in range(retries + 1):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            return
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e) or attempt == retries:
+                raise
+            print("Database is locked by another station, retrying")
+
+
+def prefix_end(prefix):
+    """
+    :return: text that sorts after every text starting with prefix, for range queries on an index
+    """
+    return prefix + chr(0x10ffff)
+
+
+def timestamp():
+    """
+    :return: current UTC time as a sortable string
+    """
+    return datetime.now(timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+def current_data_version(c):
+    # changes when another connection commits to the database, not for this connection's own commits
+    c.execute("PRAGMA data_version")
+    return c.fetchone()[0]
+
+
+def barcode_version(c):
+    c.execute("SELECT version "
+              "FROM barcode_version "
+              "WHERE id = 1")
+    return c.fetchone()[0]
+
+
+class BarcodeCache:
+    """
+    In-memory map of barcode -> product code so scans can be resolved without querying sqlite
+    The products table is loaded on the first lookup, and kept in step with this connection's writes by
+    add/remove/invalidate. Writes by other connections, e.g. other stations, the ingest server or a sync merge, are
+    found by check: when another connection has committed, the barcode version tells whether it changed the barcodes
+    """
+    def __init__(self):
+        self.codes = None
+        self.data_version = None
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, c):
+        """
+        Loads every barcode in the products table into the cache
+        Product codes are interned, as many barcodes share the same product code
+        :param c: sqlite cursor
+        :return:
+        """
+        self.data_version = current_data_version(c)
+        self.version = barcode_version(c)
+        c.execute("SELECT barcode, product_code "
+                  "FROM products")
+        self.codes = {barcode: sys.intern(product_code) if product_code else product_code
+                      for barcode, product_code in c}
+
+    def lookup(self, c, barcode):
+        """
+        Resolves a barcode to its product code
+        :param c: sqlite cursor, used to load the cache and, on a miss, to check it is still current
+        :param barcode: scanned barcode
+        :return: product code, or None if the barcode is not in the database
+        """
+        if self.codes is None:
+            self.load(c)
+        product_code = self.codes.get(barcode)
+        if product_code is None and self.check(c):
+            self.load(c)
+            product_code = self.codes.get(barcode)
+        if product_code is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return product_code
+
+    def check(self, c):
+        """
+        Drops the cached barcodes if another connection has changed them since they were loaded. Commits that don't
+        touch the barcodes, e.g. scans from another station, only cost reading the barcode version
+        :param c: sqlite cursor
+        :return: True if the cached barcodes were dropped
+        """
+        if self.codes is None:
+            return False
+        data_version = current_data_version(c)
+        if data_version == self.data_version:
+            return False
+        self.data_version = data_version
+        if barcode_version(c) == self.version:
+            return False
+        self.invalidate()
+        return True
+
+    def changed(self, c):
+        """
+        Counts up the barcode version for a change this connection is making to the barcodes, inside its write
+        transaction. The cache itself is kept in step by add, remove or invalidate
+        :param c: sqlite cursor
+        :return:
+        """
+        c.execute("UPDATE barcode_version "
+                  "SET version = version + 1 "
+                  "WHERE id = 1")
+        # if another connection changed the barcodes since the cache was loaded the versions still differ, and the
+        # next check reloads it
+        if self.version is not None:
+            self.version += 1
+
+    def add(self, barcode, product_code):
+        if self.codes is not None:
+            self.codes[barcode] = sys.intern(product_code)
+
+    def remove(self, barcode):
+        if self.codes is not None:
+            self.codes.pop(barcode, None)
+
+    def invalidate(self):
+        """
+        Drops the cached barcodes, they are reloaded from the database on the next lookup
+        :return:
+        """
+        self.codes = None
+
+    def stats(self):
+        """
+        :return: dict with the number of cached barcodes and the hit/miss counters
+        """
+        return {'barcodes': len(self.codes) if self.codes is not None else 0,
+                'hits': self.hits,
+                'misses': self.misses}
+
+
+class OrderIndex:
+    """
+    In-memory sorted index of the orders by delivery reference and customer order number, for searching as the user
+    types. The orders table is loaded on the first search. It is loaded again after orders are added, which may still
+    be rolled back, or removed, or when another connection, e.g. another station or an import thread, has written to
+    the database since
+    """
+    def __init__(self):
+        # sorted (key, customer order number, delivery reference), one entry per key
+        self.keys = None
+        self.data_version = None
+
+    def load(self, c):
+        """
+        Loads every order in the orders table into the index
+        :param c: sqlite cursor
+        :return:
+        """
+        self.data_version = current_data_version(c)
+        # read from the delivery reference index, which holds both columns and is smaller than the table
+        c.execute("SELECT order_number, internal_reference "
+                  "FROM orders "
+                  "ORDER BY internal_reference")
+        self.keys = sorted(entry for order_number, delivery_ref in c
+                           for entry in self.entries(order_number, delivery_ref))
+
+    @staticmethod
+    def entries(order_number, delivery_ref):
+        entries = [(str(order_number), order_number, delivery_ref)]
+        if delivery_ref:
+            entries.append((delivery_ref.upper(), order_number, delivery_ref))
+        return entries
+
+    def search(self, c, text, limit=ORDER_SEARCH_LIMIT):
+        """
+        Finds the orders whose delivery reference or customer order number starts with the text, followed by those
+        that contain it
+        :param c: sqlite cursor, used to load the index
+        :param text: part of a delivery reference or customer order number, in capitals
+        :param limit: most orders to return
+        :return: (customer order number, delivery reference) of the matching orders
+        """
+        if self.keys is None or current_data_version(c) != self.data_version:
+            self.load(c)
+        found = {}
+        for index in range(bisect_left(self.keys, (text,)), len(self.keys)):
+            key, order_number, delivery_ref = self.keys[index]
+            if len(found) == limit or not key.startswith(text):
+                break
+            found.setdefault(order_number, delivery_ref)
+        if len(found) < limit:
+            for key, order_number, delivery_ref in self.keys:
+                if text in key and order_number not in found:
+                    found[order_number] = delivery_ref
+                    if len(found) == limit:
+                        break
+        return list(found.items())
+
+    def invalidate(self):
+        self.keys = None
+
+
+def apply_scan_events(c):
+    """
+    Adds the scan events recorded since the last call, by every station, to scanned_products
+    Must run inside a write transaction, which keeps two stations from applying the same events
+    :param c: cursor
+    :return:
+    """
+    c.execute("SELECT last_event_id "
+              "FROM scan_events_applied")
+    last_event_id = c.fetchone()[0]
+    # NOT INDEXED keeps the read on the id range, the order index would walk the whole log for the GROUP BY
+    c.execute("SELECT sum(quantity), order_number, product_code, max(id) "
+              "FROM scan_events NOT INDEXED "
+              "WHERE id > ? "
+              "GROUP BY order_number, product_code",
+              (last_event_id,))
+    unapplied = c.fetchall()
+    if unapplied:
+        c.executemany("UPDATE scanned_products "
+                      "SET scanned_quantity = scanned_quantity + ? "
+                      "WHERE order_number = ? AND product_code = ?",
+                      [row[:3] for row in unapplied])
+        c.execute("UPDATE scan_events_applied "
+                  "SET last_event_id = ?",
+                  (max(row[3] for row in unapplied),))
+
+
+class ScanSession:
+    """
+    Working set of the scanned_products rows for one order
+    Every scan is appended to the scan_events log, with the station and time it was made, which is cheap to commit
+    in WAL mode. Scans are applied in memory and written to scanned_products in batches: a flush adds every event
+    after the last applied one, from any station, so scans that were not written are picked up by the next session
+    after a crash, and several stations can scan the same order with each scan counted exactly once. The quantities
+    of the order are read back on each flush, which brings in the scans of the other stations.
+    Mistakes are undone by appending events that cancel them, so the log can rebuild scanned_products with
+    Storage.replay_scans. The barcode cache of the connection, if given, is checked for changes made by other
+    connections on each refresh
+    """
+    def __init__(self, c, conn, order_number, station=None, flush_size=SCAN_FLUSH_SIZE,
+                 flush_interval=SCAN_FLUSH_INTERVAL, barcodes=None):
+        self.c = c
+        self.conn = conn
+        self.order_number = order_number
+        self.station = station or STATION
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.barcodes = barcodes
+        self.unflushed = 0
+        self.last_flush = time.monotonic()
+        self.snapshot = OrderSnapshot()
+        self.refresh()
+
+    def is_on_order(self, product_code):
+        return product_code in self.snapshot
+
+    def scan(self, product_code, quantity=1):
+        """
+        Adds to the scanned quantity of a product that is on the order
+        :param product_code: product code on the order
+        :param quantity: quantity to add, negative to correct mistakes
+        :return: new scanned quantity of the product
+        """
+        return self.scan_many([(product_code, quantity)])[0]
+
+    def scan_many(self, scans):
+        """
+        Adds a batch of scans, appended to the log in one transaction
+        :param scans: (product code, quantity) tuples of products on the order
+        :return: running scanned quantity of the product after each scan
+        """
+        return self.record([(product_code, quantity, None) for product_code, quantity in scans])
+
+    @timed('scan.record')
+    def record(self, events):
+        """
+        Applies events to the snapshot of the order and appends them to the log. The snapshot is updated first, so
+        an event it can't hold, e.g. a quantity out of range, is never committed
+        :param events: (product code, quantity, id of the event undone or None) tuples
+        :return: running scanned quantity of the product after each event
+        """
+        scanned_at = timestamp()
+        add_scanned = self.snapshot.add_scanned
+        scanned_quantities = []
+        begin_write(self.conn)
+        try:
+            for product_code, quantity, _ in events:
+                scanned_quantities.append(add_scanned(product_code, quantity))
+            self.c.executemany("INSERT INTO scan_events(order_number, product_code, quantity, station, scanned_at, "
+                               "undoes) "
+                               "VALUES(?,?,?,?,?,?)",
+                               [(self.order_number, product_code, quantity, self.station, scanned_at, undoes)
+                                for product_code, quantity, undoes in events])
+            with stage('scan.commit'):
+                self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            # takes back the events applied to the snapshot, none of them are in the log
+            for (product_code, quantity, _), _ in zip(events, scanned_quantities):
+                add_scanned(product_code, -quantity)
+            raise
+        self.unflushed += len(events)
+        if self.unflushed >= self.flush_size:
+            self.flush()
+        else:
+            self.flush_if_due()
+        return scanned_quantities
+
+    @timed('scan.undo')
+    def undo(self, count=1):
+        """
+        Cancels the last scans this station made on the order that are not undone yet
+        :param count: number of scans to undo
+        :return: (product code, new scanned quantity) of each scan undone, most recent first
+        """
+        # walks the log back from the newest event, which stops as soon as enough scans are found
+        self.c.execute("SELECT id, product_code, quantity "
+                       "FROM scan_events "
+                       "WHERE order_number = ? AND station = ? AND undoes IS NULL AND NOT EXISTS ("
+                       "SELECT 1 FROM scan_events AS undo WHERE undo.undoes = scan_events.id) "
+                       "ORDER BY id DESC "
+                       "LIMIT ?",
+                       (self.order_number, self.station, count,))
+        undone = [(product_code, -quantity, event_id) for event_id, product_code, quantity in self.c.fetchall()
+                  if product_code in self.snapshot]
+        if not undone:
+            return []
+        return list(zip([product_code for product_code, _, _ in undone], self.record(undone)))
+
+    @timed('scan.add_product')
+    def add_product(self, product_code, quantity):
+        """
+        Force adds a product that is not on the order, with an expected quantity of 0, and scans the quantity
+        If another station added it first, the quantity is added to theirs
+        :param product_code: product code to add
+        :param quantity: scanned quantity
+        :return:
+        """
+        begin_write(self.conn)
+        try:
+            self.c.execute("INSERT OR IGNORE INTO scanned_products "
+                           "VALUES(?,?,0,0)",
+                           (self.order_number, product_code,))
+        except BaseException:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+        self.refresh()
+        self.scan(product_code, quantity)
+
+    def flush_if_due(self):
+        if self.unflushed and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.unflushed:
+            self.refresh()
+        self.last_flush = time.monotonic()
+
+    @timed('scan.refresh')
+    def refresh(self):
+        """
+        Writes the scan events not applied yet to scanned_products in one transaction and reads back the order
+        :return:
+        """
+        begin_write(self.conn)
+        try:
+            apply_scan_events(self.c)
+            self.c.execute("SELECT product_code, expected_quantity, scanned_quantity "
+                           "FROM scanned_products "
+                           "WHERE order_number = ?",
+                           (self.order_number,))
+            self.snapshot = OrderSnapshot.from_rows(self.c)
+        except BaseException:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+        self.unflushed = 0
+        self.last_flush = time.monotonic()
+        if self.barcodes is not None:
+            self.barcodes.check(self.c)
+
+    def finish(self):
+        self.flush()
+
+
+class Storage:
+    """
+    Connection to the StockChecker database and the queries run against it
+    The connection is opened with WAL journaling, synchronous=NORMAL and foreign keys enforced, so deleting an
+    order cascades to its scanned products. Stations can share the database file: writers wait up to BUSY_TIMEOUT
+    for each other, and readers are never blocked in WAL mode. Initialised databases are migrated to the current
+    schema version when opened
+    """
+    def __init__(self, sqlite_file=DATABASE_FILE):
+        self.sqlite_file = sqlite_file
+        self.conn = sqlite3.connect(sqlite_file, timeout=BUSY_TIMEOUT, cached_statements=STATEMENT_CACHE_SIZE)
+        self.c = self.conn.cursor()
+        # WAL commits don't wait on a disk sync, so committing every scan to the scan event log stays cheap
+        self.c.execute("PRAGMA journal_mode = WAL")
+        self.c.execute("PRAGMA synchronous = NORMAL")
+        self.c.execute("PRAGMA foreign_keys = ON")
+        self.barcodes = BarcodeCache()
+        self.order_index = OrderIndex()
+        if self.is_initialised():
+            for version in migrate(self.conn):
+                print("Upgraded database to schema version", version)
+
+    def close(self):
+        """
+        Commit all changes to database and close connection
+        :return:
+        """
+        self.conn.commit()
+        self.conn.close()
+
+    @timed('storage.commit')
+    def commit(self):
+        self.conn.commit()
+
+    def initialise(self):
+        self.c.execute('CREATE TABLE products('
+                       'barcode TEXT, '
+                       'product_code TEXT, '
+                       'last_update NUMERIC, '
+                       'primary_code NUMERIC, '
+                       'PRIMARY KEY (barcode))')
+        self.c.execute('CREATE TABLE orders('
+                       'order_number INTEGER, '
+                       'internal_reference TEXT, '
+                       'PRIMARY KEY(order_number))')
+        self.c.execute('CREATE TABLE scanned_products('
+                       'order_number INTEGER, '
+                       'product_code TEXT, '
+                       'expected_quantity INTEGER, '
+                       'scanned_quantity INTEGER, '
+                       'PRIMARY KEY (order_number, product_code), '
+                       'FOREIGN KEY (order_number) REFERENCES orders(order_number)'
+                       'ON DELETE CASCADE)')
+        self.conn.commit()
+        migrate(self.conn)
+        self.barcodes.invalidate()
+        self.order_index.invalidate()
+
+    def is_initialised(self):
+        """
+        :return: True if the products, orders and scanned_products tables all exist
+        """
+        self.c.execute("SELECT count(*) "
+                       "FROM sqlite_master "
+                       "WHERE type = 'table' AND name IN ('products', 'orders', 'scanned_products')")
+        return self.c.fetchone()[0] == 3
+
+    # products
+
+    @timed('storage.lookup_barcode')
+    def lookup_barcode(self, barcode):
+        """
+        :param barcode: scanned barcode
+        :return: product code linked to the barcode, or None if the barcode is not in the database
+        """
+        return self.barcodes.lookup(self.c, barcode)
+
+    def barcode_exists(self, barcode):
+        self.c.execute("SELECT count(*) "
+                       "FROM products "
+                       "WHERE barcode = ?",
+                       (barcode,))
+        return self.c.fetchone()[0] != 0
+
+    @timed('storage.add_barcode')
+    def add_barcode(self, barcode, product_code):
+        """
+        Add a barcode linked to a product to the database
+        :param barcode: barcode to add
+        :param product_code: product code the barcode belongs to
+        :return: True if added, False if the product code is invalid or the barcode already exists
+        """
+        if not pn_regex_check(product_code) or self.barcode_exists(barcode):
+            return False
+        self.c.execute("INSERT INTO products "
+                       "VALUES (?,?,?,'false')",
+                       (barcode, product_code.upper(), timestamp(),))
+        self.c.execute("DELETE FROM deleted_products "
+                       "WHERE barcode = ?",
+                       (barcode,))
+        self.barcodes.changed(self.c)
+        self.conn.commit()
+        self.barcodes.add(barcode, product_code.upper())
+        return True
+
+    @timed('storage.remove_barcode')
+    def remove_barcode(self, barcode):
+        """
+        Remove a barcode linked to a product from the database
+        A tombstone is kept for the barcode so the removal is passed on by export_barcode_changes
+        :param barcode: barcode to remove
+        :return: True if removed, False if the barcode is not in the database
+        """
+        self.c.execute('DELETE FROM products '
+                       'WHERE barcode = ?',
+                       (barcode,))
+        if self.c.rowcount == 0:
+            self.conn.commit()
+            return False
+        self.c.execute("INSERT OR REPLACE INTO deleted_products "
+                       "VALUES(?,?)",
+                       (barcode, timestamp(),))
+        self.barcodes.changed(self.c)
+        self.conn.commit()
+        self.barcodes.remove(barcode)
+        return True
+
+    @timed('storage.load_barcodes')
+    def load_barcodes(self, barcodes_file, progress=None):
+        """
+        Bulk imports a file of barcodes (barcode, product code, last update, primary code) in one transaction
+        The file can be CSV, gzipped CSV (.gz) or a barcode database written by export_barcodes (.sqlite)
+        Barcodes that already exist in the database are skipped, rows with missing columns are rejected. The last
+        update of imported barcodes is set to the time of the import, so export_barcode_changes passes them on
+        :param barcodes_file: filename of the barcode file
+        :param progress: called with (amount read, total) after each chunk, may raise to roll back the import
+        :return: (inserted, skipped, rejected) row counts
+        """
+        if barcodes_file.endswith(BARCODE_DATABASE_EXTENSION):
+            counts = self.load_barcode_database(barcodes_file, progress)
+        else:
+            try:
+                with open(barcodes_file, 'rb') as raw_file:
+                    file_size = os.fstat(raw_file.fileno()).st_size
+                    stream = gzip.GzipFile(fileobj=raw_file) if barcodes_file.endswith(GZIP_EXTENSION) else raw_file
+                    csv_file = io.TextIOWrapper(stream, newline='')
+                    chunk_done = ((lambda rows_read: progress(raw_file.tell(), file_size)) if progress is not None
+                                  else None)
+                    counts = self.import_barcode_rows(csv.reader(csv_file, delimiter=','), progress=chunk_done)
+                self.clear_tombstones()
+            except BaseException:
+                self.conn.rollback()
+                raise
+            self.conn.commit()
+        self.barcodes.invalidate()
+        return counts
+
+    @timed('storage.load_barcode_database')
+    def load_barcode_database(self, barcodes_database_file, progress=None, chunk_size=BARCODE_CHUNK_SIZE):
+        """
+        Imports the products table of a barcode database written by export_barcodes, in one transaction
+        :param barcodes_database_file: filename of the barcode database
+        :param progress: called with (rows read, total rows) after each chunk, may raise to roll back the import
+        :param chunk_size: number of rows copied per statement
+        :return: (inserted, skipped, rejected) row counts
+        """
+        # ATTACH would create a missing file
+        if not os.path.exists(barcodes_database_file):
+            raise FileNotFoundError(barcodes_database_file)
+        self.conn.commit()
+        self.c.execute("ATTACH DATABASE ? AS source", (barcodes_database_file,))
+        try:
+            self.c.execute("SELECT min(rowid), max(rowid), count(*), "
+                           "count(CASE WHEN barcode IS NULL OR barcode = '' THEN 1 END) "
+                           "FROM source.products")
+            first, last, total, rejected = self.c.fetchone()
+            inserted = 0
+            now = timestamp()
+            if total:
+                for start in range(first, last + 1, chunk_size):
+                    self.c.execute("INSERT OR IGNORE INTO main.products "
+                                   "SELECT barcode, product_code, ?, primary_code "
+                                   "FROM source.products "
+                                   "WHERE rowid BETWEEN ? AND ? AND barcode IS NOT NULL AND barcode != ''",
+                                   (now, start, start + chunk_size - 1))
+                    inserted += self.c.rowcount
+                    if progress is not None:
+                        progress(min(start + chunk_size, last + 1) - first, last + 1 - first)
+            self.clear_tombstones()
+            if inserted:
+                self.barcodes.changed(self.c)
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        finally:
+            self.c.execute("DETACH DATABASE source")
+        return inserted, total - rejected - inserted, rejected
+
+    @timed('storage.import_barcode_rows')
+    def import_barcode_rows(self, rows, chunk_size=BARCODE_CHUNK_SIZE, progress=None):
+        """
+        Inserts barcode rows in chunks with a single statement per chunk, ignoring barcodes already in the database
+        Caller is responsible for committing, so the whole import runs as one transaction
+        :param rows: iterable of rows (barcode, product code, last update, primary code), e.g. a csv reader
+        :param chunk_size: number of rows sent to sqlite at a time
+        :param progress: called with the number of rows read after each chunk, may raise to stop the import
+        :return: (inserted, skipped, rejected) row counts
+        """
+        inserted = skipped = rejected = 0
+        now = timestamp()
+        self.c.execute("PRAGMA cache_size = -16000")
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, chunk_size))
+            if not batch:
+                break
+            chunk = [(row[0], row[1], now, row[3]) for row in batch if len(row) >= 4 and row[0]]
+            rejected += len(batch) - len(chunk)
+            if chunk:
+                self.c.executemany("INSERT OR IGNORE INTO products "
+                                   "VALUES(?,?,?,?)", chunk)
+                inserted += self.c.rowcount
+                skipped += len(chunk) - self.c.rowcount
+            if progress is not None:
+                progress(inserted + skipped + rejected)
+        if inserted:
+            self.barcodes.changed(self.c)
+        return inserted, skipped, rejected
+
+    @timed('storage.export_barcodes')
+    def export_barcodes(self, barcodes_file, progress=None, chunk_size=BARCODE_CHUNK_SIZE):
+        """
+        Writes every barcode in the database to a file that load_barcodes can import
+        Filenames ending in .gz are written as gzipped CSV, and .sqlite as a barcode database, otherwise CSV
+        :param barcodes_file: filename of the barcode file
+        :param progress: called with (rows written, total rows) after each chunk, may raise to stop the export, in
+        which case the partly written file is removed
+        :param chunk_size: number of rows fetched and written at a time
+        :return: number of rows written
+        """
+        if barcodes_file.endswith(BARCODE_DATABASE_EXTENSION):
+            return self.export_barcode_database(barcodes_file, progress, chunk_size)
+        total = None
+        if progress is not None:
+            self.c.execute("SELECT count(*) FROM products")
+            total = self.c.fetchone()[0]
+        self.c.execute('SELECT * FROM products')
+        written = 0
+        raw_file = open(barcodes_file, 'wb')
+        try:
+            stream = raw_file
+            if barcodes_file.endswith(GZIP_EXTENSION):
+                stream = gzip.GzipFile(fileobj=raw_file, mode='wb', compresslevel=EXPORT_GZIP_LEVEL)
+            # the text wrapper buffers writes, so each chunk reaches the file in a few large writes
+            with io.TextIOWrapper(stream, newline='', write_through=False) as output_file:
+                writer = csv.writer(output_file)
+                while True:
+                    rows = self.c.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    writer.writerows(rows)
+                    written += len(rows)
+                    if progress is not None:
+                        progress(written, total)
+        except BaseException:
+            raw_file.close()
+            os.remove(barcodes_file)
+            raise
+        raw_file.close()
+        return written
+
+    @timed('storage.export_barcode_database')
+    def export_barcode_database(self, barcodes_database_file, progress=None, chunk_size=BARCODE_CHUNK_SIZE):
+        """
+        Copies the products table to a new sqlite file, which load_barcodes imports without parsing any text
+        :param barcodes_database_file: filename of the barcode database, replaced if it exists
+        :param progress: called with (rows written, total rows) after each chunk, may raise to stop the export
+        :param chunk_size: number of rows copied per statement
+        :return: number of rows written
+        """
+        if os.path.exists(barcodes_database_file):
+            os.remove(barcodes_database_file)
+        self.conn.commit()
+        self.c.execute("ATTACH DATABASE ? AS export", (barcodes_database_file,))
+        written = 0
+        try:
+            # the file is removed if the export fails, so it doesn't need a journal. No primary key either, the
+            # importing database checks for duplicates
+            self.c.execute("PRAGMA export.journal_mode = OFF")
+            self.c.execute("PRAGMA export.synchronous = OFF")
+            self.c.execute('CREATE TABLE export.products('
+                           'barcode TEXT, '
+                           'product_code TEXT, '
+                           'last_update NUMERIC, '
+                           'primary_code NUMERIC)')
+            self.c.execute("SELECT min(rowid), max(rowid), count(*) FROM main.products")
+            first, last, total = self.c.fetchone()
+            if total:
+                for start in range(first, last + 1, chunk_size):
+                    self.c.execute("INSERT INTO export.products "
+                                   "SELECT barcode, product_code, last_update, primary_code "
+                                   "FROM main.products "
+                                   "WHERE rowid BETWEEN ? AND ?",
+                                   (start, start + chunk_size - 1))
+                    written += self.c.rowcount
+                    if progress is not None:
+                        progress(written, total)
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            self.c.execute("DETACH DATABASE export")
+            os.remove(barcodes_database_file)
+            raise
+        self.c.execute("DETACH DATABASE export")
+        return written
+
+    def clear_tombstones(self):
+        """
+        Drops the tombstones of removed barcodes that have been added again
+        :return:
+        """
+        self.c.execute("DELETE FROM deleted_products "
+                       "WHERE barcode IN (SELECT barcode FROM products)")
+
+    def sync_watermark(self, station):
+        """
+        :param station: name of the station changes are exported to
+        :return: time of the last export of changes to the station, or None if none were exported yet
+        """
+        self.c.execute("SELECT exported_until "
+                       "FROM sync_watermarks "
+                       "WHERE station = ?",
+                       (station,))
+        row = self.c.fetchone()
+        return row[0] if row else None
+
+    @timed('storage.export_barcode_changes')
+    def export_barcode_changes(self, barcodes_database_file, station):
+        """
+        Writes the barcodes added, changed or removed since the last export to a station to a barcode database,
+        for load_barcode_changes on that station. The first export to a station holds every barcode
+        Rows changed in the second of the previous export are sent again, load_barcode_changes ignores rows that
+        are already up to date
+        :param barcodes_database_file: filename of the barcode database, replaced if it exists
+        :param station: name of the station the changes are for
+        :return: (changed, removed) barcode counts
+        """
+        since = self.sync_watermark(station) or ''
+        until = timestamp()
+        if os.path.exists(barcodes_database_file):
+            os.remove(barcodes_database_file)
+        self.conn.commit()
+        self.c.execute("ATTACH DATABASE ? AS export", (barcodes_database_file,))
+        try:
+            self.c.execute("PRAGMA export.journal_mode = OFF")
+            self.c.execute("PRAGMA export.synchronous = OFF")
+            self.c.execute('CREATE TABLE export.products('
+                           'barcode TEXT, '
+                           'product_code TEXT, '
+                           'last_update NUMERIC, '
+                           'primary_code NUMERIC)')
+            self.c.execute('CREATE TABLE export.deleted_products('
+                           'barcode TEXT, '
+                           'deleted_at TEXT)')
+            self.c.execute("INSERT INTO export.products "
+                           "SELECT barcode, product_code, last_update, primary_code "
+                           "FROM main.products "
+                           "WHERE last_update >= ?",
+                           (since,))
+            changed = self.c.rowcount
+            self.c.execute("INSERT INTO export.deleted_products "
+                           "SELECT barcode, deleted_at "
+                           "FROM main.deleted_products "
+                           "WHERE deleted_at >= ?",
+                           (since,))
+            removed = self.c.rowcount
+            self.c.execute("INSERT OR REPLACE INTO main.sync_watermarks "
+                           "VALUES(?,?)",
+                           (station, until,))
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            self.c.execute("DETACH DATABASE export")
+            os.remove(barcodes_database_file)
+            raise
+        self.c.execute("DETACH DATABASE export")
+        return changed, removed
+
+    @timed('storage.load_barcode_changes')
+    def load_barcode_changes(self, barcodes_database_file):
+        """
+        Merges changes written by export_barcode_changes on another station, in one transaction
+        A barcode is added or updated unless it was changed or removed here more recently, and removed unless it
+        was changed here more recently. Merged changes are stamped with the time of the merge, so they are passed
+        on to other stations, and changes this database already has are ignored
+        :param barcodes_database_file: filename of the barcode database
+        :return: (changed, removed) barcode counts
+        """
+        if not os.path.exists(barcodes_database_file):
+            raise FileNotFoundError(barcodes_database_file)
+        now = timestamp()
+        self.conn.commit()
+        self.c.execute("ATTACH DATABASE ? AS source", (barcodes_database_file,))
+        try:
+            self.c.execute("INSERT INTO main.products "
+                           "SELECT s.barcode, s.product_code, ?, s.primary_code "
+                           "FROM source.products AS s "
+                           "LEFT JOIN main.products AS p ON p.barcode = s.barcode "
+                           "LEFT JOIN main.deleted_products AS d ON d.barcode = s.barcode "
+                           "WHERE s.barcode IS NOT NULL AND s.barcode != '' "
+                           "AND ((p.barcode IS NULL AND (d.deleted_at IS NULL OR d.deleted_at <= s.last_update)) "
+                           "OR ((p.product_code IS NOT s.product_code OR p.primary_code IS NOT s.primary_code) "
+                           "AND p.last_update <= s.last_update)) "
+                           "ON CONFLICT(barcode) DO UPDATE SET product_code = excluded.product_code, "
+                           "last_update = excluded.last_update, primary_code = excluded.primary_code",
+                           (now,))
+            changed = self.c.rowcount
+            self.clear_tombstones()
+            self.c.execute("INSERT OR IGNORE INTO main.deleted_products "
+                           "SELECT s.barcode, ? "
+                           "FROM source.deleted_products AS s "
+                           "LEFT JOIN main.products AS p ON p.barcode = s.barcode "
+                           "WHERE p.barcode IS NULL OR p.last_update <= s.deleted_at",
+                           (now,))
+            self.c.execute("DELETE FROM main.products "
+                           "WHERE barcode IN (SELECT barcode FROM main.deleted_products WHERE deleted_at = ?)",
+                           (now,))
+            removed = self.c.rowcount
+            if changed or removed:
+                self.barcodes.changed(self.c)
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        finally:
+            self.c.execute("DETACH DATABASE source")
+        self.barcodes.invalidate()
+        return changed, removed
+
+    def product_pages(self, product_code_prefix='', page_size=REPORT_PAGE_SIZE):
+        """
+        Reads the products linked to a barcode a page at a time, ordered by product code and barcode
+        Each page is a query on the product code index that starts after the last row of the previous page, so the
+        time and memory a page takes don't grow with the table, and no read is held open between pages
+        :param product_code_prefix: only products whose product code starts with this
+        :param page_size: rows per page
+        :return: generator of lists of (barcode, product code, last update, primary code) rows
+        """
+        prefix = product_code_prefix.upper()
+        last = (prefix, '')
+        while True:
+            self.c.execute("SELECT barcode, product_code, last_update, primary_code "
+                           "FROM products "
+                           "WHERE product_code >= ? AND product_code < ? AND (product_code, barcode) > (?, ?) "
+                           "ORDER BY product_code, barcode "
+                           "LIMIT ?",
+                           (last[0], prefix_end(prefix), last[0], last[1], page_size,))
+            page = self.c.fetchall()
+            if not page:
+                return
+            yield page
+            last = (page[-1][1], page[-1][0])
+
+    # orders
+
+    def order_exists(self, order_number):
+        self.c.execute("SELECT count(*) "
+                       "FROM orders "
+                       "WHERE order_number = ?",
+                       (order_number,))
+        return self.c.fetchone()[0] != 0
+
+    @timed('storage.resolve_order')
+    def resolve_order(self, ref):
+        """
+        Finds the orders matching a delivery reference (e.g. SJ532017) or a customer order number (e.g. 40408133)
+        in one query, on the delivery reference index and the primary key. Delivery references take precedence
+        :param ref: delivery reference or customer order number
+        :return: list of matching customer order numbers, more than one if the delivery reference is linked to
+        multiple orders
+        """
+        ref = ref.strip().upper()
+        self.c.execute("SELECT order_number, internal_reference = ? "
+                       "FROM orders "
+                       "WHERE internal_reference = ? OR order_number = ?",
+                       (ref, ref, ref,))
+        matches = self.c.fetchall()
+        by_delivery_ref = [order_number for order_number, is_delivery_ref in matches if is_delivery_ref]
+        return by_delivery_ref or [order_number for order_number, _ in matches]
+
+    @timed('storage.search_orders')
+    def search_orders(self, text, limit=ORDER_SEARCH_LIMIT):
+        """
+        Finds orders from part of a delivery reference or customer order number, e.g. as the user types
+        :param text: start or part of a delivery reference or customer order number
+        :param limit: most orders to return
+        :return: (customer order number, delivery reference) of the matching orders, those starting with the text
+        first
+        """
+        text = text.strip().upper()
+        if not text:
+            return []
+        return self.order_index.search(self.c, text, limit)
+
+    def order_summary_pages(self, outstanding_only=False, page_size=REPORT_PAGE_SIZE):
+        """
+        Reads the per-order totals kept in order_summary by the triggers on scanned_products, a page at a time,
+        each page starting after the last row of the previous one
+        :param outstanding_only: if True, only orders with units short or over, largest discrepancy first,
+        otherwise every order ordered by customer order number
+        :param page_size: rows per page
+        :return: generator of lists of (customer order number, delivery reference, lines, lines matched,
+        units short, units over) rows, with zero totals for orders without lines
+        """
+        last = None
+        while True:
+            if outstanding_only:
+                # the upper bound on the discrepancy seeks the index, the row value skips the orders already read
+                self.c.execute("SELECT s.order_number, o.internal_reference, s.lines, s.lines_matched, "
+                               "s.units_short, s.units_over "
+                               "FROM order_summary AS s "
+                               "JOIN orders AS o ON o.order_number = s.order_number "
+                               "WHERE s.units_short + s.units_over BETWEEN 1 AND ? "
+                               "AND (s.units_short + s.units_over, s.order_number) < (?, ?) "
+                               "ORDER BY s.units_short + s.units_over DESC, s.order_number DESC "
+                               "LIMIT ?",
+                               (sys.maxsize, sys.maxsize, sys.maxsize, page_size,) if last is None else
+                               (last[4] + last[5], last[4] + last[5], last[0], page_size,))
+            else:
+                self.c.execute("SELECT o.order_number, o.internal_reference, coalesce(s.lines, 0), "
+                               "coalesce(s.lines_matched, 0), coalesce(s.units_short, 0), coalesce(s.units_over, 0) "
+                               "FROM orders AS o "
+                               "LEFT JOIN order_summary AS s ON s.order_number = o.order_number "
+                               "WHERE o.order_number > ? "
+                               "ORDER BY o.order_number ASC "
+                               "LIMIT ?",
+                               (-sys.maxsize if last is None else last[0], page_size,))
+            page = self.c.fetchall()
+            if not page:
+                return
+            yield page
+            last = page[-1]
+
+    @timed('storage.order_summary')
+    def order_summary(self, order_number):
+        """
+        :param order_number: customer order number
+        :return: (lines, lines matched, units short, units over) of the order
+        """
+        self.c.execute("SELECT lines, lines_matched, units_short, units_over "
+                       "FROM order_summary "
+                       "WHERE order_number = ?",
+                       (order_number,))
+        return self.c.fetchone() or (0, 0, 0, 0)
+
+    @timed('storage.add_order')
+    def add_order(self, order_number, delivery_ref):
+        self.c.execute("INSERT INTO orders "
+                       "VALUES(?,?)",
+                       (order_number, delivery_ref))
+        self.order_index.invalidate()
+
+    @timed('storage.remove_order')
+    def remove_order(self, order_number):
+        """
+        Removes an order, its scan events and, through the foreign key cascade, its scanned products
+        :param order_number: customer order number
+        :return: True if removed, False if the order is not in the database
+        """
+        self.c.execute("DELETE FROM orders "
+                       "WHERE order_number = ?", (order_number,))
+        removed = self.c.rowcount != 0
+        if removed:
+            self.c.execute("DELETE FROM scan_events "
+                           "WHERE order_number = ?", (order_number,))
+            # the order number may be the text typed by the user, which sqlite matched as a number
+            self.order_index.invalidate()
+        self.conn.commit()
+        return removed
+
+    @timed('storage.order_lines')
+    def order_lines(self, order_number):
+        """
+        :param order_number: customer order number
+        :return: (product code, expected quantity, scanned quantity) rows of the order, ordered by product code
+        """
+        self.c.execute("SELECT product_code, expected_quantity, scanned_quantity "
+                       "FROM scanned_products "
+                       "WHERE order_number = ? "
+                       "ORDER BY product_code ASC", (order_number,))
+        return self.c.fetchall()
+
+    @timed('storage.order_snapshot')
+    def order_snapshot(self, order_number):
+        """
+        :param order_number: customer order number
+        :return: OrderSnapshot of the order, rows ordered by product code
+        """
+        self.c.execute("SELECT product_code, expected_quantity, scanned_quantity "
+                       "FROM scanned_products "
+                       "WHERE order_number = ? "
+                       "ORDER BY product_code ASC", (order_number,))
+        return OrderSnapshot.from_rows(self.c)
+
+    def order_line_pages(self, order_number, discrepancies_only=False, page_size=REPORT_PAGE_SIZE):
+        """
+        Reads the lines of an order a page at a time, ordered by product code, each page starting after the last
+        row of the previous one
+        :param order_number: customer order number
+        :param discrepancies_only: if True, only lines where the scanned quantity differs from the expected quantity
+        :param page_size: rows per page
+        :return: generator of lists of (product code, expected quantity, scanned quantity, difference) rows
+        """
+        last_product_code = ''
+        while True:
+            self.c.execute("SELECT product_code, expected_quantity, scanned_quantity, "
+                           "scanned_quantity - expected_quantity "
+                           "FROM scanned_products "
+                           "WHERE order_number = ? AND product_code > ? " +
+                           ("AND scanned_quantity != expected_quantity " if discrepancies_only else "") +
+                           "ORDER BY product_code ASC "
+                           "LIMIT ?",
+                           (order_number, last_product_code, page_size,))
+            page = self.c.fetchall()
+            if not page:
+                return
+            yield page
+            last_product_code = page[-1][0]
+
+    def order_product_codes(self, order_number):
+        self.c.execute("SELECT product_code "
+                       "FROM scanned_products "
+                       "WHERE order_number = ?",
+                       (order_number,))
+        return {row[0] for row in self.c}
+
+    @timed('storage.add_order_lines')
+    def add_order_lines(self, order_number, lines, add_existing=True):
+        """
+        Adds the line items of an order PDF to scanned_products in one statement
+        :param order_number: customer order number, must already be in the orders table
+        :param lines: (product code, supplied quantity) tuples from parse_order_lines
+        :param add_existing: if True, quantities of products already on the order are added to their supplied
+        quantity, otherwise those products are left unchanged
+        :return:
+        """
+        if add_existing:
+            self.c.executemany("INSERT INTO scanned_products "
+                               "VALUES(?,?,?,0) "
+                               "ON CONFLICT(order_number, product_code) "
+                               "DO UPDATE SET expected_quantity = expected_quantity + excluded.expected_quantity",
+                               [(order_number, product_code, quantity) for product_code, quantity in lines])
+        else:
+            self.c.executemany("INSERT OR IGNORE INTO scanned_products "
+                               "VALUES(?,?,?,0)",
+                               [(order_number, product_code, quantity) for product_code, quantity in lines])
+
+    @timed('storage.set_expected_quantity')
+    def set_expected_quantity(self, order_number, product_code, quantity):
+        """
+        Sets the supplied quantity of a product on an order, adding the product to the order if it is not on it
+        :return:
+        """
+        self.c.execute("INSERT INTO scanned_products "
+                       "VALUES(?,?,?,0) "
+                       "ON CONFLICT(order_number, product_code) "
+                       "DO UPDATE SET expected_quantity = excluded.expected_quantity",
+                       (order_number, product_code, quantity,))
+        self.conn.commit()
+
+    def is_on_order(self, order_number, product_code):
+        self.c.execute("SELECT count(*) "
+                       "FROM scanned_products "
+                       "WHERE order_number = ? AND product_code = ?",
+                       (order_number, product_code,))
+        return self.c.fetchone()[0] != 0
+
+    def scan_session(self, order_number, station=None):
+        """
+        :param order_number: customer order number
+        :param station: name the scans are recorded under, STATION if None
+        :return: ScanSession for scanning products of the order
+        """
+        return ScanSession(self.c, self.conn, order_number, station, barcodes=self.barcodes)
+
+    def scan_events(self, order_number, limit=None):
+        """
+        :param order_number: customer order number
+        :param limit: number of most recent events to return, or None for all of them
+        :return: (id, product code, quantity, station, scanned at, id of the event undone) rows of the order's scan
+        events, most recent first
+        """
+        self.c.execute("SELECT id, product_code, quantity, station, scanned_at, undoes "
+                       "FROM scan_events "
+                       "WHERE order_number = ? "
+                       "ORDER BY id DESC "
+                       "LIMIT ?",
+                       (order_number, -1 if limit is None else limit,))
+        return self.c.fetchall()
+
+    @timed('storage.replay_scans')
+    def replay_scans(self, order_number=None):
+        """
+        Rebuilds the scanned quantities of an order, or of every order, from the scan event log
+        :param order_number: customer order number, or None for every order
+        :return: (order number, product code, scanned quantity before, scanned quantity after) of each line that
+        was corrected
+        """
+        where = "" if order_number is None else "WHERE order_number = ? "
+        parameters = () if order_number is None else (order_number,)
+        begin_write(self.conn)
+        try:
+            apply_scan_events(self.c)
+            self.c.execute("SELECT order_number, product_code, scanned_quantity "
+                           "FROM scanned_products " + where,
+                           parameters)
+            before = {(row[0], row[1]): row[2] for row in self.c}
+            self.c.execute("SELECT order_number, product_code, sum(quantity) "
+                           "FROM scan_events " + where +
+                           "GROUP BY order_number, product_code",
+                           parameters)
+            replayed = {(row[0], row[1]): row[2] for row in self.c}
+            corrections = [(line[0], line[1], scanned_quantity, replayed.get(line, 0))
+                           for line, scanned_quantity in before.items() if replayed.get(line, 0) != scanned_quantity]
+            self.c.executemany("UPDATE scanned_products "
+                               "SET scanned_quantity = ? "
+                               "WHERE order_number = ? AND product_code = ?",
+                               [(after, order, product_code) for order, product_code, _, after in corrections])
+        except BaseException:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+        return corrections
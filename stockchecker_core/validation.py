@@ -0,0 +1,87 @@
+"""
+Product code and delivery reference validation
+Formats are precompiled once per supplier, and codes can be validated one at a time or a whole list/column at once
+"""
+import re
+
+# Formats used by each supplier, matched against the whole string
+SUPPLIER_FORMATS = {
+    'jaycar': {
+        # 2 letters followed by 4 numbers, e.g. AA0001
+        'product_code': '[a-zA-Z]{2}[0-9]{4}',
+        # 2 letters followed by 6 numbers, e.g. SJ532017
+        'delivery_reference': '[a-zA-Z]{2}[0-9]{6}',
+    },
+}
+DEFAULT_SUPPLIER = 'jaycar'
+
+
+class CodeValidator:
+    """
+    Precompiled product code and delivery reference formats of a supplier
+    """
+    def __init__(self, product_code, delivery_reference):
+        self.product_code_pattern = product_code
+        self.product_code_regex = re.compile(product_code)
+        self.delivery_reference_regex = re.compile(delivery_reference)
+
+    @classmethod
+    def for_supplier(cls, supplier=DEFAULT_SUPPLIER):
+        """
+        :param supplier: key of SUPPLIER_FORMATS
+        :return: CodeValidator for the formats of the supplier
+        """
+        return cls(**SUPPLIER_FORMATS[supplier])
+
+    def is_product_code(self, p_code):
+        """
+        :param p_code: string to validate
+        :return: boolean (True or False)
+        """
+        return self.product_code_regex.fullmatch(p_code) is not None
+
+    def is_delivery_reference(self, ref):
+        """
+        :param ref: string to validate
+        :return: boolean (True or False)
+        """
+        return self.delivery_reference_regex.fullmatch(ref) is not None
+
+    def validate_product_codes(self, codes):
+        """
+        Validates a list of product codes
+        :param codes: iterable of product codes, non-string values are rejected
+        :return: (list of valid codes uppercased, list of rejected values)
+        """
+        fullmatch = self.product_code_regex.fullmatch
+        valid = []
+        rejects = []
+        for code in codes:
+            if isinstance(code, str) and fullmatch(code):
+                valid.append(code.upper())
+            else:
+                rejects.append(code)
+        return valid, rejects
+
+    def validate_product_code_column(self, column):
+        """
+        Validates a pandas Series of product codes in one vectorised pass
+        :param column: Series of product codes, values are converted to strings first
+        :return: (Series of valid codes uppercased, Series of rejected values), both keep the index of column
+        """
+        codes = column.astype(str)
+        valid = codes.str.fullmatch(self.product_code_pattern)
+        return codes[valid].str.upper(), column[~valid]
+
+
+validator = CodeValidator.for_supplier(DEFAULT_SUPPLIER)
+
+
+def pn_regex_check(p_code):
+    """
+    Verify that the provided string uses the valid formatting for a product code
+    Formatting is set by the supplier of the validator, 2 letters followed by 4 numbers for Jaycar
+    :param p_code: string to validate
+    :return: boolean (True or False)
+    """
+    return validator.is_product_code(p_code)